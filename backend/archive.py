@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Archive of finished transcripts with a full-text index over their segments
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from config import ARCHIVE_PATH, SHARED_FS
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Most hits a single search returns
+MAX_SEARCH_LIMIT = 500
+
+# Orders search hits can be returned in. "rank" scores every match, "newest"
+# walks the index backwards and stops at the limit, so it stays fast for
+# words that occur in a large share of the archive.
+SEARCH_ORDERS = {
+    "rank": "rank",
+    "newest": "segments_index.rowid DESC",
+}
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS recordings ("
+    " id TEXT PRIMARY KEY,"
+    " name TEXT,"
+    " model TEXT,"
+    " language TEXT,"
+    " duration REAL NOT NULL,"
+    " segment_count INTEGER NOT NULL,"
+    " created_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS segments ("
+    " id INTEGER PRIMARY KEY,"
+    " recording_id TEXT NOT NULL,"
+    " position INTEGER NOT NULL,"
+    " start REAL NOT NULL,"
+    " end REAL NOT NULL,"
+    " text TEXT NOT NULL,"
+    " piece REAL NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS segments_recording ON segments (recording_id, position)",
+    # External content: the index stores only tokens, the text stays in segments.
+    # Prefix indexes make "meet*" style queries as cheap as whole words.
+    "CREATE VIRTUAL TABLE IF NOT EXISTS segments_index USING fts5("
+    " text, content='segments', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # Keep the index in step with the segments table
+    "CREATE TRIGGER IF NOT EXISTS segments_insert AFTER INSERT ON segments BEGIN"
+    " INSERT INTO segments_index (rowid, text) VALUES (new.id, new.text);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS segments_delete AFTER DELETE ON segments BEGIN"
+    " INSERT INTO segments_index (segments_index, rowid, text) VALUES ('delete', old.id, old.text);"
+    " END",
+]
+
+
+class ArchiveError(Exception):
+    """Raised for a search the index cannot run, such as invalid query syntax"""
+
+
+class TranscriptArchive:
+    """SQLite archive of transcripts, searchable through an FTS5 index"""
+
+    def __init__(self, path: str = ARCHIVE_PATH):
+        """
+        Initialize the archive
+
+        Args:
+            path: Path to the SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Other backend processes may be writing the same file
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL needs shared memory, which hosts sharing a network filesystem don't have
+        self._conn.execute(f"PRAGMA journal_mode={'DELETE' if SHARED_FS else 'WAL'}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        # Archives created before recordings could be uploaded in pieces
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(segments)")]
+        if "piece" not in columns:
+            self._conn.execute("ALTER TABLE segments ADD COLUMN piece REAL NOT NULL DEFAULT 0")
+
+    def add(self, result: Dict[str, Any], recording_id: Optional[str] = None,
+            name: Optional[str] = None, model: Optional[str] = None, offset: float = 0.0) -> str:
+        """
+        Archive and index a transcript, replacing an earlier one with the same ID
+
+        A recording uploaded in pieces is archived piece by piece: each piece
+        is filed under its offset and only replaces an earlier upload of the
+        same piece, so pieces can arrive in any order or at the same time,
+        and uploading one again does not duplicate it.
+
+        Args:
+            result: Transcriber result with segments and language, in recording time
+            recording_id: ID to file it under, a new one if None
+            name: Name of the recording, such as the uploaded file name
+            model: Model that transcribed it
+            offset: Seconds into the recording where this piece starts, 0 for a whole recording
+
+        Returns:
+            str: The recording ID
+        """
+        recording_id = recording_id or uuid.uuid4().hex
+        segments = result.get("segments") or []
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM segments WHERE recording_id = ? AND piece = ?",
+                                   (recording_id, offset))
+                self._conn.executemany(
+                    "INSERT INTO segments (recording_id, position, start, end, text, piece)"
+                    " VALUES (?, 0, ?, ?, ?, ?)",
+                    [
+                        (recording_id, segment.get("start", 0.0), segment.get("end", 0.0),
+                         segment.get("text", ""), offset)
+                        for segment in segments
+                    ]
+                )
+                # Number the segments in recording time, whatever order the pieces came in
+                ids = self._conn.execute(
+                    "SELECT id FROM segments WHERE recording_id = ? ORDER BY start, id", (recording_id,)
+                ).fetchall()
+                self._conn.executemany("UPDATE segments SET position = ? WHERE id = ?",
+                                       [(position, row[0]) for position, row in enumerate(ids)])
+                segment_count, duration = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(MAX(end), 0) FROM segments WHERE recording_id = ?", (recording_id,)
+                ).fetchone()
+                # The piece at offset 0 names the recording, the others keep its name and creation time
+                self._conn.execute(
+                    "INSERT INTO recordings (id, name, model, language, duration, segment_count, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (id) DO UPDATE SET"
+                    " model = excluded.model, language = excluded.language,"
+                    " duration = excluded.duration, segment_count = excluded.segment_count"
+                    + ("" if offset > 0 else ", name = excluded.name, created_at = excluded.created_at"),
+                    (recording_id, name, model, result.get("language"), duration, segment_count, time.time())
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return recording_id
+
+    def search(self, query: str, limit: int = 50, offset: int = 0,
+               recording_id: Optional[str] = None, order: str = "rank") -> List[Dict[str, Any]]:
+        """
+        Find segments matching a full-text query
+
+        Args:
+            query: FTS5 query, e.g. words, "a phrase", prefix* or NEAR(a b)
+            limit: Most hits to return, capped at MAX_SEARCH_LIMIT
+            offset: Hits to skip, for paging
+            recording_id: Only search this recording
+            order: "rank" for best matches first, "newest" for the most recently archived first
+
+        Returns:
+            List[Dict]: Hits with the recording, segment position, start, end, text and a highlighted snippet
+
+        Raises:
+            ArchiveError: If the query is not valid FTS5 syntax or the order is unknown
+        """
+        if order not in SEARCH_ORDERS:
+            raise ArchiveError(f"Unknown order: {order}, expected one of {', '.join(SEARCH_ORDERS)}")
+
+        sql = (
+            "SELECT s.recording_id, r.name, s.position, s.start, s.end, s.text,"
+            " snippet(segments_index, 0, '[', ']', '...', 16)"
+            " FROM segments_index"
+            " JOIN segments s ON s.id = segments_index.rowid"
+            " JOIN recordings r ON r.id = s.recording_id"
+            " WHERE segments_index MATCH ?"
+        )
+        params: List[Any] = [query]
+        if recording_id is not None:
+            sql += " AND s.recording_id = ?"
+            params.append(recording_id)
+        sql += f" ORDER BY {SEARCH_ORDERS[order]} LIMIT ? OFFSET ?"
+        params += [max(1, min(limit, MAX_SEARCH_LIMIT)), max(offset, 0)]
+
+        try:
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ArchiveError(f"Invalid search query: {str(e)}")
+
+        return [
+            {
+                "recording_id": row[0],
+                "name": row[1],
+                "segment": row[2],
+                "start": row[3],
+                "end": row[4],
+                "text": row[5],
+                "snippet": row[6],
+            }
+            for row in rows
+        ]
+
+    def get(self, recording_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an archived transcript
+
+        Returns:
+            Optional[Dict]: The recording's details with text and segments, None if unknown
+        """
+        with self._lock:
+            recording = self._conn.execute(
+                "SELECT id, name, model, language, duration, segment_count, created_at"
+                " FROM recordings WHERE id = ?", (recording_id,)
+            ).fetchone()
+            if recording is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT position, start, end, text FROM segments WHERE recording_id = ? ORDER BY position",
+                (recording_id,)
+            ).fetchall()
+
+        segments = [{"id": row[0], "start": row[1], "end": row[2], "text": row[3]} for row in rows]
+        return {
+            "recording_id": recording[0],
+            "name": recording[1],
+            "model": recording[2],
+            "language": recording[3],
+            "duration": recording[4],
+            "segment_count": recording[5],
+            "created_at": recording[6],
+            "text": " ".join(segment["text"] for segment in segments),
+            "segments": segments,
+        }
+
+    def delete(self, recording_id: str) -> bool:
+        """
+        Remove a transcript and its index entries
+
+        Returns:
+            bool: False if the recording was not archived
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM segments WHERE recording_id = ?", (recording_id,))
+                deleted = self._conn.execute("DELETE FROM recordings WHERE id = ?", (recording_id,)).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted > 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of archived recordings, segments and hours"""
+        with self._lock:
+            recordings, hours = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(duration), 0) / 3600.0 FROM recordings"
+            ).fetchone()
+            segments = self._conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {
+            "path": self.path,
+            "recordings": recordings,
+            "segments": segments,
+            "hours": round(hours, 2),
+        }
+
+
+def open_archive(path: str = ARCHIVE_PATH) -> Optional[TranscriptArchive]:
+    """Open the archive, None if it is disabled or cannot be opened"""
+    if not path:
+        return None
+    try:
+        return TranscriptArchive(path)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to open transcript archive: {str(e)}")
+        return None
+
+
+if __name__ == "__main__":
+    # Simple test: index a large synthetic archive and time a few searches
+    import random
+    import tempfile
+
+    # A vocabulary with a Zipf-like spread, so some words are everywhere and most are rare
+    words = ["the", "and", "we", "meeting", "budget", "launch", "revenue", "deadline"] + \
+        [f"word{i}" for i in range(5000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        archive = TranscriptArchive(os.path.join(directory, "archive.db"))
+        started = time.perf_counter()
+        for index in range(200):
+            # An hour of five-second segments per recording
+            segments = [
+                {"start": i * 5.0, "end": i * 5.0 + 5.0, "text": " ".join(rng.choices(words, weights, k=12))}
+                for i in range(720)
+            ]
+            archive.add({"segments": segments, "language": "en"}, f"rec{index}", name=f"meeting {index}")
+        archive.add({"segments": [{"start": 12.0, "end": 15.5, "text": "the zebra migration plan"}]}, "needle")
+        print(f"Indexed {archive.stats()} in {time.perf_counter() - started:.1f}s")
+
+        queries = [("zebra", "rank"), ('"migration plan"', "rank"), ("zeb*", "rank"), ("word42", "rank"),
+                   ("budget AND deadline", "rank"), ("NEAR(launch revenue, 5)", "rank"), ("the", "newest")]
+        for query, order in queries:
+            started = time.perf_counter()
+            hits = archive.search(query, limit=10, order=order)
+            print(f"{query!r} by {order}: {len(hits)} hits in {(time.perf_counter() - started) * 1000:.1f}ms, "
+                  f"first {hits[0]['recording_id']} at {hits[0]['start']}s: {hits[0]['snippet']}")
+
+        assert archive.search("zebra")[0]["recording_id"] == "needle"
+        assert archive.delete("needle") and not archive.search("zebra")
+
+        # A recording uploaded in three pieces arriving out of order, one of them twice
+        for offset in (1200.0, 600.0, 0.0, 600.0):
+            archive.add({"segments": [{"start": offset + 1.0, "end": offset + 4.0, "text": f"piece at {offset:g}"}]},
+                        "pieces", name=f"part at {offset:g}", offset=offset)
+        pieces = archive.get("pieces")
+        assert [s["text"] for s in pieces["segments"]] == ["piece at 0", "piece at 600", "piece at 1200"]
+        assert [s["id"] for s in pieces["segments"]] == [0, 1, 2]
+        assert pieces["name"] == "part at 0" and pieces["duration"] == 1204.0
+        try:
+            archive.search('"unbalanced')
+        except ArchiveError as e:
+            print(e)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Decode uploaded audio to the 16 kHz mono PCM whisper expects
+"""
+import io
+import logging
+import shutil
+import subprocess
+from typing import Optional, Union
+
+import numpy as np
+import soundfile as sf
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Sample rate whisper expects
+SAMPLE_RATE = 16000
+
+# Taps on each side of the resampling low-pass filter
+RESAMPLE_HALF_TAPS = 64
+
+
+class AudioDecodeError(Exception):
+    """Raised when audio cannot be decoded"""
+
+
+def ffmpeg_available() -> bool:
+    """Check if ffmpeg is on the PATH"""
+    return shutil.which("ffmpeg") is not None
+
+
+def detect_format(header: bytes) -> Optional[str]:
+    """
+    Recognize an audio container from the first bytes of a file
+
+    Args:
+        header: At least the first 12 bytes of the file
+
+    Returns:
+        Optional[str]: "wav", "flac", "ogg", "mp3", "mp4", or None if unknown
+    """
+    if header[:4] in (b"RIFF", b"RF64") and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    return None
+
+
+def is_whisper_native(audio_file: str) -> bool:
+    """Check if a file is already 16 kHz mono 16-bit PCM WAV"""
+    try:
+        info = sf.info(audio_file)
+    except (RuntimeError, sf.LibsndfileError):
+        return False
+    return info.format == "WAV" and info.subtype == "PCM_16" \
+        and info.samplerate == SAMPLE_RATE and info.channels == 1
+
+
+def audio_duration(audio_file: str) -> Optional[float]:
+    """Duration of an audio file in seconds from its header, None if unreadable"""
+    try:
+        info = sf.info(audio_file)
+    except (RuntimeError, sf.LibsndfileError):
+        return None
+    return info.frames / info.samplerate
+
+
+def lowpass(samples: np.ndarray, src_rate: int, dst_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Remove content above ~90% of the new Nyquist frequency before decimating"""
+    if dst_rate >= src_rate or len(samples) == 0:
+        return samples
+    cutoff = 0.45 * dst_rate / src_rate
+    taps = np.arange(-RESAMPLE_HALF_TAPS, RESAMPLE_HALF_TAPS + 1)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel.astype(np.float32), mode="same")
+
+
+def resample(samples: np.ndarray, src_rate: int, dst_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Resample mono audio with a windowed-sinc low-pass and linear interpolation
+
+    Args:
+        samples: Mono float32 samples
+        src_rate: Sample rate of samples
+        dst_rate: Target sample rate
+
+    Returns:
+        np.ndarray: Resampled float32 samples
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples.astype(np.float32, copy=False)
+
+    samples = lowpass(samples, src_rate, dst_rate)
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class AudioReader:
+    """
+    16 kHz mono view of an audio file that decodes only the slices asked for
+
+    Slicing it returns the same samples as slicing decode_audio()'s result,
+    but only the requested span (plus the resampling filter's margin) is
+    read, so a long recording is never held in memory as a whole.
+    """
+
+    def __init__(self, audio_file: str):
+        """
+        Initialize the reader
+
+        Args:
+            audio_file: Path to a file soundfile can read
+
+        Raises:
+            AudioDecodeError: If soundfile cannot read the file
+        """
+        try:
+            info = sf.info(audio_file)
+        except (RuntimeError, sf.LibsndfileError) as e:
+            raise AudioDecodeError(f"Unsupported audio format: {str(e)}")
+        self.audio_file = audio_file
+        self.sample_rate = info.samplerate
+        self.source_frames = info.frames
+        self.length = int(round(info.frames * SAMPLE_RATE / info.samplerate))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key: slice) -> np.ndarray:
+        start, end, step = key.indices(self.length)
+        if step != 1:
+            raise ValueError("AudioReader only supports contiguous slices")
+        return self.read(start, end)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """
+        Decode samples start to end of the 16 kHz mono signal
+
+        Args:
+            start: First 16 kHz sample
+            end: Sample after the last one
+
+        Returns:
+            np.ndarray: float32 samples
+        """
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        ratio = self.sample_rate / SAMPLE_RATE
+        # Enough source frames around the span for the filter and the interpolation
+        first = max(int(start * ratio) - RESAMPLE_HALF_TAPS - 1, 0)
+        last = min(int(np.ceil((end - 1) * ratio)) + RESAMPLE_HALF_TAPS + 2, self.source_frames)
+        try:
+            with sf.SoundFile(self.audio_file) as f:
+                f.seek(first)
+                data = f.read(last - first, dtype="float32", always_2d=True)
+        except (RuntimeError, sf.LibsndfileError) as e:
+            raise AudioDecodeError(f"Failed to read audio: {str(e)}")
+
+        mono = data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+        if self.sample_rate == SAMPLE_RATE:
+            return np.ascontiguousarray(mono[start - first:end - first], dtype=np.float32)
+        filtered = lowpass(mono, self.sample_rate)
+        positions = np.arange(start, end, dtype=np.float64) * ratio - first
+        return np.interp(positions, np.arange(len(filtered)), filtered).astype(np.float32)
+
+
+# Audio decoded in memory, or a reader that decodes slices of it on demand
+Samples = Union[np.ndarray, AudioReader]
+
+
+def _decode_ffmpeg(audio_file: str) -> np.ndarray:
+    """Decode any format ffmpeg understands straight to 16 kHz mono float32"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", audio_file,
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-"
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"ffmpeg failed to decode audio: {e.stderr.decode(errors='replace')}")
+    return np.frombuffer(result.stdout, dtype="<f4")
+
+
+def decode_audio(audio_file: str) -> np.ndarray:
+    """
+    Decode an audio file to 16 kHz mono float32
+
+    WAV at any rate or channel count, FLAC and OGG are decoded in-process.
+    Other formats such as MP3 are decoded by ffmpeg if it is installed.
+
+    Args:
+        audio_file: Path to the audio file
+
+    Returns:
+        np.ndarray: 16 kHz mono float32 samples
+
+    Raises:
+        AudioDecodeError: If the audio cannot be decoded
+    """
+    try:
+        samples, sample_rate = sf.read(audio_file, dtype="float32", always_2d=True)
+    except (RuntimeError, sf.LibsndfileError) as e:
+        if ffmpeg_available():
+            return _decode_ffmpeg(audio_file)
+        raise AudioDecodeError(f"Unsupported audio format: {str(e)}")
+
+    # Downmix, then bring to whisper's sample rate
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    return resample(mono, sample_rate, SAMPLE_RATE)
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Encode samples as a 16-bit PCM WAV file in memory"""
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def to_float32(samples: np.ndarray) -> np.ndarray:
+    """Samples as float32 in [-1, 1], scaling 16-bit PCM"""
+    if samples.dtype == np.int16:
+        return samples.astype(np.float32) / 32768.0
+    return np.asarray(samples, dtype=np.float32)
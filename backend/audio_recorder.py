@@ -2,13 +2,25 @@
 """
 Audio recorder module for macOS to capture system audio and microphone
 """
+import glob
 import os
+import shutil
 import subprocess
-import tempfile
 import logging
+import queue
+import threading
 import time
 import signal
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from config import (
+    RECORDER_BACKEND, RECORDER_BUFFER_SECONDS, RECORDER_SPILL_TO_DISK, RECORDER_FORMAT, RECORDER_SEGMENT_SECONDS,
+)
+from ring_buffer import RingBuffer
+from scratch import ScratchFullError, scratch
 
 # Setup logging
 logging.basicConfig(
@@ -17,12 +29,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Sample rate required by Whisper
+SAMPLE_RATE = 16000
+
+# File formats the recorder can encode to while capturing; the backend accepts both
+RECORDING_FORMATS = ("flac", "wav")
+
+# Whether SoX's 'rec' is on the PATH, looked up once
+_rec_available = None
+
+def rec_available() -> bool:
+    """Check if the SoX 'rec' command is available"""
+    global _rec_available
+    if _rec_available is None:
+        _rec_available = shutil.which("rec") is not None
+    return _rec_available
+
+def segment_path(path: str, index: int) -> str:
+    """Name of a numbered segment file, the way SoX's newfile effect names them: rec.flac -> rec001.flac"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}{index:03d}{ext}"
+
 class AudioRecorder:
     """Class to handle audio recording on macOS"""
     
-    def __init__(self):
+    def __init__(self, backend=RECORDER_BACKEND, buffer_seconds=RECORDER_BUFFER_SECONDS,
+                 spill_to_disk=RECORDER_SPILL_TO_DISK, format=RECORDER_FORMAT,
+                 segment_seconds=RECORDER_SEGMENT_SECONDS):
+        """
+        Initialize the recorder
+        
+        Args:
+            backend: "sox" to record with a SoX subprocess, or "sounddevice" to
+                capture in-process into a ring buffer
+            buffer_seconds: Seconds of recent audio kept in memory (sounddevice only)
+            spill_to_disk: Write all captured audio to the recording file as it
+                arrives (sounddevice only); otherwise only the buffered audio
+                is written when recording stops
+            format: "wav", or "flac" to compress losslessly while capturing
+            segment_seconds: Start a new numbered file every this many seconds,
+                0 for a single file (with sounddevice, only when spilling to disk)
+        """
+        self.backend = backend
+        self.buffer_seconds = buffer_seconds
+        self.spill_to_disk = spill_to_disk
+        self.format = format
+        self.segment_seconds = segment_seconds
         self.recording_process = None
-        self.output_file = None
+        self.output_path = None
+        # sounddevice capture state
+        self.stream = None
+        self.buffer: Optional[RingBuffer] = None
+        self._spill_queue = None
+        self._spill_thread = None
+    
+    @property
+    def is_recording(self) -> bool:
+        return self.recording_process is not None or self.stream is not None
     
     def start_recording(self) -> Tuple[bool, str]:
         """
@@ -32,46 +95,196 @@ class AudioRecorder:
             Tuple[bool, str]: Success status and message or file path
         """
         # Stop any existing recording
-        if self.recording_process is not None:
+        if self.is_recording:
             self.stop_recording()
         
-        # Create a temporary file for the recording
-        self.output_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        self.output_file.close()
+        if self.format not in RECORDING_FORMATS:
+            return False, f"Unsupported recording format: {self.format}, expected one of {', '.join(RECORDING_FORMATS)}"
+        
+        # Create a scratch file for the recording, swept up even if this process dies.
+        # When recording in segments, its name is the pattern for the numbered segment files.
+        try:
+            self.output_path = scratch.create(f".{self.format}")
+        except (ScratchFullError, OSError) as e:
+            return False, f"Failed to create the recording file: {str(e)}"
+        
+        if self.backend == "sounddevice":
+            return self._start_sounddevice()
         
         try:
             # Check if 'rec' command is available (part of SoX)
-            try:
-                subprocess.run(["which", "rec"], check=True, capture_output=True)
-            except subprocess.CalledProcessError:
+            if not rec_available():
                 return False, "SoX 'rec' command not found. Please install SoX: brew install sox"
             
             # Start recording both system audio and microphone on macOS
-            # This requires SoX and a virtual audio device like BlackHole for system audio
+            # This requires SoX and a virtual audio device like BlackHole for system audio.
+            # SoX picks the encoding from the file extension, FLAC is compressed as it is captured.
             cmd = [
                 "rec", 
                 "-r", "16000",  # Sample rate required by Whisper
                 "-c", "1",      # Mono audio
                 "-b", "16",     # 16-bit depth
-                self.output_file.name,
+                self.output_path,
                 "remix", "1,2"  # Mix all channels
             ]
+            if self.segment_seconds:
+                # Close the file every segment_seconds and continue in rec001.flac, rec002.flac, ...
+                cmd += ["trim", "0", f"{self.segment_seconds:g}", ":", "newfile", ":", "restart"]
             
-            logger.info(f"Starting recording to {self.output_file.name}")
+            logger.info(f"Starting recording to {self.output_path}")
             self.recording_process = subprocess.Popen(
                 cmd, 
                 stdout=subprocess.PIPE, 
                 stderr=subprocess.PIPE
             )
             
-            return True, self.output_file.name
+            return True, self.output_path
         
         except Exception as e:
             logger.error(f"Error starting recording: {str(e)}")
-            if self.output_file and os.path.exists(self.output_file.name):
-                os.unlink(self.output_file.name)
+            if self.output_path:
+                scratch.remove(self.output_path)
             return False, f"Failed to start recording: {str(e)}"
     
+    def _start_sounddevice(self) -> Tuple[bool, str]:
+        """
+        Start capturing into the ring buffer with sounddevice
+        
+        Returns:
+            Tuple[bool, str]: Success status and message or file path
+        """
+        try:
+            import sounddevice as sd
+        except (ImportError, OSError) as e:
+            scratch.remove(self.output_path)
+            return False, f"sounddevice is not available: {str(e)}"
+        
+        self.buffer = RingBuffer(int(self.buffer_seconds * SAMPLE_RATE))
+        
+        if self.spill_to_disk:
+            # The audio callback must not block on disk I/O, hand blocks to a writer thread
+            self._spill_queue = queue.Queue()
+            self._spill_thread = threading.Thread(
+                target=self._spill_writer,
+                args=(self._spill_queue, self.output_path, int(self.segment_seconds * SAMPLE_RATE)),
+                daemon=True
+            )
+            self._spill_thread.start()
+        
+        def callback(indata, frames, time_info, status):
+            if status:
+                logger.warning(f"Audio capture status: {status}")
+            samples = indata[:, 0]
+            self.buffer.write(samples)
+            if self._spill_queue is not None:
+                self._spill_queue.put(samples.copy())
+        
+        try:
+            self.stream = sd.InputStream(
+                samplerate=SAMPLE_RATE,
+                channels=1,
+                dtype="int16",
+                callback=callback
+            )
+            self.stream.start()
+        except Exception as e:
+            logger.error(f"Error starting recording: {str(e)}")
+            self.stream = None
+            self._stop_spill_writer()
+            scratch.remove(self.output_path)
+            return False, f"Failed to start recording: {str(e)}"
+        
+        logger.info(f"Started in-process recording to {self.output_path}")
+        return True, self.output_path
+    
+    @staticmethod
+    def _spill_writer(blocks: queue.Queue, path: str, segment_samples: int = 0):
+        """
+        Append captured blocks to the recording file until a None sentinel arrives
+        
+        Args:
+            blocks: Queue of int16 sample blocks
+            path: Recording file, its extension picks the format
+            segment_samples: Start a new numbered segment file after this many
+                samples, 0 to write everything to path
+        """
+        def open_file(name: str) -> sf.SoundFile:
+            return sf.SoundFile(name, mode="w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16")
+        
+        index = 1
+        written = 0
+        f = open_file(segment_path(path, index) if segment_samples else path)
+        try:
+            while True:
+                block = blocks.get()
+                if block is None:
+                    break
+                while segment_samples and written + len(block) > segment_samples:
+                    # Fill the segment to its exact length, so segment i starts at i * segment_seconds
+                    split = segment_samples - written
+                    f.write(block[:split])
+                    f.close()
+                    index += 1
+                    written = 0
+                    f = open_file(segment_path(path, index))
+                    block = block[split:]
+                f.write(block)
+                written += len(block)
+        finally:
+            f.close()
+    
+    def _stop_spill_writer(self):
+        """Flush pending blocks and close the spill file"""
+        if self._spill_thread is not None:
+            self._spill_queue.put(None)
+            self._spill_thread.join()
+        self._spill_queue = None
+        self._spill_thread = None
+    
+    def _stop_sounddevice(self) -> Tuple[bool, str]:
+        """
+        Stop the sounddevice capture and finalize the recording file
+        
+        Returns:
+            Tuple[bool, str]: Success status and message or file path
+        """
+        try:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+            
+            if self._spill_thread is not None:
+                self._stop_spill_writer()
+            else:
+                sf.write(self.output_path, self.buffer.read(0), SAMPLE_RATE, subtype="PCM_16")
+            
+            path = self.get_recording_file()
+            logger.info(f"Recording stopped, saved to {path}")
+            return True, path
+        
+        except Exception as e:
+            logger.error(f"Error stopping recording: {str(e)}")
+            return False, f"Failed to stop recording: {str(e)}"
+    
+    def get_audio(self, since: int = 0) -> Tuple[np.ndarray, int]:
+        """
+        Get audio captured so far, while recording is still in progress
+        
+        Only available with the sounddevice backend. Audio older than the
+        ring buffer's capacity is no longer available.
+        
+        Args:
+            since: Stream position returned by the previous call
+            
+        Returns:
+            Tuple[np.ndarray, int]: 16 kHz mono int16 samples and the
+            position to pass to the next call
+        """
+        if self.buffer is None:
+            return np.zeros(0, dtype=np.int16), since
+        end = self.buffer.written
+        return self.buffer.read(since, end), end
+    
     def stop_recording(self) -> Tuple[bool, str]:
         """
         Stop the current recording
@@ -79,6 +292,9 @@ class AudioRecorder:
         Returns:
             Tuple[bool, str]: Success status and message or file path
         """
+        if self.stream is not None:
+            return self._stop_sounddevice()
+        
         if self.recording_process is None:
             return True, "No recording in progress"
         
@@ -94,9 +310,10 @@ class AudioRecorder:
             
             self.recording_process = None
             
-            if self.output_file and os.path.exists(self.output_file.name):
-                logger.info(f"Recording stopped, saved to {self.output_file.name}")
-                return True, self.output_file.name
+            path = self.get_recording_file()
+            if path:
+                logger.info(f"Recording stopped, saved to {path}")
+                return True, path
             else:
                 return False, "Recording file not found"
         
@@ -109,23 +326,53 @@ class AudioRecorder:
         Get the path to the current recording file
         
         Returns:
-            Optional[str]: Path to the recording file or None
+            Optional[str]: Path to the recording file, the newest segment when
+            recording in segments, or None
         """
-        if self.output_file and os.path.exists(self.output_file.name):
-            return self.output_file.name
+        segments = self._segment_files()
+        if segments:
+            return segments[-1]
+        if self.output_path and os.path.exists(self.output_path):
+            # In segment mode it is only the name pattern until something is written to it
+            if not self.segment_seconds or os.path.getsize(self.output_path) > 0:
+                return self.output_path
         return None
     
+    def _segment_files(self) -> List[str]:
+        """Segment files written so far, in recording order"""
+        if not self.segment_seconds or not self.output_path:
+            return []
+        stem, ext = os.path.splitext(self.output_path)
+        return sorted(glob.glob(f"{glob.escape(stem)}[0-9][0-9][0-9]{ext}"))
+    
+    def get_segments(self) -> List[Tuple[str, float]]:
+        """
+        Get the segment files that are complete, while recording is still in progress
+        
+        Each one can be uploaded to /transcribe with its offset, which returns
+        timestamps in recording time and, with the same recording_id, adds it
+        to the archived recording.
+        
+        Returns:
+            List[Tuple[str, float]]: Path of each finished segment and the
+            second of the recording it starts at
+        """
+        segments = self._segment_files()
+        if self.is_recording:
+            # The newest one is still being written
+            segments = segments[:-1]
+        return [(path, index * self.segment_seconds) for index, path in enumerate(segments)]
+    
     def cleanup(self):
         """Clean up any temporary files"""
-        if self.recording_process is not None:
+        if self.is_recording:
             self.stop_recording()
         
-        if self.output_file and os.path.exists(self.output_file.name):
-            try:
-                os.unlink(self.output_file.name)
-                logger.info(f"Removed temporary file {self.output_file.name}")
-            except Exception as e:
-                logger.error(f"Error removing temporary file: {str(e)}")
+        for path in self._segment_files():
+            scratch.remove(path)
+        if self.output_path and os.path.exists(self.output_path):
+            scratch.remove(self.output_path)
+            logger.info(f"Removed temporary file {self.output_path}")
 
 # Singleton instance
 recorder = AudioRecorder()
@@ -142,6 +389,14 @@ def get_recording_file() -> Optional[str]:
     """Get the current recording file path"""
     return recorder.get_recording_file()
 
+def get_segments() -> List[Tuple[str, float]]:
+    """Get the finished segment files and their offsets"""
+    return recorder.get_segments()
+
+def get_audio(since: int = 0) -> Tuple[np.ndarray, int]:
+    """Get audio captured since a stream position"""
+    return recorder.get_audio(since)
+
 def cleanup():
     """Clean up resources"""
     recorder.cleanup()
@@ -153,11 +408,13 @@ def signal_handler(sig, frame):
     cleanup()
     exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+def install_signal_handlers():
+    """Stop recording on SIGINT/SIGTERM; only for scripts that own the process, not on import"""
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
 if __name__ == "__main__":
+    install_signal_handlers()
     # Simple test
     print("Starting recording for 5 seconds...")
     success, message = start_recording()
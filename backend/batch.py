@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Batch transcription of many files with JSONL output and resume
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, TextIO, Tuple
+
+from audio_io import audio_duration
+from cancellation import CancelToken
+from dispatcher import Dispatcher, QueueFullError
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# File extensions picked up when transcribing a directory
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3", ".m4a")
+
+
+def find_audio_files(directory: str) -> List[str]:
+    """List audio files under a directory, recursively"""
+    return sorted(
+        str(path) for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+
+def longest_first(items: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Order (name, path) items by audio length, longest first
+
+    Starting the longest files first keeps one long file from running
+    alone at the end of the batch. Files whose header cannot be read are
+    ordered by size instead.
+    """
+    def length(item):
+        duration = audio_duration(item[1])
+        if duration is not None:
+            return duration
+        # Roughly 1 second per 32 kB of 16 kHz 16-bit audio
+        return os.path.getsize(item[1]) / 32000
+
+    return sorted(items, key=length, reverse=True)
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """Names of files already transcribed successfully in a JSONL output file"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption
+                continue
+            if record.get("success"):
+                completed.add(record.get("file"))
+    return completed
+
+
+class Batch:
+    """A set of files transcribed into one JSONL file"""
+
+    def __init__(self, items: List[Tuple[str, str]], output_path: str,
+                 remove_files: bool = False, batch_id: Optional[str] = None,
+                 update_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Initialize the batch
+
+        Args:
+            items: (name, path) of each file, name is recorded in the output
+            output_path: JSONL file results are appended to
+            remove_files: Delete each file after it is processed, for uploads
+            batch_id: ID of the batch, generated if not given
+            update_callback: Called with the status information whenever it
+                changes, e.g. to record it in the job store
+        """
+        self.id = batch_id or uuid.uuid4().hex
+        self.items = items
+        self.output_path = output_path
+        self.remove_files = remove_files
+        self.status = "queued"
+        self.total = len(items)
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.update_callback = update_callback
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Status information for this batch"""
+        return {
+            "batch_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "output_path": self.output_path,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+    async def run(self, dispatcher: Dispatcher, transcribe_func: Callable[..., Tuple[bool, Dict[str, Any]]],
+                  max_workers: int = 1, resume: bool = True, cancel: Optional[CancelToken] = None, **options):
+        """
+        Transcribe every file, longest first, appending one JSON line per file
+
+        Files go through the dispatcher like any other request, so a batch
+        shares its concurrency and queue limits instead of running beside them.
+
+        Args:
+            dispatcher: Dispatcher the files are transcribed on
+            transcribe_func: Blocking function that transcribes a file, like ModelRegistry.transcribe
+            max_workers: Number of files handed to the dispatcher at the same time
+            resume: Skip files already transcribed successfully in the output file
+            cancel: Token that stops the batch; files it stops are left out of
+                the output, so resuming transcribes them again
+            **options: Extra keyword arguments for transcribe_func, such as the model
+        """
+        cancel = cancel if cancel is not None else CancelToken()
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            await asyncio.to_thread(self._update)
+            os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+            completed = await asyncio.to_thread(load_completed, self.output_path) if resume else set()
+            pending = []
+            for name, path in self.items:
+                if name in completed:
+                    self.skipped += 1
+                    self._remove(path)
+                else:
+                    pending.append((name, path))
+
+            logger.info(f"Batch {self.id}: {len(pending)} files to transcribe, {self.skipped} already done")
+
+            queue = iter(await asyncio.to_thread(longest_first, pending))
+            with open(self.output_path, "a") as output:
+                async def process():
+                    # Each worker takes the next file until none are left
+                    for name, path in queue:
+                        if cancel.cancelled:
+                            break
+                        await self._process(output, name, path, dispatcher, transcribe_func, cancel, options)
+
+                workers = [asyncio.create_task(process()) for _ in range(max(max_workers, 1))]
+                try:
+                    await asyncio.gather(*workers)
+                except BaseException:
+                    for worker in workers:
+                        worker.cancel()
+                    raise
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Batch {self.id} failed: {str(e)}")
+            self.status = "failed"
+            self.error = str(e)
+        else:
+            self.status = "cancelled" if cancel.cancelled else "completed"
+            logger.info(f"Batch {self.id} {self.status}: {self.completed} completed, {self.failed} failed, "
+                        f"{self.skipped} skipped in {time.time() - self.started_at:.1f}s")
+        finally:
+            self.finished_at = time.time()
+            # Files a failed or cancelled batch never reached
+            for _, path in self.items:
+                self._remove(path)
+            await asyncio.to_thread(self._update)
+
+    async def _process(self, output: TextIO, name: str, path: str, dispatcher: Dispatcher,
+                       transcribe_func: Callable[..., Tuple[bool, Dict[str, Any]]], cancel: CancelToken,
+                       options: Dict[str, Any]):
+        """Transcribe one file and append its record"""
+        started = time.time()
+        try:
+            while True:
+                try:
+                    success, result = await dispatcher.run(transcribe_func, path, cancel=cancel, **options)
+                    break
+                except QueueFullError:
+                    # Direct /transcribe requests are using every slot, retry shortly
+                    await asyncio.sleep(0.5)
+        except Exception as e:
+            success, result = False, {"error": f"Transcription failed: {str(e)}"}
+        finally:
+            self._remove(path)
+
+        if result.get("cancelled"):
+            return
+        record = {"file": name, "success": success, "seconds": round(time.time() - started, 3)}
+        record.update(result)
+        output.write(json.dumps(record) + "\n")
+        # Flush every record so an interrupted batch can resume
+        output.flush()
+        if success:
+            self.completed += 1
+        else:
+            self.failed += 1
+        await asyncio.to_thread(self._update)
+
+    def fail(self, error: str):
+        """Mark the batch failed and remove the files it has not processed"""
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+        for _, path in self.items:
+            self._remove(path)
+        self._update()
+
+    def _update(self):
+        """Report the status information to the update callback"""
+        if self.update_callback is None:
+            return
+        try:
+            self.update_callback(self.to_dict())
+        except Exception as e:
+            logger.error(f"Error recording batch {self.id}: {str(e)}")
+
+    def _remove(self, path: str):
+        """Delete an uploaded file once it is processed"""
+        if not self.remove_files:
+            return
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing batch file {path}: {str(e)}")
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Benchmark transcription latency, real-time factor, throughput and memory
+
+Drives the in-process Transcriber and the HTTP /transcribe endpoint with
+synthetic speech-like audio (or your own files) at several lengths and
+concurrency levels, and writes the results as JSON so runs can be compared
+across commits.
+
+Run from the backend directory:
+    python bench/benchmark.py --stub --output bench-results.json
+    python bench/benchmark.py --mode http --url http://127.0.0.1:8000 --samples ~/recordings
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+BENCH_DIR = Path(__file__).parent.absolute()
+BACKEND_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from audio_io import SAMPLE_RATE, decode_audio, encode_wav  # noqa: E402
+
+STUB_WHISPER = BENCH_DIR / "stub_whisper.py"
+
+
+def make_stub_whisper_dir(directory: Path, model_name: str) -> Path:
+    """
+    Lay out a fake whisper.cpp checkout whose binaries are stub_whisper.py
+
+    Args:
+        directory: Where to create it
+        model_name: Model the backend will look for
+
+    Returns:
+        Path: The fake whisper.cpp directory
+    """
+    bin_dir = directory / "build" / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for name, mode in (("whisper-cli", "cli"), ("whisper-server", "server")):
+        wrapper = bin_dir / name
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_WHISPER}" {mode} "$@"\n')
+        wrapper.chmod(0o755)
+
+    model_dir = directory / "models"
+    model_dir.mkdir(parents=True, exist_ok=True)
+    (model_dir / f"ggml-{model_name}.bin").write_bytes(b"\0" * 1024)
+    return directory
+
+
+def synthetic_speech(seconds: float, seed: int = 0) -> np.ndarray:
+    """
+    Speech-like audio: bursts of modulated noise separated by short silences
+
+    The pauses give the chunker realistic split points.
+
+    Args:
+        seconds: Length of the audio
+        seed: Random seed, the same seed gives the same audio
+
+    Returns:
+        np.ndarray: 16 kHz mono float32 samples
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    samples = np.zeros(total, dtype=np.float32)
+    position = 0
+    while position < total:
+        burst = int(rng.uniform(1.0, 4.0) * SAMPLE_RATE)
+        end = min(position + burst, total)
+        t = np.arange(end - position) / SAMPLE_RATE
+        # Syllable-rate envelope over band-limited noise
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3.0, 5.0) * t))
+        noise = np.convolve(rng.standard_normal(end - position), np.ones(8) / 8, mode="same")
+        samples[position:end] = 0.3 * envelope * noise
+        position = end + int(rng.uniform(0.2, 0.8) * SAMPLE_RATE)
+    return samples
+
+
+def load_samples(directory: str) -> List[Tuple[str, np.ndarray]]:
+    """Decode every audio file in a directory to 16 kHz mono"""
+    from batch import find_audio_files
+
+    return [(os.path.basename(path), decode_audio(path)) for path in find_audio_files(directory)]
+
+
+def request_audio(samples: np.ndarray, index: int) -> bytes:
+    """
+    WAV bytes of the samples with a little request-specific dither
+
+    Every request gets different audio so a transcription cache in front of
+    the server cannot turn the benchmark into a cache benchmark.
+    """
+    rng = np.random.default_rng(index)
+    return encode_wav(samples + rng.normal(0, 1e-4, len(samples)).astype(np.float32))
+
+
+class ProcessTreeSampler:
+    """Samples the resident memory of a process and its descendants in the background"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _tree_rss(self) -> int:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces, the parent pid follows its closing paren
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+
+        total = 0
+        pending = [self.pid]
+        while pending:
+            pid = pending.pop()
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * self._page_size
+            except (OSError, IndexError, ValueError):
+                continue
+            pending.extend(children.get(pid, []))
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            # No /proc, fall back to the peak reported by the OS for this process
+            import resource
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = usage if sys.platform == "darwin" else usage * 1024
+
+
+def summarize(latencies: List[float], audio_seconds: List[float], wall_seconds: float,
+              errors: int, peak_rss: int) -> Dict[str, Any]:
+    """Latency percentiles, real-time factor and throughput of one scenario"""
+    result = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": peak_rss,
+    }
+    if not latencies:
+        return result
+
+    latency = np.array(latencies)
+    rtf = np.array(audio_seconds) / latency
+    result.update({
+        "latency_mean": float(latency.mean()),
+        "latency_p50": float(np.percentile(latency, 50)),
+        "latency_p95": float(np.percentile(latency, 95)),
+        "latency_p99": float(np.percentile(latency, 99)),
+        "rtf_p50": float(np.percentile(rtf, 50)),
+        "throughput_rps": len(latencies) / wall_seconds,
+        "audio_seconds_per_second": sum(audio_seconds) / wall_seconds,
+    })
+    return result
+
+
+def run_scenario(call: Callable[[bytes], bool], samples: np.ndarray, concurrency: int,
+                 n_requests: int, pid: int) -> Dict[str, Any]:
+    """
+    Send n_requests transcriptions of the samples, concurrency at a time
+
+    Args:
+        call: Transcribes WAV bytes, returns True on success
+        samples: Audio to transcribe
+        concurrency: Requests in flight at the same time
+        n_requests: Number of requests
+        pid: Process whose memory (with its children) is sampled
+
+    Returns:
+        Dict: Summary from summarize
+    """
+    payloads = [request_audio(samples, index) for index in range(n_requests)]
+    duration = len(samples) / SAMPLE_RATE
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def timed(payload: bytes):
+        started = time.perf_counter()
+        try:
+            ok = call(payload)
+        except Exception as e:
+            print(f"  request failed: {e}", file=sys.stderr)
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+
+    with ProcessTreeSampler(pid) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, payloads))
+        wall = time.perf_counter() - started
+
+    return summarize(latencies, [duration] * len(latencies), wall, errors[0], sampler.peak)
+
+
+def inprocess_caller(model_name: str, pool_size: int) -> Tuple[Callable[[bytes], bool], Callable[[], None]]:
+    """Transcribe through a Transcriber in this process, return (call, close)"""
+    from transcriber import Transcriber
+
+    transcriber = Transcriber(model_name, pool_size=pool_size, cache_path="")
+    transcriber.start_engine()
+    scratch = tempfile.mkdtemp(prefix="scribly-bench-")
+
+    def call(payload: bytes) -> bool:
+        # Transcriber.transcribe takes a path, writing it is part of the cost
+        fd, path = tempfile.mkstemp(suffix=".wav", dir=scratch)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            success, result = transcriber.transcribe(path)
+            if not success:
+                print(f"  transcription failed: {result['error']}", file=sys.stderr)
+            return success
+        finally:
+            os.unlink(path)
+
+    def close():
+        transcriber.stop_engine()
+        os.rmdir(scratch)
+
+    return call, close
+
+
+def http_caller(url: str, model_name: Optional[str]) -> Callable[[bytes], bool]:
+    """Transcribe through POST /transcribe"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=64)
+    session.mount("http://", adapter)
+
+    def call(payload: bytes) -> bool:
+        data = {"model": model_name} if model_name else {}
+        response = session.post(
+            f"{url}/transcribe",
+            files={"file": ("bench.wav", payload, "audio/wav")},
+            data=data,
+        )
+        if response.status_code != 200:
+            print(f"  HTTP {response.status_code}: {response.text[:200]}", file=sys.stderr)
+            return False
+        body = response.json()
+        if not body.get("success"):
+            print(f"  transcription failed: {body.get('error')}", file=sys.stderr)
+        return bool(body.get("success"))
+
+    return call
+
+
+def start_server(port: int, env: Dict[str, str], timeout: float = 60.0) -> subprocess.Popen:
+    """Start the API with uvicorn and wait until it answers"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("API server exited during startup")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"API server did not start within {timeout}s")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(value: str, cast) -> list:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcription latency and throughput")
+    parser.add_argument("--mode", choices=("inprocess", "http", "both"), default="both",
+                        help="Drive the Transcriber directly, the HTTP API, or both")
+    parser.add_argument("--stub", action="store_true",
+                        help="Use a stub whisper binary instead of a built whisper.cpp and model")
+    parser.add_argument("--stub-speed", type=float, default=100.0,
+                        help="Real-time factor the stub pretends to run at")
+    parser.add_argument("--url", default=None,
+                        help="Benchmark an already running API instead of starting one")
+    parser.add_argument("--model", default="base.en", help="Whisper model to use")
+    parser.add_argument("--pool-size", type=int, default=None, help="Resident workers (default from config)")
+    parser.add_argument("--engine", choices=("server", "library", "cli"), default=None,
+                        help="Inference engine (default from config)")
+    parser.add_argument("--durations", default="5,30,180",
+                        help="Comma-separated lengths in seconds of the synthetic audio")
+    parser.add_argument("--samples", default=None,
+                        help="Directory of audio files to use instead of synthetic audio")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per scenario")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the API server started by the benchmark")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory(prefix="scribly-bench-")
+    env = dict(os.environ)
+    # Measure transcription, not the result cache
+    env["SCRIBLY_CACHE_PATH"] = ""
+    if args.stub:
+        env["SCRIBLY_WHISPER_CPP_DIR"] = str(make_stub_whisper_dir(Path(scratch.name) / "whisper.cpp", args.model))
+        env["SCRIBLY_STUB_SPEED"] = str(args.stub_speed)
+    if args.pool_size is not None:
+        env["SCRIBLY_POOL_SIZE"] = str(args.pool_size)
+    if args.engine is not None:
+        env["SCRIBLY_ENGINE"] = args.engine
+    concurrency_levels = parse_list(args.concurrency, int)
+    env["SCRIBLY_MAX_QUEUED"] = str(max(concurrency_levels))
+    # The in-process Transcriber reads the same settings
+    os.environ.update(env)
+
+    from config import ENGINE, POOL_SIZE
+
+    if args.samples:
+        audio = load_samples(args.samples)
+    else:
+        audio = [(f"synthetic-{seconds:g}s", synthetic_speech(seconds)) for seconds in parse_list(args.durations, float)]
+
+    modes = ["inprocess", "http"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        server = None
+        if mode == "inprocess":
+            call, close = inprocess_caller(args.model, POOL_SIZE)
+            pid = os.getpid()
+        else:
+            if args.url:
+                url, pid = args.url.rstrip("/"), os.getpid()
+            else:
+                server = start_server(args.port, env)
+                url, pid = f"http://127.0.0.1:{args.port}", server.pid
+            call, close = http_caller(url, args.model), (lambda: None)
+
+        try:
+            # Warm up so the first scenario doesn't pay for lazy initialization
+            call(request_audio(audio[0][1][:SAMPLE_RATE], args.requests))
+            for name, samples in audio:
+                for concurrency in concurrency_levels:
+                    print(f"{mode}: {name} x{args.requests} at concurrency {concurrency}", file=sys.stderr)
+                    summary = run_scenario(call, samples, concurrency, args.requests, pid)
+                    summary.update({
+                        "mode": mode,
+                        "audio": name,
+                        "audio_seconds": len(samples) / SAMPLE_RATE,
+                        "concurrency": concurrency,
+                    })
+                    results.append(summary)
+        finally:
+            close()
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "stub": args.stub,
+            "stub_speed": args.stub_speed if args.stub else None,
+            "model": args.model,
+            "engine": ENGINE,
+            "pool_size": POOL_SIZE,
+            "requests_per_scenario": args.requests,
+        },
+        "results": results,
+    }
+
+    for result in results:
+        if "latency_p50" in result:
+            print(f"{result['mode']:>9} {result['audio']:>20} c={result['concurrency']:<3} "
+                  f"p50={result['latency_p50']:.3f}s p95={result['latency_p95']:.3f}s "
+                  f"p99={result['latency_p99']:.3f}s rtf={result['rtf_p50']:.1f} "
+                  f"rps={result['throughput_rps']:.2f} rss={result['peak_rss_bytes'] / 2**20:.0f}MiB "
+                  f"errors={result['errors']}")
+        else:
+            print(f"{result['mode']:>9} {result['audio']:>20} c={result['concurrency']:<3} all {result['errors']} requests failed")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Check that jobs and batches are shared between API processes
+
+Starts two servers on the same job store with the stub whisper.cpp, submits
+a job and a batch to the first and polls them through the second until they
+finish. Exits non-zero if the second process cannot see them.
+
+Run from the backend directory:
+    python bench/multiprocess_check.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from benchmark import make_stub_whisper_dir, request_audio, start_server, synthetic_speech
+
+
+def wait_finished(url: str, timeout: float) -> dict:
+    """Poll a job or batch status URL until it is no longer queued or running"""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = requests.get(url, timeout=5)
+        response.raise_for_status()
+        status = response.json()
+        if status["status"] not in ("queued", "running"):
+            return status
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Still {status['status']} after {timeout}s: {url}")
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check jobs and batches across two API processes")
+    parser.add_argument("--model", default="base.en", help="Whisper model the stub pretends to be")
+    parser.add_argument("--ports", default="8766,8767", help="Ports of the two servers")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for each job and batch")
+    args = parser.parse_args()
+
+    ports = [int(port) for port in args.ports.split(",")]
+    scratch = tempfile.TemporaryDirectory(prefix="scribly-multiprocess-")
+    root = Path(scratch.name)
+    env = dict(os.environ)
+    env.update({
+        "SCRIBLY_WHISPER_CPP_DIR": str(make_stub_whisper_dir(root / "whisper.cpp", args.model)),
+        "SCRIBLY_STUB_SPEED": "20",
+        "SCRIBLY_ENGINE": "cli",
+        "SCRIBLY_WARMUP": "0",
+        "SCRIBLY_CACHE_PATH": "",
+        "SCRIBLY_JOB_STORE_PATH": str(root / "jobs" / "jobs.db"),
+        "SCRIBLY_BATCH_DIR": str(root / "batches"),
+        "SCRIBLY_SCRATCH_DIR": str(root / "scratch"),
+    })
+
+    servers = []
+    try:
+        for port in ports:
+            servers.append(start_server(port, env))
+        first, second = (f"http://127.0.0.1:{port}" for port in ports)
+        audio = synthetic_speech(5.0)
+
+        response = requests.post(f"{first}/jobs", files={"file": ("job.wav", request_audio(audio, 0), "audio/wav")},
+                                 timeout=30)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        job = wait_finished(f"{second}/jobs/{job_id}", args.timeout)
+        assert job["status"] == "completed", f"job {job['status']}: {job.get('error')}"
+        result = requests.get(f"{second}/jobs/{job_id}/result", timeout=5)
+        assert result.status_code == 200, f"job result through the second process: {result.status_code}"
+        print(f"Job submitted to :{ports[0]} completed and read through :{ports[1]}")
+
+        files = [("files", (f"file-{i}.wav", request_audio(audio, i), "audio/wav")) for i in range(3)]
+        response = requests.post(f"{first}/transcribe/batch", files=files, timeout=30)
+        response.raise_for_status()
+        batch_id = response.json()["batch_id"]
+        batch = wait_finished(f"{second}/transcribe/batch/{batch_id}", args.timeout)
+        assert batch["status"] == "completed" and batch["completed"] == 3, f"batch {batch}"
+        results = requests.get(f"{second}/transcribe/batch/{batch_id}/results", timeout=5)
+        assert results.status_code == 200 and len(results.text.splitlines()) == 3, "batch results"
+        print(f"Batch submitted to :{ports[0]} completed and read through :{ports[1]}")
+    except (AssertionError, RuntimeError, requests.RequestException) as e:
+        print(f"Multi-process check failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
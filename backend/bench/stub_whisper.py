@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Stand-in for whisper-cli and whisper-server that needs no model
+
+It reads the audio, sleeps for its duration divided by SCRIBLY_STUB_SPEED
+(default 100x real time) and answers with evenly spaced dummy segments in
+the same formats as the real binaries, so the backend's own overhead can be
+measured on machines without a built whisper.cpp.
+
+Usage:
+    stub_whisper.py cli -m MODEL -f FILE [-oj -of PREFIX]
+    stub_whisper.py server -m MODEL [--host HOST] [--port PORT]
+"""
+import argparse
+import email
+import email.policy
+import io
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import soundfile as sf
+
+# Seconds of audio per dummy segment
+SEGMENT_SECONDS = 5.0
+
+
+def stub_speed() -> float:
+    try:
+        return max(float(os.environ.get("SCRIBLY_STUB_SPEED", "100")), 0.001)
+    except ValueError:
+        return 100.0
+
+
+def fake_inference(audio) -> list:
+    """
+    Pretend to transcribe audio
+
+    Args:
+        audio: Path or file object of a WAV file
+
+    Returns:
+        list: (start, end, text) per segment
+    """
+    info = sf.info(audio)
+    duration = info.frames / info.samplerate
+    started = time.perf_counter()
+    time.sleep(duration / stub_speed())
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(start + SEGMENT_SECONDS, duration)
+        segments.append((start, end, f" Stub segment {len(segments)}."))
+        start = end
+
+    # Timing lines in whisper.cpp's format so stderr parsing gets exercised
+    print("whisper_print_timings:     load time =     0.00 ms", file=sys.stderr)
+    print(f"whisper_print_timings:   encode time = {elapsed_ms:8.2f} ms /     1 runs", file=sys.stderr)
+    print(f"whisper_print_timings:    total time = {elapsed_ms:8.2f} ms", file=sys.stderr)
+    sys.stderr.flush()
+    return segments
+
+
+def timestamp(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+
+def run_cli(argv: list):
+    parser = argparse.ArgumentParser(prog="whisper-cli")
+    parser.add_argument("-m", "--model")
+    parser.add_argument("-f", "--file", required=True)
+    parser.add_argument("-oj", "--output-json", action="store_true")
+    parser.add_argument("-of", "--output-file")
+    args, _ = parser.parse_known_args(argv)
+
+    segments = fake_inference(args.file)
+
+    # Segments on stdout as whisper-cli prints them
+    for start, end, text in segments:
+        print(f"[{timestamp(start)} --> {timestamp(end)}]  {text}", flush=True)
+
+    if args.output_json:
+        prefix = args.output_file or args.file
+        with open(f"{prefix}.json", "w") as f:
+            json.dump({
+                "result": {"language": "en"},
+                "transcription": [
+                    {
+                        "timestamps": {"from": timestamp(start), "to": timestamp(end)},
+                        "offsets": {"from": int(start * 1000), "to": int(end * 1000)},
+                        "text": text,
+                    }
+                    for start, end, text in segments
+                ],
+            }, f)
+
+
+class StubServerHandler(BaseHTTPRequestHandler):
+    """Serves GET / and POST /inference like whisper-server"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        body = b"<html><body>whisper stub</body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/inference":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body,
+            policy=email.policy.HTTP
+        )
+        audio = None
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                audio = part.get_payload(decode=True)
+        if audio is None:
+            self._send_json(400, {"error": "no file"})
+            return
+
+        try:
+            segments = fake_inference(io.BytesIO(audio))
+        except Exception as e:
+            self._send_json(200, {"error": str(e)})
+            return
+
+        self._send_json(200, {
+            "task": "transcribe",
+            "language": "en",
+            "text": "".join(text for _, _, text in segments),
+            "segments": [
+                {"id": index, "start": start, "end": end, "text": text}
+                for index, (start, end, text) in enumerate(segments)
+            ],
+        })
+
+
+def run_server(argv: list):
+    parser = argparse.ArgumentParser(prog="whisper-server")
+    parser.add_argument("-m", "--model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args, _ = parser.parse_known_args(argv)
+
+    # One request at a time, like whisper-server
+    HTTPServer((args.host, args.port), StubServerHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("cli", "server"):
+        print(__doc__, file=sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] == "cli":
+        run_cli(sys.argv[2:])
+    else:
+        run_server(sys.argv[2:])
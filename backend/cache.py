@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of transcription results
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import soundfile as sf
+
+from config import CACHE_PATH, CACHE_MAX_BYTES, SHARED_FS
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Frames hashed per read when fingerprinting audio
+HASH_BLOCK_FRAMES = 65536
+
+
+def audio_fingerprint(audio_file: str) -> str:
+    """
+    Hash the decoded PCM of an audio file
+
+    Files that decode to the same samples hash the same even if their
+    headers or containers differ. Files soundfile cannot decode are
+    hashed byte for byte.
+
+    Args:
+        audio_file: Path to the audio file
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    try:
+        with sf.SoundFile(audio_file) as f:
+            digest.update(f"{f.samplerate}:{f.channels}:".encode())
+            for block in f.blocks(blocksize=HASH_BLOCK_FRAMES, dtype="int16"):
+                digest.update(block.tobytes())
+        return digest.hexdigest()
+    except (RuntimeError, sf.LibsndfileError):
+        pass
+
+    digest = hashlib.sha256(b"raw:")
+    with open(audio_file, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """SQLite-backed cache with size-bounded LRU eviction"""
+
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES):
+        """
+        Initialize the cache
+
+        Args:
+            path: Path to the SQLite database file
+            max_bytes: Total size of cached results before eviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Other backend processes may be writing the same file
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL needs shared memory, which hosts sharing a network filesystem don't have
+        self._conn.execute(f"PRAGMA journal_mode={'DELETE' if SHARED_FS else 'WAL'}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    @staticmethod
+    def make_key(fingerprint: str, model_name: str, params: Dict[str, Any]) -> str:
+        """Combine the audio fingerprint with the model and decoding parameters"""
+        material = json.dumps([fingerprint, model_name, params], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            Optional[Dict]: The cached result, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """
+        Store a result and evict the least recently used ones over the size limit
+
+        Args:
+            key: Cache key from make_key
+            result: Transcription result to store
+        """
+        value = json.dumps(result, separators=(",", ":"))
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        rows = self._conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self._conn.execute("COMMIT")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and size of the cache"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+# Caches by database path, shared by every transcriber in the process
+_caches: Dict[str, TranscriptionCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(path: str = CACHE_PATH) -> TranscriptionCache:
+    """Get the shared cache for a database path, opening it on first use"""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = TranscriptionCache(path)
+        return _caches[path]
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Cancellation tokens that stop in-flight inference when a request's deadline
+passes, its client disconnects or its job is cancelled
+"""
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+from metrics import CANCELLED, CANCELLED_SECONDS
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Reasons a token is cancelled for
+DEADLINE = "deadline"
+DISCONNECT = "disconnect"
+JOB_CANCELLED = "job_cancelled"
+SHUTDOWN = "shutdown"
+
+
+class TranscriptionCancelled(Exception):
+    """Raised by work that stopped because its token was cancelled"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Transcription cancelled: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Shared by everything working on one request
+
+    Engines register a callback that stops their work (kill whisper-cli,
+    kill a whisper-server worker, flag the libwhisper abort callback), and
+    the token runs it as soon as the request is cancelled or its deadline
+    passes. Work that has not started yet checks the token and skips.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Initialize the token
+
+        Args:
+            timeout: Seconds from now until the deadline, None or 0 for none
+        """
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        if timeout:
+            self._timer = threading.Timer(timeout, self.cancel, (DEADLINE,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None without one"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def cancel(self, reason: str):
+        """
+        Cancel the work and run the registered stop callbacks, once
+
+        Args:
+            reason: Why, e.g. DEADLINE, DISCONNECT or JOB_CANCELLED
+        """
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            callbacks = list(self._callbacks)
+            self._callbacks = []
+        if self._timer is not None:
+            self._timer.cancel()
+
+        logger.info(f"Cancelling transcription after {time.monotonic() - self.started:.2f}s: {reason}")
+        CANCELLED.inc(reason=reason)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cancel callback failed: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run a callback when the token is cancelled, right away if it already is
+
+        Args:
+            callback: Stops the caller's work, called from whichever thread cancels
+
+        Returns:
+            Callable: Unregisters the callback, call it once the work is done
+        """
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                registered = True
+            else:
+                registered = False
+        if not registered:
+            callback()
+
+        def unregister():
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+        return unregister
+
+    def check(self):
+        """
+        Raise if the token is cancelled
+
+        Raises:
+            TranscriptionCancelled: If it is
+        """
+        if self.reason is not None:
+            raise TranscriptionCancelled(self.reason)
+
+    def wasted(self, seconds: float):
+        """Record seconds of work thrown away because of the cancellation"""
+        if self.reason is not None and seconds > 0:
+            CANCELLED_SECONDS.inc(seconds, reason=self.reason)
+
+    def close(self):
+        """Stop the deadline timer once the work is done"""
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def check(cancel: Optional[CancelToken]):
+    """Raise TranscriptionCancelled if an optional token is cancelled"""
+    if cancel is not None:
+        cancel.check()
+
+
+if __name__ == "__main__":
+    # Simple test
+    token = CancelToken(timeout=0.2)
+    stopped = threading.Event()
+    unregister = token.on_cancel(stopped.set)
+    print(f"Cancelled before deadline: {token.cancelled}, remaining {token.remaining():.2f}s")
+    print(f"Stop callback ran at the deadline: {stopped.wait(1)}, reason {token.reason}")
+    try:
+        token.check()
+    except TranscriptionCancelled as e:
+        print(e)
+    unregister()
+
+    late = threading.Event()
+    token.on_cancel(late.set)
+    print(f"Callback registered after cancellation runs right away: {late.is_set()}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Split long recordings at silence and stitch the chunk transcriptions together
+"""
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_io import Samples
+from metrics import stage
+from segments import join_text
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Length of the frames used to measure energy
+FRAME_SECONDS = 0.03
+
+# Frames read at a time when measuring energy, about a minute of audio
+ENERGY_BLOCK_FRAMES = 2000
+
+
+class Chunk:
+    """A slice of a recording to transcribe on its own"""
+
+    def __init__(self, index: int, start: int, end: int, keep_start: int, keep_end: int, sample_rate: int):
+        """
+        Initialize the chunk
+
+        Args:
+            index: Position of the chunk in the recording
+            start: First sample of the chunk, including the overlap
+            end: Sample after the last one in the chunk
+            keep_start: First sample this chunk owns in the stitched output
+            keep_end: Sample after the last one this chunk owns
+            sample_rate: Sample rate of the recording
+        """
+        self.index = index
+        self.start = start
+        self.end = end
+        self.keep_start = keep_start
+        self.keep_end = keep_end
+        self.sample_rate = sample_rate
+
+    @property
+    def offset(self) -> float:
+        """Start of the chunk in seconds"""
+        return self.start / self.sample_rate
+
+
+def frame_energy(samples: Samples, sample_rate: int) -> Tuple[np.ndarray, int]:
+    """
+    RMS energy of consecutive non-overlapping frames
+
+    The samples are read a block at a time, so a lazily decoded recording
+    is never held in memory as a whole.
+
+    Returns:
+        Tuple[np.ndarray, int]: Energy per frame and frame length in samples
+    """
+    frame_length = max(int(sample_rate * FRAME_SECONDS), 1)
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), frame_length
+    energies = []
+    block = ENERGY_BLOCK_FRAMES * frame_length
+    for start in range(0, n_frames * frame_length, block):
+        frames = samples[start:min(start + block, n_frames * frame_length)].reshape(-1, frame_length)
+        energies.append(np.sqrt(np.mean(frames * frames, axis=1)))
+    return np.concatenate(energies), frame_length
+
+
+def find_split_points(samples: Samples, sample_rate: int, chunk_seconds: float,
+                      search_seconds: float = 5.0) -> List[int]:
+    """
+    Pick split points close to every chunk_seconds, moved to the quietest spot nearby
+
+    Args:
+        samples: Mono samples
+        sample_rate: Sample rate of the samples
+        chunk_seconds: Target chunk length
+        search_seconds: How far before or after the target to look for silence
+
+    Returns:
+        List[int]: Sample positions to split at, excluding 0 and the end
+    """
+    energy, frame_length = frame_energy(samples, sample_rate)
+    if len(energy) == 0:
+        return []
+
+    # Smooth over ~0.3s so a single quiet frame between words doesn't win
+    window = max(int(0.3 / FRAME_SECONDS), 1)
+    smoothed = np.convolve(energy, np.ones(window) / window, mode="same")
+
+    chunk_frames = int(chunk_seconds / FRAME_SECONDS)
+    search_frames = int(search_seconds / FRAME_SECONDS)
+    points = []
+    target = chunk_frames
+    while target < len(smoothed) - search_frames:
+        low = max(target - search_frames, (points[-1] // frame_length if points else 0) + 1)
+        high = min(target + search_frames, len(smoothed) - 1)
+        best = low + int(np.argmin(smoothed[low:high + 1]))
+        points.append(best * frame_length)
+        target = best + chunk_frames
+    return points
+
+
+def make_chunks(samples: Samples, sample_rate: int, chunk_seconds: float,
+                overlap_seconds: float) -> List[Chunk]:
+    """
+    Split a recording into chunks at silence, each overlapping the previous one
+
+    Args:
+        samples: Mono samples
+        sample_rate: Sample rate of the samples
+        chunk_seconds: Target chunk length
+        overlap_seconds: Audio from the previous chunk prepended to each chunk
+
+    Returns:
+        List[Chunk]: The chunks in order
+    """
+    bounds = [0] + find_split_points(samples, sample_rate, chunk_seconds) + [len(samples)]
+    overlap = int(overlap_seconds * sample_rate)
+    chunks = []
+    for index, (keep_start, keep_end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        chunks.append(Chunk(
+            index,
+            max(keep_start - overlap, 0),
+            keep_end,
+            keep_start,
+            keep_end,
+            sample_rate
+        ))
+    return chunks
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^\w]+", " ", text.lower()).strip()
+
+
+def stitch_chunk(stitched: List[Dict[str, Any]], chunk: Chunk, result: Dict[str, Any],
+                 last: bool) -> List[Dict[str, Any]]:
+    """
+    Append one chunk's segments to the segments stitched so far
+
+    Segments are shifted by the chunk's offset. A segment is kept only by
+    the chunk that owns its midpoint, and the first segment of a chunk is
+    dropped if it overlaps and repeats the last segment of the previous one.
+
+    Args:
+        stitched: Segments of the previous chunks, extended in place
+        chunk: The chunk that was transcribed
+        result: Transcriber result for the chunk
+        last: Whether this is the final chunk of the recording
+
+    Returns:
+        List[Dict]: The segments added
+    """
+    keep_start = chunk.keep_start / chunk.sample_rate
+    keep_end = chunk.keep_end / chunk.sample_rate
+    added = []
+    first_in_chunk = True
+    for segment in result.get("segments", []):
+        segment = dict(segment)
+        segment["start"] = segment.get("start", 0.0) + chunk.offset
+        segment["end"] = segment.get("end", 0.0) + chunk.offset
+        midpoint = (segment["start"] + segment["end"]) / 2
+        if midpoint < keep_start or (midpoint >= keep_end and not last):
+            continue
+        if first_in_chunk:
+            first_in_chunk = False
+            if stitched and segment["start"] < stitched[-1]["end"] and \
+                    _normalize(segment.get("text", "")) == _normalize(stitched[-1].get("text", "")):
+                continue
+        segment["id"] = len(stitched)
+        stitched.append(segment)
+        added.append(segment)
+    return added
+
+
+def stitch_segments(chunks: List[Chunk], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Merge per-chunk segments into one list with global timestamps, see stitch_chunk
+
+    Args:
+        chunks: The chunks that were transcribed
+        results: Transcriber results for each chunk, in the same order
+
+    Returns:
+        List[Dict]: The stitched segments
+    """
+    stitched = []
+    for chunk, result in zip(chunks, results):
+        stitch_chunk(stitched, chunk, result, chunk is chunks[-1])
+    return stitched
+
+
+def transcribe_chunked(samples: Samples, sample_rate: int, transcribe_func: Callable[[np.ndarray], Dict[str, Any]],
+                       chunk_seconds: float, overlap_seconds: float, max_workers: int,
+                       progress_callback: Optional[Callable[[float], None]] = None,
+                       segment_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Transcribe a long recording as overlapping chunks in parallel
+
+    Chunks are stitched in order as soon as each one and all before it are
+    done, so segments reach segment_callback long before the last chunk.
+
+    Args:
+        samples: Mono samples of the recording, or an AudioReader that decodes each chunk when it starts
+        sample_rate: Sample rate of the samples
+        transcribe_func: Blocking function that transcribes a slice of the
+            samples and returns a result dict with segments; raises on failure
+        chunk_seconds: Target chunk length
+        overlap_seconds: Overlap between consecutive chunks
+        max_workers: Number of chunks transcribed at the same time
+        progress_callback: Called with the fraction of chunks done
+        segment_callback: Called with each stitched segment, in order
+
+    Returns:
+        Dict: text, segments and language
+    """
+    chunks = make_chunks(samples, sample_rate, chunk_seconds, overlap_seconds)
+    logger.info(f"Transcribing {len(samples) / sample_rate:.1f}s of audio as "
+                f"{len(chunks)} chunks with {max_workers} workers")
+
+    done = [0]
+    done_lock = threading.Lock()
+
+    def transcribe_chunk(chunk: Chunk) -> Dict[str, Any]:
+        if isinstance(samples, np.ndarray):
+            audio = samples[chunk.start:chunk.end]
+        else:
+            with stage("decode"):
+                audio = samples[chunk.start:chunk.end]
+        result = transcribe_func(audio)
+        with done_lock:
+            done[0] += 1
+            if progress_callback:
+                progress_callback(done[0] / len(chunks))
+        return result
+
+    segments = []
+    language = None
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="chunk") as executor:
+        futures = [executor.submit(transcribe_chunk, chunk) for chunk in chunks]
+        try:
+            for chunk, future in zip(chunks, futures):
+                result = future.result()
+                if language is None:
+                    language = result.get("language", "en")
+                with stage("postprocess"):
+                    added = stitch_chunk(segments, chunk, result, chunk is chunks[-1])
+                if segment_callback:
+                    for segment in added:
+                        segment_callback(segment)
+        except BaseException:
+            # The recording failed, drop the chunks that have not started instead of transcribing them
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return {
+        "text": join_text(segments),
+        "segments": segments,
+        "language": language or "en",
+    }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Runtime configuration for the backend, read from environment variables
+"""
+import os
+import tempfile
+
+from tuning import choose_layout
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting from the environment"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# whisper.cpp checkout with the built binaries and models
+WHISPER_CPP_DIR = os.environ.get(
+    "SCRIBLY_WHISPER_CPP_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "whisper.cpp")
+)
+
+# Inference engine for resident models: "server" (whisper-server workers),
+# "library" (libwhisper loaded in-process) or "cli" (whisper-cli per request)
+ENGINE = os.environ.get("SCRIBLY_ENGINE", "server")
+
+# libwhisper shared library for the library engine (empty searches the whisper.cpp build)
+WHISPER_LIBRARY = os.environ.get("SCRIBLY_WHISPER_LIBRARY", "")
+
+# Worker layout measured by setup_whisper.py --tune
+TUNING_PATH = os.environ.get(
+    "SCRIBLY_TUNING_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tuning.json")
+)
+
+# Split of the usable cores (physical, within affinity and cgroup quota) into workers and threads
+LAYOUT = choose_layout(TUNING_PATH)
+
+# Number of resident whisper-server workers, or library engine states (0 disables both)
+POOL_SIZE = env_int("SCRIBLY_POOL_SIZE", LAYOUT["workers"])
+
+# Threads used by each whisper-server worker, library engine request and whisper-cli run
+WORKER_THREADS = env_int("SCRIBLY_WORKER_THREADS", LAYOUT["threads"])
+
+if "SCRIBLY_POOL_SIZE" in os.environ or "SCRIBLY_WORKER_THREADS" in os.environ:
+    LAYOUT = dict(LAYOUT, workers=POOL_SIZE, threads=WORKER_THREADS, source="environment")
+
+# Seconds between worker health checks
+HEALTH_CHECK_INTERVAL = env_float("SCRIBLY_HEALTH_CHECK_INTERVAL", 10.0)
+
+# Seconds to wait for a worker to load its model and start serving
+WORKER_STARTUP_TIMEOUT = env_float("SCRIBLY_WORKER_STARTUP_TIMEOUT", 60.0)
+
+# Seconds a worker may take to answer a request before it is treated as stuck and killed,
+# plus SCRIBLY_WORKER_TIMEOUT_FACTOR seconds per second of audio
+WORKER_REQUEST_TIMEOUT = env_float("SCRIBLY_WORKER_REQUEST_TIMEOUT", 60.0)
+WORKER_TIMEOUT_FACTOR = env_float("SCRIBLY_WORKER_TIMEOUT_FACTOR", 2.0)
+
+# Transcriptions allowed to wait for a free slot before requests are rejected
+MAX_QUEUED_TRANSCRIPTIONS = env_int("SCRIBLY_MAX_QUEUED", 16)
+
+# Jobs allowed to wait in the /jobs backlog before submissions are rejected
+MAX_JOB_BACKLOG = env_int("SCRIBLY_MAX_JOB_BACKLOG", 100)
+
+# Finished jobs kept so their results can be fetched
+JOB_HISTORY_SIZE = env_int("SCRIBLY_JOB_HISTORY_SIZE", 500)
+
+# SQLite file holding the jobs of every backend process on this host
+JOB_STORE_PATH = os.environ.get(
+    "SCRIBLY_JOB_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs", "jobs.db")
+)
+
+# Seconds between checks for jobs queued by other processes
+JOB_POLL_INTERVAL = env_float("SCRIBLY_JOB_POLL_INTERVAL", 0.5)
+
+# Seconds a running job stays claimed without a heartbeat from its process
+JOB_LEASE_SECONDS = env_float("SCRIBLY_JOB_LEASE_SECONDS", 60.0)
+
+# The job store and cache live on a network filesystem shared by several hosts
+SHARED_FS = env_bool("SCRIBLY_SHARED_FS", False)
+
+# Recordings longer than this many seconds are split and transcribed in parallel (0 disables)
+CHUNK_THRESHOLD_SECONDS = env_float("SCRIBLY_CHUNK_THRESHOLD", 120.0)
+
+# Target length of each chunk of a long recording
+CHUNK_SECONDS = env_float("SCRIBLY_CHUNK_SECONDS", 60.0)
+
+# Audio shared by consecutive chunks so words at a boundary are not lost
+CHUNK_OVERLAP_SECONDS = env_float("SCRIBLY_CHUNK_OVERLAP", 1.0)
+
+# SQLite file holding cached transcription results (empty disables the cache)
+CACHE_PATH = os.environ.get(
+    "SCRIBLY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "transcriptions.db")
+)
+
+# Size of cached results before the least recently used ones are evicted
+CACHE_MAX_BYTES = env_int("SCRIBLY_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+# SQLite file archiving finished transcripts with a full-text index for /search (empty disables)
+ARCHIVE_PATH = os.environ.get("SCRIBLY_ARCHIVE_PATH", "")
+
+# Seconds a /transcribe request may take before its inference is stopped with 504 (0 disables).
+# Clients can ask for less with the X-Request-Timeout header or the timeout form field.
+REQUEST_TIMEOUT_SECONDS = env_float("SCRIBLY_REQUEST_TIMEOUT", 600.0)
+
+# Largest accepted upload in bytes
+MAX_UPLOAD_BYTES = env_int("SCRIBLY_MAX_UPLOAD_BYTES", 1024 * 1024 * 1024)
+
+# Bytes copied at a time when saving uploads
+UPLOAD_CHUNK_BYTES = env_int("SCRIBLY_UPLOAD_CHUNK_BYTES", 1024 * 1024)
+
+# Directory for uploads and intermediate audio, RAM-backed /dev/shm where the host has it
+SCRATCH_DIR = os.environ.get(
+    "SCRIBLY_SCRATCH_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "scribly")
+)
+
+# Scratch directory used instead when SCRATCH_DIR has less free space than a request may use,
+# e.g. Docker's 64 MB /dev/shm (only when SCRIBLY_SCRATCH_DIR is not set)
+SCRATCH_FALLBACK_DIR = (
+    "" if os.environ.get("SCRIBLY_SCRATCH_DIR") else os.path.join(tempfile.gettempdir(), "scribly")
+)
+
+# Bytes of scratch files a backend process may hold at once, lowered to the free space at startup
+SCRATCH_MAX_BYTES = env_int("SCRIBLY_SCRATCH_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+
+# Largest scratch file a single request may create
+SCRATCH_REQUEST_BYTES = env_int("SCRIBLY_SCRATCH_REQUEST_BYTES", MAX_UPLOAD_BYTES)
+
+# Seconds after which scratch files are removed, longer than the longest transcription or batch
+SCRATCH_MAX_AGE_SECONDS = env_float("SCRIBLY_SCRATCH_MAX_AGE", 6 * 3600.0)
+
+# Seconds between sweeps for orphaned scratch files
+SCRATCH_SWEEP_INTERVAL = env_float("SCRIBLY_SCRATCH_SWEEP_INTERVAL", 60.0)
+
+# Responses at least this many bytes are gzipped for clients that accept it (0 disables)
+GZIP_MIN_BYTES = env_int("SCRIBLY_GZIP_MIN_BYTES", 1024)
+
+# Seconds of audio transcribed together before /ws/stream finalizes it
+STREAM_WINDOW_SECONDS = env_float("SCRIBLY_STREAM_WINDOW", 10.0)
+
+# Seconds of new audio that trigger a partial /ws/stream update
+STREAM_STEP_SECONDS = env_float("SCRIBLY_STREAM_STEP", 3.0)
+
+# Seconds of audio carried over from a finalized window into the next one
+STREAM_KEEP_SECONDS = env_float("SCRIBLY_STREAM_KEEP", 0.2)
+
+# Seconds of audio a /ws/stream client may get ahead of the transcription before it is disconnected
+STREAM_MAX_BACKLOG_SECONDS = env_float("SCRIBLY_STREAM_MAX_BACKLOG", 60.0)
+
+# Audio capture backend for AudioRecorder: "sox" (rec subprocess) or "sounddevice"
+RECORDER_BACKEND = os.environ.get("SCRIBLY_RECORDER_BACKEND", "sox")
+
+# Seconds of recent audio kept in memory by the sounddevice recorder
+RECORDER_BUFFER_SECONDS = env_float("SCRIBLY_RECORDER_BUFFER_SECONDS", 600.0)
+
+# Write everything the sounddevice recorder captures to its WAV file as it arrives
+RECORDER_SPILL_TO_DISK = env_bool("SCRIBLY_RECORDER_SPILL_TO_DISK", True)
+
+# File format AudioRecorder encodes to while capturing: "wav" or "flac" (lossless, about half the size)
+RECORDER_FORMAT = os.environ.get("SCRIBLY_RECORDER_FORMAT", "wav")
+
+# Length of the rolling segment files AudioRecorder writes, so finished ones can be uploaded
+# while recording continues (0 writes a single file)
+RECORDER_SEGMENT_SECONDS = env_float("SCRIBLY_RECORDER_SEGMENT_SECONDS", 0.0)
+
+# Model used when a request does not name one
+DEFAULT_MODEL = os.environ.get("SCRIBLY_DEFAULT_MODEL", "base.en")
+
+# Per-model worker counts overriding SCRIBLY_POOL_SIZE, e.g. "tiny.en-q5_1=4,large-v3=1"
+MODEL_POOL_SIZES = {
+    name.strip(): int(size)
+    for name, _, size in (
+        item.partition("=") for item in os.environ.get("SCRIBLY_MODEL_POOL_SIZES", "").split(",")
+    )
+    if name.strip() and size.strip().isdigit()
+}
+
+# Further models downloaded, read into the page cache and started at startup, e.g. "tiny.en,small"
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("SCRIBLY_PRELOAD_MODELS", "").split(",") if name.strip()]
+
+# Transcriptions allowed to run at the same time, defaults to one per worker of every configured model
+# (the default, preloaded and SCRIBLY_MODEL_POOL_SIZES ones) so each model's workers can all be busy
+MAX_CONCURRENT_TRANSCRIPTIONS = env_int("SCRIBLY_MAX_CONCURRENT", sum(
+    max(MODEL_POOL_SIZES.get(name, POOL_SIZE), 1)
+    for name in {DEFAULT_MODEL, *PRELOAD_MODELS, *MODEL_POOL_SIZES}
+))
+
+# Run a short inference on every worker at startup so the first request is not the slow one
+WARMUP = env_bool("SCRIBLY_WARMUP", True)
+
+# Memory the loaded models' workers may use before idle ones are unloaded (0 = half of RAM)
+MODEL_MEMORY_BYTES = env_int("SCRIBLY_MODEL_MEMORY_BYTES", 0)
+
+# Directory for batch result files
+BATCH_DIR = os.environ.get(
+    "SCRIBLY_BATCH_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "batches")
+)
+
+# Server directory whose files /transcribe/batch may read by path (empty disables)
+BATCH_ROOT = os.environ.get("SCRIBLY_BATCH_ROOT", "")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Bounded dispatcher that runs blocking transcription work off the event loop
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from config import MAX_CONCURRENT_TRANSCRIPTIONS, MAX_QUEUED_TRANSCRIPTIONS
+from metrics import STAGE_SECONDS
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the dispatcher cannot accept more work"""
+
+
+class Dispatcher:
+    """Run blocking calls on a bounded thread pool with a bounded wait queue"""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TRANSCRIPTIONS,
+                 max_queued: int = MAX_QUEUED_TRANSCRIPTIONS):
+        """
+        Initialize the dispatcher
+
+        Args:
+            max_concurrent: Number of calls allowed to run at the same time
+            max_queued: Number of calls allowed to wait for a free slot
+        """
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queued = max(max_queued, 0)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrent,
+            thread_name_prefix="transcribe"
+        )
+        # Only touched from the event loop thread
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return min(self._pending, self.max_concurrent)
+
+    @property
+    def queued(self) -> int:
+        return max(self._pending - self.max_concurrent, 0)
+
+    def submit(self, func: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Schedule a blocking call in the thread pool without waiting for it
+
+        Must be called from the event loop. Capacity is checked right away,
+        so a full queue is reported before anything is scheduled.
+
+        Args:
+            func: Blocking function to call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            asyncio.Future: Resolves to the return value of func
+
+        Raises:
+            QueueFullError: If the dispatcher is at capacity
+        """
+        if self._pending >= self.max_concurrent + self.max_queued:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Transcription queue is full ({self.queued} waiting, {self.running} running)"
+            )
+
+        submitted = time.perf_counter()
+
+        def call():
+            # Time spent waiting for a free thread
+            STAGE_SECONDS.observe(time.perf_counter() - submitted, stage="queue_wait")
+            return func(*args, **kwargs)
+
+        self._pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, call)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future: asyncio.Future):
+        self._pending -= 1
+        self.completed += 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking call in the thread pool and wait for its result
+
+        Args:
+            func: Blocking function to call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            The return value of func
+
+        Raises:
+            QueueFullError: If the dispatcher is at capacity
+        """
+        return await self.submit(func, *args, **kwargs)
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for the dispatcher"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+# Singleton instance
+dispatcher = Dispatcher()
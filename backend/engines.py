@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Inference engines the transcriber runs whisper.cpp through
+
+    CliEngine      a one-off whisper-cli process per request, always available
+    ServerEngine   resident whisper-server workers, one model copy per worker
+    LibraryEngine  libwhisper loaded in-process: one shared model context and
+                   a decoding state per concurrent request
+"""
+import os
+import queue
+import re
+import subprocess
+import threading
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from config import WHISPER_CPP_DIR
+from cancellation import CancelToken, check
+from audio_io import decode_audio, encode_wav, to_float32
+from metrics import stage, observe_whisper_output
+from scratch import out_of_space_as_full, scratch
+from segments import join_text, parse_segment_line
+from worker_pool import WorkerPool, WorkerError, WHISPER_SERVER
+from whisper_lib import WhisperLibrary, WhisperLibraryError, find_library
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Path to the whisper-cli executable
+WHISPER_CLI = Path(WHISPER_CPP_DIR) / "build" / "bin" / "whisper-cli"
+
+# Language whisper-cli reports on stderr when it detects it, e.g. "auto-detected language: de (p = 0.97)"
+DETECTED_LANGUAGE_PATTERN = re.compile(r"auto-detected language: (\w+)")
+
+SegmentCallback = Callable[[Dict[str, Any]], None]
+
+# A path to an audio file, or 16 kHz mono samples (float32, or int16 PCM)
+Audio = Union[str, np.ndarray]
+
+
+class EngineError(Exception):
+    """Raised when an engine cannot transcribe a request"""
+
+
+class Engine:
+    """Runs whisper.cpp on audio; subclasses decide how the model is loaded"""
+
+    name = "engine"
+
+    def start(self) -> bool:
+        """
+        Load the model so requests skip it
+
+        Returns:
+            bool: True if the engine can serve requests
+        """
+        return True
+
+    def stop(self):
+        """Release the model and anything else held by start"""
+
+    def is_running(self) -> bool:
+        return True
+
+    @property
+    def size(self) -> int:
+        """Requests the engine serves at the same time"""
+        return 1
+
+    def busy(self) -> int:
+        """Requests being served right now"""
+        return 0
+
+    def transcribe(self, audio: Audio, segment_callback: Optional[SegmentCallback] = None,
+                   cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Transcribe audio
+
+        Args:
+            audio: Path to an audio file whisper.cpp reads, or 16 kHz mono samples
+            segment_callback: Called with each segment as soon as it is available
+            cancel: Token that stops the inference as soon as it is cancelled
+
+        Returns:
+            Dict: text, segments and language
+
+        Raises:
+            EngineError: If the transcription fails
+            TranscriptionCancelled: If the token was cancelled
+        """
+        raise NotImplementedError
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for the engine"""
+        return {"engine": self.name, "running": self.is_running(), "size": self.size, "busy": self.busy()}
+
+
+class CliEngine(Engine):
+    """A one-off whisper-cli process per request, loading the model every time"""
+
+    name = "cli"
+
+    def __init__(self, model_path: Path, threads: int, cli_path: Path = WHISPER_CLI):
+        """
+        Initialize the engine
+
+        Args:
+            model_path: Path to the ggml model
+            threads: Inference threads per run
+            cli_path: Path to the whisper-cli executable
+        """
+        self.model_path = Path(model_path)
+        self.threads = threads
+        self.cli_path = Path(cli_path)
+        self._running = 0
+        self._lock = threading.Lock()
+        # Looked up until found, then trusted, so requests don't stat it
+        self._found = False
+
+    def is_running(self) -> bool:
+        if not self._found:
+            self._found = self.cli_path.exists() or self.cli_path.with_suffix(".exe").exists()
+        return self._found
+
+    def busy(self) -> int:
+        return self._running
+
+    def transcribe(self, audio: Audio, segment_callback: Optional[SegmentCallback] = None,
+                   cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        check(cancel)
+        if not isinstance(audio, np.ndarray):
+            return self._run(audio, segment_callback, cancel)
+
+        # whisper-cli only reads files
+        data = encode_wav(audio)
+        # A full scratch space raises ScratchFullError, reported to the client as 507
+        temp_path = scratch.create(".wav", size=len(data))
+        try:
+            with out_of_space_as_full(), open(temp_path, "wb") as temp_file:
+                temp_file.write(data)
+            return self._run(temp_path, segment_callback, cancel)
+        finally:
+            scratch.remove(temp_path)
+
+    def _run(self, audio_file: str, segment_callback: Optional[SegmentCallback],
+             cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Transcribe an audio file with whisper-cli
+
+        Segments are parsed from whisper-cli's stdout as it prints them, so
+        nothing is written to disk and each one can be forwarded right away.
+        Cancelling the token kills the process.
+        """
+        if not self.is_running():
+            raise EngineError("whisper-cli not found. Please build whisper.cpp first.")
+
+        cmd = [
+            str(self.cli_path),
+            "-m", str(self.model_path),
+            "-f", audio_file,
+            # Sized so concurrent runs share the cores instead of oversubscribing them
+            "-t", str(self.threads),
+            "-p", "1",
+        ]
+
+        logger.info(f"Running transcription: {' '.join(cmd)}")
+        with self._lock:
+            self._running += 1
+        unregister = None
+        process = None
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1
+            )
+            if cancel is not None:
+                unregister = cancel.on_cancel(process.kill)
+
+            # Drain stderr alongside stdout so neither pipe fills up
+            stderr_lines: List[str] = []
+            stderr_reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+            stderr_reader.start()
+
+            segments = []
+            for line in process.stdout:
+                segment = parse_segment_line(line)
+                if segment is None:
+                    continue
+                segment["id"] = len(segments)
+                segments.append(segment)
+                if segment_callback:
+                    segment_callback(segment)
+
+            process.wait()
+            stderr_reader.join()
+        except OSError as e:
+            raise EngineError(f"Transcription failed: {str(e)}")
+        finally:
+            if unregister is not None:
+                unregister()
+            # Left early, e.g. the segment callback raised because a streaming client went away
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+            with self._lock:
+                self._running -= 1
+
+        # Killed on purpose, the partial output is discarded
+        check(cancel)
+
+        stderr = "".join(stderr_lines)
+        observe_whisper_output(stderr)
+
+        if process.returncode != 0:
+            logger.error(f"Transcription process error: {stderr}")
+            raise EngineError(f"Transcription failed: {stderr}")
+
+        language = DETECTED_LANGUAGE_PATTERN.search(stderr)
+        return {
+            "text": join_text(segments),
+            "segments": segments,
+            "language": language.group(1) if language else "en",
+        }
+
+
+class ServerEngine(Engine):
+    """Resident whisper-server workers, each with its own copy of the model"""
+
+    name = "server"
+
+    def __init__(self, model_path: Path, size: int, threads: int, server_path: Path = WHISPER_SERVER):
+        """
+        Initialize the engine
+
+        Args:
+            model_path: Path to the ggml model every worker loads
+            size: Number of workers
+            threads: Inference threads per worker
+            server_path: Path to the whisper-server executable
+        """
+        self.pool = WorkerPool(model_path, size=size, threads=threads, server_path=server_path)
+
+    def start(self) -> bool:
+        if not self.pool.server_path.exists():
+            logger.warning("whisper-server not found, using whisper-cli per request")
+            return False
+        return self.pool.start()
+
+    def stop(self):
+        self.pool.stop()
+
+    def is_running(self) -> bool:
+        return self.pool.is_running()
+
+    @property
+    def size(self) -> int:
+        return self.pool.size
+
+    def busy(self) -> int:
+        return sum(worker.lock.locked() for worker in self.pool.workers)
+
+    def transcribe(self, audio: Audio, segment_callback: Optional[SegmentCallback] = None,
+                   cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        # whisper-server takes WAV files, samples are posted as WAV bytes
+        if isinstance(audio, np.ndarray):
+            audio = encode_wav(audio)
+        try:
+            result = self.pool.transcribe(audio, cancel=cancel)
+        except WorkerError as e:
+            raise EngineError(str(e))
+        if segment_callback:
+            for segment in result["segments"]:
+                segment_callback(segment)
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        return dict(super().status(), worker_pool=self.pool.status())
+
+
+class LibraryEngine(Engine):
+    """
+    libwhisper loaded in-process
+
+    The model weights are loaded once into a context shared by all requests.
+    Each concurrent request borrows one of `size` decoding states, so memory
+    grows by a state (KV cache and buffers) per request instead of by a full
+    model copy, and samples are handed over as a float32 buffer without
+    process creation, WAV encoding or HTTP.
+    """
+
+    name = "library"
+
+    def __init__(self, model_path: Path, size: int, threads: int, library_path: Optional[Path] = None):
+        """
+        Initialize the engine
+
+        Args:
+            model_path: Path to the ggml model
+            size: Number of decoding states, the requests served at the same time
+            threads: Inference threads per request
+            library_path: Path to libwhisper, None to search the whisper.cpp build
+        """
+        self.model_path = Path(model_path)
+        self._size = max(size, 1)
+        self.threads = threads
+        self.library_path = library_path
+        self.library: Optional[WhisperLibrary] = None
+        self.ctx = None
+        self.states: List[int] = []
+        self._idle = queue.Queue()
+
+    def start(self) -> bool:
+        if self.ctx is not None:
+            return True
+
+        path = self.library_path or find_library()
+        if path is None:
+            logger.warning("libwhisper not found, build whisper.cpp with BUILD_SHARED_LIBS=ON")
+            return False
+
+        try:
+            self.library = WhisperLibrary(path)
+            self.ctx = self.library.init_context(self.model_path)
+            # All states up front so memory use is known once the model is loaded
+            for _ in range(self._size):
+                self.states.append(self.library.init_state(self.ctx))
+        except WhisperLibraryError as e:
+            logger.error(str(e))
+            self._free()
+            return False
+
+        self._idle = queue.Queue()
+        for state in self.states:
+            self._idle.put(state)
+        logger.info(f"Loaded {self.model_path.name} with {path.name} "
+                    f"(version {self.library.version or 'unknown'}), {self._size} states")
+        return True
+
+    def stop(self):
+        if self.ctx is None:
+            return
+        # Wait for in-flight requests to hand back their state
+        for _ in self.states:
+            self._idle.get()
+        self._free()
+        # Wake requests still waiting for a state, they fail with EngineError
+        for _ in range(self._size):
+            self._idle.put(None)
+
+    def _free(self):
+        for state in self.states:
+            self.library.free_state(state)
+        self.states = []
+        if self.ctx is not None:
+            self.library.free(self.ctx)
+            self.ctx = None
+
+    def is_running(self) -> bool:
+        return self.ctx is not None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def busy(self) -> int:
+        return len(self.states) - self._idle.qsize() if self.ctx is not None else 0
+
+    def transcribe(self, audio: Audio, segment_callback: Optional[SegmentCallback] = None,
+                   cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        if self.ctx is None:
+            raise EngineError("libwhisper engine is not running")
+        check(cancel)
+
+        if isinstance(audio, np.ndarray):
+            samples = to_float32(audio)
+        else:
+            try:
+                with stage("decode"):
+                    samples = decode_audio(audio)
+            except Exception as e:
+                raise EngineError(f"Transcription failed: {str(e)}")
+
+        state = self._borrow_state(cancel)
+        if state is None:
+            self._idle.put(state)
+            raise EngineError("libwhisper engine was stopped")
+        # whisper.cpp polls the abort callback between encoder and decoder steps
+        abort = (lambda: cancel.cancelled) if cancel is not None else None
+        try:
+            segments, language = self.library.full(self.ctx, state, samples, self.threads, segment_callback, abort)
+        except WhisperLibraryError as e:
+            check(cancel)
+            raise EngineError(f"Transcription failed: {str(e)}")
+        finally:
+            self._idle.put(state)
+        check(cancel)
+
+        return {
+            "text": join_text(segments),
+            "segments": segments,
+            "language": language,
+        }
+
+    def _borrow_state(self, cancel: Optional[CancelToken]) -> Optional[int]:
+        """Wait for an idle decoding state, giving up if the token is cancelled meanwhile"""
+        while True:
+            try:
+                return self._idle.get(timeout=0.25)
+            except queue.Empty:
+                check(cancel)
+
+    def status(self) -> Dict[str, Any]:
+        return dict(
+            super().status(),
+            threads=self.threads,
+            model_path=str(self.model_path),
+            library=str(self.library.path) if self.library is not None else None,
+            version=self.library.version if self.library is not None else None,
+        )
+
+
+def create_engine(kind: str, model_path: Path, size: int, threads: int) -> Optional[Engine]:
+    """
+    Build a resident engine
+
+    Args:
+        kind: "server" or "library"
+        model_path: Path to the ggml model
+        size: Requests served at the same time
+        threads: Inference threads per request
+
+    Returns:
+        Optional[Engine]: The engine, not started yet, None for "cli" or an unknown kind
+    """
+    if kind == "server":
+        return ServerEngine(model_path, size, threads)
+    if kind == "library":
+        return LibraryEngine(model_path, size, threads)
+    if kind != "cli":
+        logger.error(f"Unknown engine {kind}, using whisper-cli per request")
+    return None
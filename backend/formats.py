@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Shapes a transcription result into the response format a client asked for
+
+    full     text plus every segment with all of its fields (the default)
+    text     only the text
+    compact  start, end and text of the segments as parallel arrays
+    srt      SubRip subtitles
+    vtt      WebVTT subtitles
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+FORMATS = ("full", "text", "compact", "srt", "vtt")
+
+# Media types of the formats that are not JSON
+SUBTITLE_MEDIA_TYPES = {
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt",
+}
+
+# Segment fields the compact format keeps unless fields names others
+COMPACT_FIELDS = ("start", "end", "text")
+
+
+class FormatError(Exception):
+    """Raised for an unknown format or field list"""
+
+
+def parse_format(format: Optional[str], fields: Optional[str]) -> Tuple[str, Optional[List[str]]]:
+    """
+    Validate the format and fields request parameters
+
+    Args:
+        format: One of FORMATS, None for full
+        fields: Comma-separated segment fields to keep, e.g. "start,end,text"
+
+    Returns:
+        Tuple[str, Optional[List[str]]]: The format and the fields, None to keep all
+
+    Raises:
+        FormatError: If the format is unknown or fields is used with a subtitle format
+    """
+    format = (format or "full").strip().lower()
+    if format not in FORMATS:
+        raise FormatError(f"Unknown format: {format}, expected one of {', '.join(FORMATS)}")
+
+    names = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+    if names and format not in ("full", "compact"):
+        raise FormatError(f"fields only applies to the full and compact formats, not {format}")
+    return format, names
+
+
+def select_fields(segments: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    """Keep only the named fields of each segment"""
+    return [{name: segment[name] for name in fields if name in segment} for segment in segments]
+
+
+def columns(segments: List[Dict[str, Any]], fields: List[str]) -> Dict[str, list]:
+    """
+    Turn a list of segments into one array per field
+
+    Args:
+        segments: Segments as the transcriber returns them
+        fields: Fields to keep, missing ones are filled with None
+
+    Returns:
+        Dict[str, list]: Field name to the values of every segment, in order
+    """
+    return {name: [segment.get(name) for segment in segments] for name in fields}
+
+
+def format_timestamp(seconds: float, decimal_marker: str) -> str:
+    """Format seconds as HH:MM:SS followed by the marker and milliseconds"""
+    milliseconds = max(int(round(seconds * 1000)), 0)
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
+
+
+def to_srt(segments: List[Dict[str, Any]]) -> str:
+    """Render segments as SubRip subtitles"""
+    cues = []
+    for index, segment in enumerate(segments, start=1):
+        start = format_timestamp(segment["start"], ",")
+        end = format_timestamp(segment["end"], ",")
+        cues.append(f"{index}\n{start} --> {end}\n{segment['text'].strip()}\n")
+    return "\n".join(cues)
+
+
+def to_vtt(segments: List[Dict[str, Any]]) -> str:
+    """Render segments as WebVTT subtitles"""
+    cues = ["WEBVTT\n"]
+    for segment in segments:
+        start = format_timestamp(segment["start"], ".")
+        end = format_timestamp(segment["end"], ".")
+        cues.append(f"{start} --> {end}\n{segment['text'].strip()}\n")
+    return "\n".join(cues)
+
+
+def shape_result(result: Dict[str, Any], format: str, fields: Optional[List[str]] = None) -> Any:
+    """
+    Shape a successful transcription result
+
+    Args:
+        result: Transcriber result with text and segments
+        format: One of FORMATS
+        fields: Segment fields to keep for full and compact, None for the defaults
+
+    Returns:
+        Dict for the JSON formats, str for srt and vtt
+    """
+    segments = result["segments"]
+    if format == "srt":
+        return to_srt(segments)
+    if format == "vtt":
+        return to_vtt(segments)
+    if format == "text":
+        return {"text": result["text"], "success": True}
+    if format == "compact":
+        # The text is only sent per segment, clients join it if they need it
+        return {"segments": columns(segments, fields or list(COMPACT_FIELDS)), "success": True}
+    return {
+        "text": result["text"],
+        "segments": select_fields(segments, fields) if fields else segments,
+        "success": True,
+        "error": None,
+    }
+
+
+if __name__ == "__main__":
+    # Simple test
+    example = {
+        "text": " Hello there. General Kenobi.",
+        "segments": [
+            {"id": 0, "start": 0.0, "end": 1.5, "text": " Hello there.", "tokens": [1, 2]},
+            {"id": 1, "start": 1.5, "end": 3723.25, "text": " General Kenobi.", "tokens": [3]},
+        ],
+    }
+    for name in FORMATS:
+        print(f"--- {name}")
+        print(shape_result(example, name))
+    print(shape_result(example, *parse_format("full", "start,text")))
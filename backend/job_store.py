@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+SQLite job store shared by every backend process on a host
+
+Jobs live in one database instead of process memory, so any process can
+accept a job, any other can claim and run it, and every process can report
+its status and result. A claim is an IMMEDIATE transaction, so two processes
+never run the same job. Running jobs hold a lease their owner renews; jobs of
+an owner that died are queued again once the lease runs out.
+
+Batches are recorded here too, so their progress can be read through any
+process. A batch runs in the process that accepted it and holds a lease the
+same way; one whose process died is marked failed.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from config import JOB_STORE_PATH, JOB_LEASE_SECONDS, SHARED_FS
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+BATCH_FIELDS = (
+    "status", "total", "completed", "failed", "skipped", "output_path", "started_at", "finished_at", "error"
+)
+
+JOB_COLUMNS = (
+    "id, sequence, file_path, priority, options, status, progress, created_at, "
+    "started_at, finished_at, result, error, owner"
+)
+
+
+class Job:
+    """A transcription job and its result"""
+
+    def __init__(self, file_path: str, priority: int = 0, options: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the job
+
+        Args:
+            file_path: Path to the uploaded audio file, removed when the job finishes
+            priority: Higher values are scheduled first
+            options: Extra keyword arguments for the transcription function
+        """
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.priority = priority
+        self.options = options or {}
+        self.sequence = 0
+        self.status = QUEUED
+        self.progress = 0.0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Process running the job
+        self.owner: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "Job":
+        """Build a job from a row selected with JOB_COLUMNS"""
+        job = cls(row[2], row[3], json.loads(row[4]))
+        (job.id, job.sequence, _, _, _, job.status, job.progress, job.created_at,
+         job.started_at, job.finished_at, result, job.error, job.owner) = row
+        job.result = json.loads(result) if result is not None else None
+        return job
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Status information for this job"""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "options": self.options,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """Jobs in a SQLite database that several processes use at the same time"""
+
+    def __init__(self, path: str = JOB_STORE_PATH, shared_fs: bool = SHARED_FS):
+        """
+        Initialize the store
+
+        Args:
+            path: Path to the SQLite database file
+            shared_fs: The database is on a network filesystem used by several
+                hosts; WAL needs shared memory, so the rollback journal is used
+        """
+        self.path = path
+        self.shared_fs = shared_fs
+        self.files_dir = os.path.join(os.path.dirname(path), "files")
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Claims wait for each other instead of failing with "database is locked"
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute(f"PRAGMA journal_mode={'DELETE' if shared_fs else 'WAL'}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " sequence INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT UNIQUE NOT NULL,"
+            " file_path TEXT,"
+            " priority INTEGER NOT NULL,"
+            " options TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " progress REAL NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " result TEXT,"
+            " error TEXT,"
+            " owner TEXT,"
+            " lease_until REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_schedule ON jobs (status, priority DESC, sequence)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " sequence INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT UNIQUE NOT NULL,"
+            " status TEXT NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " completed INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " skipped INTEGER NOT NULL DEFAULT 0,"
+            " output_path TEXT NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " error TEXT,"
+            " owner TEXT,"
+            " lease_until REAL)"
+        )
+
+    def keep_file(self, file_path: str, job_id: str) -> str:
+        """
+        Move a job's audio next to the database
+
+        Uploads arrive in the accepting process's scratch directory, which is
+        removed if that process stops, so queued jobs keep their audio here
+        where any process (on any host with shared_fs) can still run them.
+
+        Returns:
+            str: The path the job should use
+        """
+        os.makedirs(self.files_dir, exist_ok=True)
+        dest = os.path.join(self.files_dir, job_id + os.path.splitext(file_path)[1])
+        shutil.move(file_path, dest)
+        return dest
+
+    def add(self, job: Job, max_backlog: int) -> bool:
+        """
+        Queue a job unless the backlog is full
+
+        Args:
+            job: The job to queue, its sequence is set
+            max_backlog: Queued jobs allowed across all processes
+
+        Returns:
+            bool: False if the backlog is full
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if queued >= max_backlog:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (id, file_path, priority, options, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job.id, job.file_path, job.priority, json.dumps(job.options), QUEUED, job.created_at)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        job.sequence = cursor.lastrowid
+        return True
+
+    def claim(self, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Job]:
+        """
+        Take the highest priority queued job
+
+        Args:
+            owner: ID of the claiming process
+            lease_seconds: Seconds the claim holds without a heartbeat
+
+        Returns:
+            Optional[Job]: The claimed job, now running, or None if nothing is queued
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY priority DESC, sequence LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, started_at = ?, lease_until = ? WHERE id = ?",
+                    (RUNNING, owner, now, now + lease_seconds, row[0])
+                )
+                job = self._get(row[0])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def heartbeat(self, owner: str, lease_seconds: float = JOB_LEASE_SECONDS):
+        """Extend the lease of every job and batch the owner is running"""
+        lease_until = time.time() + lease_seconds
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                (lease_until, owner, RUNNING)
+            )
+            self._conn.execute(
+                "UPDATE batches SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (lease_until, owner, QUEUED, RUNNING)
+            )
+
+    def requeue_expired(self) -> List[str]:
+        """
+        Queue again the running jobs whose owner stopped renewing the lease
+
+        Returns:
+            List[str]: IDs of the requeued jobs
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND lease_until < ?", (RUNNING, time.time())
+                )]
+                self._conn.executemany(
+                    "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL, progress = 0 WHERE id = ?",
+                    [(QUEUED, job_id) for job_id in ids]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        for job_id in ids:
+            logger.warning(f"Requeued job {job_id}, its process stopped renewing the lease")
+        return ids
+
+    def release(self, owner: str):
+        """Queue again the jobs an owner is running, used when its process shuts down"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL, progress = 0 "
+                "WHERE owner = ? AND status = ?",
+                (QUEUED, owner, RUNNING)
+            )
+
+    def set_progress(self, job_id: str, progress: float):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    def finish(self, job_id: str, owner: str, status: str,
+               result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> bool:
+        """
+        Record the outcome of a running job
+
+        Returns:
+            bool: False if the job was cancelled or requeued meanwhile and the outcome was dropped
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, finished_at = ?, result = ?, error = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (status, time.time(), json.dumps(result) if result is not None else None, error,
+                 job_id, owner, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Mark a queued or running job cancelled
+
+        Returns:
+            Optional[Job]: The job as it was before, None if it does not exist
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._get(job_id)
+                if job is not None and not job.finished:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                        (CANCELLED, time.time(), job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def add_batch(self, batch: Dict[str, Any], owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """
+        Record a batch the owner is about to run
+
+        Args:
+            batch: Status information of the batch, as from Batch.to_dict
+            owner: ID of the process running it
+            lease_seconds: Seconds the batch stays claimed without a heartbeat
+
+        Returns:
+            bool: False if a batch with the same ID is still running somewhere
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT status, lease_until FROM batches WHERE id = ?", (batch["batch_id"],)
+                ).fetchone()
+                if row is not None and row[0] in (QUEUED, RUNNING) and row[1] >= now:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                # A finished batch with the same ID is being resumed, it starts over as a new row
+                self._conn.execute("DELETE FROM batches WHERE id = ?", (batch["batch_id"],))
+                self._conn.execute(
+                    f"INSERT INTO batches (id, {', '.join(BATCH_FIELDS)}, owner, lease_until) "
+                    f"VALUES (?, {', '.join('?' for _ in BATCH_FIELDS)}, ?, ?)",
+                    (batch["batch_id"],) + tuple(batch[field] for field in BATCH_FIELDS) + (owner, now + lease_seconds)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def update_batch(self, batch: Dict[str, Any], owner: str) -> bool:
+        """
+        Record a batch's progress
+
+        Returns:
+            bool: False if the batch is no longer the owner's, e.g. it was
+                marked failed after the lease ran out
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE batches SET {', '.join(f'{field} = ?' for field in BATCH_FIELDS)} "
+                "WHERE id = ? AND owner = ? AND status IN (?, ?)",
+                tuple(batch[field] for field in BATCH_FIELDS) + (batch["batch_id"], owner, QUEUED, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a batch's status information by ID"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT id, {', '.join(BATCH_FIELDS)} FROM batches WHERE id = ?", (batch_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("batch_id",) + BATCH_FIELDS, row))
+
+    def expire_batches(self) -> List[str]:
+        """
+        Mark failed the batches whose owner stopped renewing the lease
+
+        Returns:
+            List[str]: IDs of the failed batches
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM batches WHERE status IN (?, ?) AND lease_until < ?", (QUEUED, RUNNING, now)
+                )]
+                self._conn.executemany(
+                    "UPDATE batches SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                    [(FAILED, now, "The process running the batch stopped", batch_id) for batch_id in ids]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        for batch_id in ids:
+            logger.warning(f"Batch {batch_id} failed, its process stopped renewing the lease")
+        return ids
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        row = self._conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID"""
+        with self._lock:
+            return self._get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """Number of queued jobs scheduled before this one, None if not queued"""
+        if job.status != QUEUED:
+            return None
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND "
+                "(priority > ? OR (priority = ? AND sequence < ?))",
+                (QUEUED, job.priority, job.priority, job.sequence)
+            ).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state"""
+        counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+        with self._lock:
+            for status, count in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    def prune(self, history_size: int):
+        """Forget the oldest finished jobs and batches beyond the history size"""
+        with self._lock:
+            for table in ("jobs", "batches"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE status IN (?, ?, ?) AND sequence NOT IN ("
+                    f" SELECT sequence FROM {table} WHERE status IN (?, ?, ?) ORDER BY sequence DESC LIMIT ?)",
+                    FINISHED_STATES + FINISHED_STATES + (history_size,)
+                )
+
+
+def _self_check_worker(path: str, worker: int, results):
+    """Claim and finish jobs until the store runs dry, see __main__"""
+    store = JobStore(path)
+    owner = f"worker-{worker}"
+    claimed = []
+    while True:
+        job = store.claim(owner)
+        if job is None:
+            break
+        time.sleep(0.002)
+        store.finish(job.id, owner, COMPLETED, {"text": job.options["n"], "by": owner})
+        claimed.append(job.id)
+    results.put(claimed)
+
+
+if __name__ == "__main__":
+    # Simple test: several processes drain one store, no job runs twice
+    import multiprocessing
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "jobs.db")
+        store = JobStore(path)
+        jobs = [Job("", priority=i % 3, options={"n": i}) for i in range(200)]
+        for job in jobs:
+            assert store.add(job, max_backlog=1000)
+        assert not store.add(Job(""), max_backlog=200), "backlog limit not enforced"
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_self_check_worker, args=(path, i, results)) for i in range(4)
+        ]
+        for process in processes:
+            process.start()
+        claimed = [job_id for _ in processes for job_id in results.get()]
+        for process in processes:
+            process.join()
+
+        assert sorted(claimed) == sorted(job.id for job in jobs), "a job was lost or run twice"
+        assert store.counts()[COMPLETED] == len(jobs)
+        assert store.get(jobs[7].id).result["text"] == 7
+        print(f"{len(jobs)} jobs claimed once each by {len(processes)} processes: "
+              f"{sorted(len([j for j in claimed if store.get(j).result['by'] == f'worker-{i}']) for i in range(4))}")
+
+        # A job whose owner died is queued again once its lease runs out
+        job = Job("", options={"n": -1})
+        store.add(job, max_backlog=1000)
+        assert store.claim("dead", lease_seconds=0.01).id == job.id
+        time.sleep(0.05)
+        assert store.requeue_expired() == [job.id]
+        assert not store.finish(job.id, "dead", COMPLETED, {}), "stale owner finished a requeued job"
+        assert store.claim("alive").id == job.id
+
+        store.prune(10)
+        assert store.counts()[COMPLETED] == 10
+
+        # A batch is visible through another connection and runs in one process at a time
+        batch = {"batch_id": "b1", "status": QUEUED, "total": 2, "completed": 0, "failed": 0, "skipped": 0,
+                 "output_path": "b1.jsonl", "started_at": None, "finished_at": None, "error": None}
+        assert store.add_batch(batch, "dead", lease_seconds=0.01)
+        time.sleep(0.05)
+        assert JobStore(path).add_batch(batch, "alive"), "expired batch not taken over"
+        assert not store.add_batch(batch, "other"), "batch ran twice"
+        assert JobStore(path).update_batch(dict(batch, status=RUNNING, completed=1), "alive")
+        assert not store.update_batch(dict(batch, completed=2), "dead"), "stale owner updated a batch"
+        assert store.get_batch("b1")["completed"] == 1
+        store.add_batch(dict(batch, batch_id="b2"), "dead", lease_seconds=0.01)
+        time.sleep(0.05)
+        assert store.expire_batches() == ["b2"] and store.get_batch("b2")["status"] == FAILED
+        print("Job store OK")
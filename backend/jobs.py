@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Asynchronous transcription jobs with a priority-aware scheduler
+
+Jobs are kept in a JobStore shared by every backend process, so a job
+submitted to one process may be run by any of them.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import (
+    MAX_CONCURRENT_TRANSCRIPTIONS, MAX_JOB_BACKLOG, JOB_HISTORY_SIZE, JOB_POLL_INTERVAL, JOB_LEASE_SECONDS,
+)
+from archive import TranscriptArchive
+from cancellation import CancelToken, JOB_CANCELLED, SHUTDOWN
+from dispatcher import Dispatcher, QueueFullError
+from job_store import Job, JobStore, QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED, FINISHED_STATES
+from scratch import scratch
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+class JobManager:
+    """Schedule transcription jobs by priority on a fixed number of runners"""
+
+    def __init__(self, run_func: Callable[[str], Tuple[bool, Dict[str, Any]]],
+                 dispatcher: Dispatcher,
+                 concurrency: int = MAX_CONCURRENT_TRANSCRIPTIONS,
+                 max_backlog: int = MAX_JOB_BACKLOG,
+                 history_size: int = JOB_HISTORY_SIZE,
+                 store: Optional[JobStore] = None,
+                 poll_interval: float = JOB_POLL_INTERVAL,
+                 lease_seconds: float = JOB_LEASE_SECONDS,
+                 archive: Optional[TranscriptArchive] = None):
+        """
+        Initialize the job manager
+
+        Args:
+            run_func: Blocking function that transcribes a file, like ModelRegistry.transcribe
+            dispatcher: Dispatcher used to run run_func off the event loop
+            concurrency: Number of jobs this process runs at the same time
+            max_backlog: Number of queued jobs, across all processes, before submissions are rejected
+            history_size: Number of finished jobs kept for result retrieval
+            store: Job store shared with the other processes, the default store if None
+            poll_interval: Seconds between checks for jobs queued by other processes
+            lease_seconds: Seconds a claimed job stays claimed without a heartbeat
+            archive: Archive completed transcripts are indexed in, under the job ID
+        """
+        self.run_func = run_func
+        self.dispatcher = dispatcher
+        self.concurrency = max(concurrency, 1)
+        self.max_backlog = max_backlog
+        self.history_size = history_size
+        self.store = store if store is not None else JobStore()
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.archive = archive
+        # Tokens of the jobs this process is running, to stop them when cancelled
+        self._cancels: Dict[str, CancelToken] = {}
+        # Identifies this process's claims in the shared store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._runners: List[asyncio.Task] = []
+        self._maintainer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the job runners on the current event loop"""
+        self._wakeup = asyncio.Condition()
+        # Jobs and batches left running by a process that died before this one started
+        await asyncio.to_thread(self.store.requeue_expired)
+        await asyncio.to_thread(self.store.expire_batches)
+        self._runners = [
+            asyncio.create_task(self._run_jobs(i)) for i in range(self.concurrency)
+        ]
+        self._maintainer = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        """Stop the job runners and hand this process's running jobs back to the queue"""
+        tasks = self._runners + ([self._maintainer] if self._maintainer is not None else [])
+        for task in tasks:
+            task.cancel()
+        # Another process reruns them from the start, so their inference is of no use
+        for cancel in list(self._cancels.values()):
+            cancel.cancel(SHUTDOWN)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runners = []
+        self._maintainer = None
+        await asyncio.to_thread(self.store.release, self.owner)
+
+    async def submit(self, file_path: str, priority: int = 0, **options) -> Job:
+        """
+        Queue a file for transcription
+
+        Args:
+            file_path: Path to the audio file, owned by the job from now on
+                and removed if the job is rejected
+            priority: Higher values are scheduled first
+            **options: Extra keyword arguments for run_func, such as the model
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            QueueFullError: If the backlog is full
+        """
+        job = Job(file_path, priority, options)
+        job.file_path = await asyncio.to_thread(self.store.keep_file, file_path, job.id)
+        # Moved out of scratch, stop counting it there
+        scratch.remove(file_path)
+        if not await asyncio.to_thread(self.store.add, job, self.max_backlog):
+            self._cleanup(job)
+            raise QueueFullError(f"Job backlog is full ({self.max_backlog} queued)")
+
+        async with self._wakeup:
+            self._wakeup.notify()
+
+        logger.info(f"Queued job {job.id} with priority {priority}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID, whichever process accepted or runs it"""
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def position(self, job: Job) -> Optional[int]:
+        """Number of queued jobs scheduled before this one, None if not queued"""
+        return await asyncio.to_thread(self.store.position, job)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a job
+
+        Queued jobs are dropped from the schedule. Running jobs are marked
+        cancelled and their inference stopped, right away in this process
+        and within the poll interval in others.
+
+        Args:
+            job_id: ID of the job
+
+        Returns:
+            Optional[Job]: The job, or None if it does not exist
+        """
+        job = await asyncio.to_thread(self.store.cancel, job_id)
+        if job is None or job.finished:
+            return job
+
+        # A running job's file is removed by the process running it
+        if job.status == QUEUED:
+            self._cleanup(job)
+        elif job.id in self._cancels:
+            self._cancels[job.id].cancel(JOB_CANCELLED)
+        logger.info(f"Cancelled job {job.id}")
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _next_job(self) -> Job:
+        """Wait for the highest priority queued job"""
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.owner, self.lease_seconds)
+            if job is not None:
+                return job
+            # Woken by a submit to this process, or look again for jobs other processes queued
+            async with self._wakeup:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _maintain(self):
+        """Renew the leases of this process's jobs and batches, and clean up after processes that died"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner, self.lease_seconds)
+                if await asyncio.to_thread(self.store.requeue_expired):
+                    async with self._wakeup:
+                        self._wakeup.notify_all()
+                await asyncio.to_thread(self.store.expire_batches)
+            except sqlite3.Error as e:
+                logger.error(f"Job store maintenance failed: {str(e)}")
+
+    async def _watch_cancel(self, job: Job, cancel: CancelToken):
+        """Stop a running job's inference once it is cancelled, possibly through another process"""
+        while not cancel.cancelled:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                current = await asyncio.to_thread(self.store.get, job.id)
+            except sqlite3.Error:
+                continue
+            if current is None or current.status == CANCELLED:
+                cancel.cancel(JOB_CANCELLED)
+
+    async def _run_jobs(self, runner_id: int):
+        """Runner loop that executes jobs one at a time"""
+        while True:
+            job = await self._next_job()
+
+            cancel = CancelToken()
+            self._cancels[job.id] = cancel
+            watcher = asyncio.create_task(self._watch_cancel(job, cancel))
+            try:
+                while True:
+                    try:
+                        success, result = await self.dispatcher.run(
+                            self.run_func, job.file_path,
+                            progress_callback=self._progress_updater(job), cancel=cancel, **job.options
+                        )
+                        break
+                    except QueueFullError:
+                        # Direct /transcribe requests are using every slot, retry shortly
+                        await asyncio.sleep(0.5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                success, result = False, {"error": f"Transcription failed: {str(e)}"}
+            finally:
+                watcher.cancel()
+                del self._cancels[job.id]
+
+            status = COMPLETED if success else FAILED
+            recorded = await asyncio.to_thread(
+                self.store.finish, job.id, self.owner, status,
+                result if success else None, None if success else result.get("error")
+            )
+            if not recorded:
+                # Cancelled meanwhile, or requeued after the lease ran out and now another process's
+                current = await asyncio.to_thread(self.store.get, job.id)
+                if current is not None and current.status == CANCELLED:
+                    self._cleanup(job)
+                continue
+
+            self._cleanup(job)
+            if success and self.archive is not None:
+                try:
+                    await asyncio.to_thread(self.archive.add, result, job.id, None, job.options.get("model"))
+                except Exception as e:
+                    logger.warning(f"Failed to archive job {job.id}: {str(e)}")
+            await asyncio.to_thread(self.store.prune, self.history_size)
+            logger.info(f"Job {job.id} {status} in {time.time() - job.started_at:.2f}s")
+
+    def _progress_updater(self, job: Job) -> Callable[[float], None]:
+        """Callback the transcriber uses to report a job's progress"""
+        def update(progress: float):
+            self.store.set_progress(job.id, progress)
+        return update
+
+    def _cleanup(self, job: Job):
+        """Remove the job's uploaded file"""
+        if job.file_path and os.path.exists(job.file_path):
+            try:
+                os.unlink(job.file_path)
+            except OSError as e:
+                logger.error(f"Error removing job file: {str(e)}")
+
+    async def status(self) -> Dict[str, Any]:
+        """Status information for the job manager"""
+        return {
+            "concurrency": self.concurrency,
+            "max_backlog": self.max_backlog,
+            "owner": self.owner,
+            "store": self.store.path,
+            "jobs": await asyncio.to_thread(self.store.counts),
+        }
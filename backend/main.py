@@ -1,12 +1,43 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 import os
-import subprocess
-import tempfile
 import json
+import asyncio
+import hashlib
 import logging
+import uuid
+
+from transcriber import transcriber
+from models import registry, list_models, ModelError, ModelUnavailableError
+from dispatcher import dispatcher, QueueFullError
+from jobs import JobManager, COMPLETED, FAILED, QUEUED
+from metrics import metrics
+from preflight import Preflight
+from uploads import save_upload, UploadError, UploadRoute
+from config import (
+    MAX_UPLOAD_BYTES, BATCH_DIR, BATCH_ROOT, WHISPER_CPP_DIR, LAYOUT, GZIP_MIN_BYTES, REQUEST_TIMEOUT_SECONDS,
+)
+from batch import Batch, find_audio_files
+from streaming import StreamBacklogError, StreamingSession
+from archive import ArchiveError, open_archive
+from cancellation import CancelToken, DEADLINE, DISCONNECT, SHUTDOWN
+from formats import FormatError, SUBTITLE_MEDIA_TYPES, parse_format, shape_result
+from scratch import scratch
+from segments import shift_result, shift_segment
+
+# orjson serializes large segment lists several times faster than the json module
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
 
 # Setup logging
 logging.basicConfig(
@@ -15,7 +46,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Whisper.cpp Transcription API")
+app = FastAPI(title="Whisper.cpp Transcription API", default_response_class=FastJSONResponse)
+# Uploads are parsed straight into scratch files, see uploads.py
+app.router.route_class = UploadRoute
 
 # Add CORS middleware to allow requests from the Tauri app
 app.add_middleware(
@@ -26,19 +59,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Path to the whisper.cpp directory
-WHISPER_CPP_DIR = os.path.join(os.path.dirname(
-    os.path.abspath(__file__)), "whisper.cpp")
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip responses, except streamed transcriptions, whose records must not wait in the compressor"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            accept = Headers(scope=scope).get("accept", "")
+            if any(media_type in accept for media_type in STREAM_MEDIA_TYPES):
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+
+if GZIP_MIN_BYTES > 0:
+    # Level 6 compresses multi-MB transcripts nearly as well as 9 at a fraction of the CPU
+    app.add_middleware(CompressionMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=6)
+
+
+class UploadLimitMiddleware:
+    """
+    Reject oversized uploads from their Content-Length before reading the body,
+    and stop reading bodies without one, e.g. chunked, once they pass the limit
+
+    A plain ASGI middleware rather than @app.middleware("http"), whose
+    wrapped receive channel hides client disconnects from the endpoints.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            content_length = Headers(scope=scope).get("content-length")
+            # Allow some room for the multipart framing around the file
+            if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit"}
+                )
+                await response(scope, receive, send)
+                return
+            receive = self.limit_body(receive)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def limit_body(receive):
+        """Wrap the receive channel to count the body bytes as they arrive"""
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_UPLOAD_BYTES + 64 * 1024:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+            return message
+        return limited_receive
+
+
+app.add_middleware(UploadLimitMiddleware)
+
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request: Request, exc: UploadError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)})
+
+
+# Path to the whisper.cpp models
 WHISPER_MODEL_DIR = os.path.join(WHISPER_CPP_DIR, "models")
 WHISPER_MODEL_PATH = os.path.join(WHISPER_MODEL_DIR, "ggml-base.en.bin")
 
-# Check if whisper.cpp is installed
-if not os.path.exists(WHISPER_CPP_DIR):
-    logger.error(
-        "whisper.cpp directory not found. Please clone and build it first.")
-
-# Ensure the model directory exists
-os.makedirs(WHISPER_MODEL_DIR, exist_ok=True)
+# Installation checks and model warm-up, run once at startup
+preflight = Preflight(registry)
 
 
 class TranscriptionResponse(BaseModel):
@@ -46,6 +140,170 @@ class TranscriptionResponse(BaseModel):
     segments: Optional[list] = None
     success: bool = True
     error: Optional[str] = None
+    recording_id: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    priority: int = 0
+    options: dict = {}
+    progress: float = 0.0
+    position: Optional[int] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    completed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    output_path: str
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+# Background transcription jobs, scheduled by priority
+# Finished transcripts, searchable through /search (None when SCRIBLY_ARCHIVE_PATH is empty)
+archive = open_archive()
+
+job_manager = JobManager(registry.transcribe, dispatcher, archive=archive)
+
+
+def collect_gauges():
+    """Queue depth, worker utilization and cache hit ratio at scrape time"""
+    yield "scribly_queue_depth", "Transcriptions waiting to run", [
+        ({"queue": "dispatcher"}, dispatcher.queued),
+        # Rendered in the threadpool, so the store is read directly
+        ({"queue": "jobs"}, job_manager.store.counts()[QUEUED]),
+    ]
+    yield "scribly_transcriptions_running", "Transcriptions running on the dispatcher", [
+        ({}, dispatcher.running),
+    ]
+
+    workers, busy, caches = [], [], {}
+    for name, model_transcriber in list(registry.transcribers.items()):
+        if model_transcriber.cache is not None:
+            caches[model_transcriber.cache.path] = model_transcriber.cache
+        engine = model_transcriber.engine
+        if engine is None:
+            continue
+        workers.append(({"model": name, "engine": engine.name}, engine.size))
+        busy.append(({"model": name, "engine": engine.name}, engine.busy()))
+    yield "scribly_workers", "Requests the resident engine serves at once (whisper-server workers or library states)", workers
+    yield "scribly_workers_busy", "Workers or library states serving a request", busy
+    yield "scribly_worker_utilization", "Fraction of workers serving a request", [
+        (labels, count / total if total else 0.0) for (labels, total), (_, count) in zip(workers, busy)
+    ]
+
+    stats = [cache.stats() for cache in caches.values()]
+    yield "scribly_cache_hit_ratio", "Transcription cache hits per lookup", [
+        ({"path": s["path"]}, s["hit_ratio"]) for s in stats
+    ]
+    yield "scribly_cache_bytes", "Size of cached transcription results", [
+        ({"path": s["path"]}, s["size_bytes"]) for s in stats
+    ]
+
+
+metrics.register_collector(collect_gauges)
+
+
+async def job_response(job) -> JobResponse:
+    """Build the status response for a job"""
+    return JobResponse(position=await job_manager.position(job), **job.to_dict())
+
+
+def require_format(format: Optional[str], fields: Optional[str]):
+    """Validate the format and fields parameters, see formats.py"""
+    try:
+        return parse_format(format, fields)
+    except FormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def result_response(result: dict, format: str, fields: Optional[List[str]],
+                    recording_id: Optional[str] = None) -> Response:
+    """
+    Build the response for a successful transcription in the requested format
+
+    The content is serialized directly, skipping response model validation,
+    which costs more than the serialization itself for long transcripts.
+    """
+    content = shape_result(result, format, fields)
+    headers = {"X-Recording-Id": recording_id} if recording_id else None
+    if format in SUBTITLE_MEDIA_TYPES:
+        return PlainTextResponse(content, media_type=SUBTITLE_MEDIA_TYPES[format], headers=headers)
+    if recording_id:
+        content["recording_id"] = recording_id
+    return FastJSONResponse(content, headers=headers)
+
+
+async def archive_result(result: dict, recording_id: Optional[str], name: Optional[str],
+                         model: Optional[str], offset: float = 0.0) -> Optional[str]:
+    """Archive and index a transcript, returning its recording ID, or None if the archive is off"""
+    if archive is None:
+        return None
+    try:
+        return await run_in_threadpool(archive.add, result, recording_id, name, model, offset)
+    except Exception as e:
+        logger.warning(f"Failed to archive transcript: {str(e)}")
+        return None
+
+
+def require_archive():
+    """The transcript archive, or a 404 if it is disabled"""
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Transcript archive is disabled, set SCRIBLY_ARCHIVE_PATH")
+    return archive
+
+
+# Seconds between checks whether the client of a running transcription is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+def require_timeout(request: Request, timeout: Optional[float]) -> Optional[float]:
+    """
+    Seconds the request may take: the timeout parameter or X-Request-Timeout header,
+    capped by SCRIBLY_REQUEST_TIMEOUT, None for no deadline
+    """
+    if timeout is None:
+        header = request.headers.get("x-request-timeout")
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid X-Request-Timeout: {header}")
+    if timeout is not None and timeout <= 0:
+        raise HTTPException(status_code=400, detail="The timeout must be positive")
+
+    if REQUEST_TIMEOUT_SECONDS > 0:
+        return min(timeout, REQUEST_TIMEOUT_SECONDS) if timeout else REQUEST_TIMEOUT_SECONDS
+    return timeout
+
+
+async def watch_disconnect(request: Request, cancel: CancelToken):
+    """Cancel the token as soon as the client disconnects, run as a task next to the work"""
+    while not cancel.cancelled:
+        if await request.is_disconnected():
+            cancel.cancel(DISCONNECT)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+def require_model(model: Optional[str]) -> str:
+    """Resolve a requested model, rejecting unknown ones and ones still downloading"""
+    try:
+        return registry.check_available(model)
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    except ModelError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/")
@@ -53,94 +311,215 @@ async def root():
     return {"message": "Whisper.cpp Transcription API"}
 
 
-@app.post("/transcribe", response_model=TranscriptionResponse)
-async def transcribe(file: UploadFile = File(...), background_tasks: BackgroundTasks = BackgroundTasks()):
+@app.get("/ready")
+async def ready():
+    """Whether startup checks and warm-up are done; 503 until then or if they failed"""
+    status = preflight.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.on_event("startup")
+def start_preflight():
+    """Check the installation, load and warm up the models in the background, see /ready"""
+    preflight.start()
+
+
+@app.on_event("startup")
+def start_scratch():
+    """Remove scratch files left by processes that stopped and start sweeping for orphans"""
+    scratch.start()
+
+
+@app.on_event("startup")
+async def start_jobs():
+    """Start the background job runners"""
+    await job_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    """Stop the background job runners"""
+    await job_manager.stop()
+
+
+@app.on_event("shutdown")
+async def stop_batches():
+    """Stop the running batches, resubmitting a directory resumes it"""
+    for cancel in list(batch_tasks.values()):
+        cancel.cancel(SHUTDOWN)
+    await asyncio.gather(*batch_tasks, return_exceptions=True)
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    """Stop the resident whisper-server workers"""
+    registry.stop_all()
+
+
+@app.on_event("shutdown")
+def stop_scratch():
+    """Remove this process's scratch files"""
+    scratch.stop()
+
+
+# Media types /transcribe can stream segments in, chosen with the Accept header
+STREAM_MEDIA_TYPES = ("application/x-ndjson", "text/event-stream")
+
+
+def format_record(kind: str, payload: dict, media_type: str) -> str:
+    """Encode one streamed record as an NDJSON line or a Server-Sent Event"""
+    if media_type == "text/event-stream":
+        return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"type": kind, **payload}) + "\n"
+
+
+def stream_transcription(audio_file: str, model: Optional[str], media_type: str,
+                         recording_id: Optional[str] = None, name: Optional[str] = None,
+                         timeout: Optional[float] = None, offset: float = 0.0) -> StreamingResponse:
+    """
+    Transcribe a saved upload and stream each segment as whisper produces it
+
+    Segments are sent as "segment" records, followed by a "done" record with
+    the full text, or an "error" record if the transcription fails.
+
+    Args:
+        audio_file: Path to the saved upload, removed once transcribed
+        model: Model name, None for the default
+        media_type: One of STREAM_MEDIA_TYPES
+        recording_id: ID to archive the transcript under, a new one if None
+        name: Name of the recording in the archive
+        timeout: Seconds until the inference is stopped, None for no deadline
+        offset: Seconds into a longer recording where the upload starts
+    """
+    loop = asyncio.get_running_loop()
+    updates: asyncio.Queue = asyncio.Queue()
+    cancel = CancelToken(timeout)
+
+    def on_segment(segment: dict):
+        loop.call_soon_threadsafe(updates.put_nowait, shift_segment(segment, offset))
+
     try:
-        # Save the uploaded file to a temporary location
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            temp_file_path = temp_file.name
-            # Write the uploaded file content to the temporary file
-            content = await file.read()
-            temp_file.write(content)
-
-        # Check if the model exists, if not download it
-        if not os.path.exists(WHISPER_MODEL_PATH):
-            logger.info("Downloading Whisper model...")
-            download_script = os.path.join(
-                WHISPER_CPP_DIR, "models", "download-ggml-model.sh")
-            subprocess.run(
-                ["bash", download_script, "base.en"],
-                cwd=WHISPER_CPP_DIR,
-                check=True
-            )
+        future = dispatcher.submit(registry.transcribe, audio_file, model=model, segment_callback=on_segment,
+                                   cancel=cancel)
+    except QueueFullError as e:
+        cancel.close()
+        scratch.remove(audio_file)
+        raise HTTPException(status_code=429, detail=str(e))
 
-        # Path to the whisper-cli executable
-        whisper_cli = os.path.join(
-            WHISPER_CPP_DIR, "build", "bin", "whisper-cli")
+    # Runs after every segment queued by the worker thread
+    future.add_done_callback(lambda _: updates.put_nowait(None))
+    future.add_done_callback(lambda _: scratch.remove(audio_file))
 
-        if not os.path.exists(whisper_cli):
-            raise HTTPException(
-                status_code=500,
-                detail="whisper-cli not found. Please build whisper.cpp first."
-            )
+    async def records():
+        try:
+            while True:
+                segment = await updates.get()
+                if segment is None:
+                    break
+                yield format_record("segment", segment, media_type)
+        finally:
+            # The response stops early when the client disconnects
+            if not future.done():
+                cancel.cancel(DISCONNECT)
+            cancel.close()
 
-        # Create a temporary file for the JSON output
-        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as json_file:
-            json_file_path = json_file.name
-
-        # Run whisper-cli with JSON output
-        cmd = [
-            whisper_cli,
-            "-m", WHISPER_MODEL_PATH,
-            "-f", temp_file_path,
-            "-oj",  # Output JSON
-            # Output file path without extension
-            "-of", os.path.splitext(json_file_path)[0]
-        ]
-
-        logger.info(f"Running transcription: {' '.join(cmd)}")
-        subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
+        try:
+            success, result = future.result()
+        except Exception as e:
+            success, result = False, {"error": f"Transcription failed: {str(e)}"}
 
-        # Read the JSON output
-        with open(json_file_path, "r") as f:
-            transcription_data = json.load(f)
+        if not success:
+            logger.error(f"Transcription error: {result['error']}")
+            yield format_record("error", {"success": False, "error": result["error"]}, media_type)
+            return
+        result = shift_result(result, offset)
+        yield format_record("done", {
+            "success": True,
+            "recording_id": await archive_result(result, recording_id, name, model, offset),
+            "text": result["text"],
+            "language": result.get("language"),
+            "segment_count": len(result["segments"]),
+        }, media_type)
 
-        # Clean up temporary files in the background
-        def cleanup_files():
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+    return StreamingResponse(
+        records(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-            if os.path.exists(json_file_path):
-                os.unlink(json_file_path)
 
-        if background_tasks:
-            background_tasks.add_task(cleanup_files)
-        else:
-            cleanup_files()
+@app.post("/transcribe", response_model=TranscriptionResponse)
+async def transcribe(request: Request, file: UploadFile = File(...), model: Optional[str] = Form(None),
+                     format: Optional[str] = Form(None), fields: Optional[str] = Form(None),
+                     recording_id: Optional[str] = Form(None), timeout: Optional[float] = Form(None),
+                     offset: float = Form(0.0)):
+    """
+    Transcribe an uploaded file
 
-        # Extract the full text and segments
-        full_text = " ".join([segment.get("text", "")
-                             for segment in transcription_data.get("segments", [])])
+    Set format to full (default), text, compact, srt or vtt, and fields to
+    the segment fields to keep, e.g. "start,end,text". With the archive
+    enabled the transcript is indexed under recording_id (or a new ID
+    returned in the response) for /search. For a piece of a longer
+    recording, such as a segment the recorder finished while it keeps
+    recording, offset is the second it starts at: timestamps are returned in
+    recording time and the piece is added to the archived recording. The inference is stopped when
+    the client disconnects or after timeout seconds (or the
+    X-Request-Timeout header, capped by SCRIBLY_REQUEST_TIMEOUT), which
+    returns 504. Send Accept:
+    application/x-ndjson or text/event-stream to receive each segment as
+    soon as it is transcribed instead of one response at the end.
+    """
+    format, fields = require_format(format, fields)
+    timeout = require_timeout(request, timeout)
+    if not 0 <= offset < float("inf"):
+        raise HTTPException(status_code=400, detail="offset must be a non-negative number of seconds")
+    model = require_model(model)
+    try:
+        # Save the uploaded file to a temporary location
+        temp_file_path = await save_upload(file)
 
-        return TranscriptionResponse(
-            text=full_text,
-            segments=transcription_data.get("segments", []),
-            success=True
-        )
+        accept = request.headers.get("accept", "")
+        for media_type in STREAM_MEDIA_TYPES:
+            if media_type in accept:
+                return stream_transcription(temp_file_path, model, media_type, recording_id, file.filename, timeout,
+                                            offset)
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Transcription process error: {e.stderr}")
-        return TranscriptionResponse(
-            text="",
-            success=False,
-            error=f"Transcription failed: {e.stderr}"
-        )
+        # Run on the resident engine, or a one-off whisper-cli if it is down.
+        # The call blocks, so it runs on the dispatcher's thread pool to keep
+        # the event loop free for other requests. The upload is removed as
+        # soon as whisper is done with it.
+        cancel = CancelToken(timeout)
+        watcher = asyncio.create_task(watch_disconnect(request, cancel))
+        try:
+            success, result = await dispatcher.run(registry.transcribe, temp_file_path, model=model, cancel=cancel)
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        finally:
+            watcher.cancel()
+            cancel.close()
+            scratch.remove(temp_file_path)
+
+        if not success and result.get("cancelled") == DEADLINE:
+            raise HTTPException(status_code=504, detail=f"Transcription did not finish within {timeout:g}s")
+
+        if not success and result.get("status_code"):
+            # Scratch space ran out
+            raise HTTPException(status_code=result["status_code"], detail=result["error"])
+
+        if not success:
+            logger.error(f"Transcription error: {result['error']}")
+            return TranscriptionResponse(
+                text="",
+                success=False,
+                error=result["error"]
+            )
+
+        result = shift_result(result, offset)
+        recording_id = await archive_result(result, recording_id, file.filename, model, offset)
+        return result_response(result, format, fields, recording_id)
+
+    except (HTTPException, UploadError):
+        raise
 
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}")
@@ -151,16 +530,329 @@ async def transcribe(file: UploadFile = File(...), background_tasks: BackgroundT
         )
 
 
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(file: UploadFile = File(...), priority: int = Form(0), model: Optional[str] = Form(None)):
+    """Queue a file for transcription and return its job ID immediately"""
+    model = require_model(model)
+
+    temp_file_path = await save_upload(file)
+    try:
+        job = await job_manager.submit(temp_file_path, priority, model=model)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return await job_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """Get the status and progress of a job"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await job_response(job)
+
+
+@app.get("/jobs/{job_id}/result", response_model=TranscriptionResponse)
+async def get_job_result(job_id: str, format: Optional[str] = None, fields: Optional[str] = None):
+    """Get the transcription of a finished job, in the same formats as /transcribe"""
+    format, fields = require_format(format, fields)
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job.status == COMPLETED:
+        # Jobs are archived under their own ID
+        return result_response(job.result, format, fields, job.id if archive is not None else None)
+
+    if job.status == FAILED:
+        return TranscriptionResponse(text="", success=False, error=job.error)
+
+    raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+
+
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await job_response(job)
+
+
+async def transcribe_window(websocket: WebSocket, session: StreamingSession, stream_transcriber,
+                            flush: bool = False, cancel: Optional[CancelToken] = None):
+    """Transcribe the session's current window and send the result to the client"""
+    window, offset, final = session.take_window(flush)
+    if len(window) == 0:
+        return
+
+    while True:
+        try:
+            result = await dispatcher.run(stream_transcriber.transcribe_samples, window, cancel=cancel)
+            break
+        except QueueFullError:
+            if not final:
+                # Skip this partial update, the next step covers the same audio
+                return
+            await asyncio.sleep(0.2)
+
+    await websocket.send_json(StreamingSession.make_message(result, offset, final))
+
+
+# Batches running in this process and the tokens that stop them
+batch_tasks: Dict[asyncio.Task, CancelToken] = {}
+
+
+@app.post("/transcribe/batch", response_model=BatchResponse, status_code=202)
+async def transcribe_batch(files: List[UploadFile] = File(None), directory: Optional[str] = Form(None),
+                           model: Optional[str] = Form(None), resume: bool = Form(True)):
+    """
+    Transcribe many files in the background, longest first, into a JSONL file
+
+    Either upload the files or name a directory under SCRIBLY_BATCH_ROOT.
+    Submitting the same directory and model again resumes an interrupted
+    batch, skipping files already in its results.
+    """
+    model = require_model(model)
+
+    if bool(files) == bool(directory):
+        raise HTTPException(status_code=400, detail="Upload files or name a directory, not both")
+
+    if directory:
+        if not BATCH_ROOT:
+            raise HTTPException(status_code=403, detail="Server-side batch paths are disabled")
+        root = os.path.realpath(BATCH_ROOT)
+        target = os.path.realpath(os.path.join(root, directory))
+        if target != root and not target.startswith(root + os.sep):
+            raise HTTPException(status_code=403, detail="Directory is outside the batch root")
+        if not os.path.isdir(target):
+            raise HTTPException(status_code=404, detail="Directory not found")
+
+        items = [(os.path.relpath(path, target), path) for path in await run_in_threadpool(find_audio_files, target)]
+        # Same directory and model, same batch, so a resubmission resumes it
+        batch_id = hashlib.sha256(f"{target}:{model}".encode()).hexdigest()[:32]
+        batch = Batch(items, os.path.join(BATCH_DIR, f"{batch_id}.jsonl"), batch_id=batch_id)
+    else:
+        uploads = []
+        try:
+            for index, file in enumerate(files):
+                uploads.append((file.filename or f"file-{index}", await save_upload(file)))
+        except BaseException:
+            for _, path in uploads:
+                scratch.remove(path)
+            raise
+        batch_id = uuid.uuid4().hex
+        # Kept with the job audio, out of scratch, whose age limit and quota are meant for single requests
+        items = []
+        for index, (name, path) in enumerate(uploads):
+            items.append((name, await asyncio.to_thread(job_manager.store.keep_file, path, f"{batch_id}-{index}")))
+            scratch.remove(path)
+        batch = Batch(items, os.path.join(BATCH_DIR, f"{batch_id}.jsonl"), remove_files=True, batch_id=batch_id)
+
+    # Recorded in the job store, so every process can report the batch's progress
+    store = job_manager.store
+    if not await asyncio.to_thread(store.add_batch, batch.to_dict(), job_manager.owner, job_manager.lease_seconds):
+        raise HTTPException(status_code=409, detail="Batch is already running")
+    batch.update_callback = lambda info: store.update_batch(info, job_manager.owner)
+    cancel = CancelToken()
+
+    async def run_batch():
+        try:
+            engine = await asyncio.to_thread(registry.get, model)
+        except ModelError as e:
+            logger.error(f"Batch {batch.id} failed: {str(e)}")
+            await asyncio.to_thread(batch.fail, str(e))
+            return
+        await batch.run(dispatcher, registry.transcribe, max_workers=engine.parallelism(), resume=resume,
+                        cancel=cancel, model=model)
+
+    task = asyncio.create_task(run_batch())
+    batch_tasks[task] = cancel
+    task.add_done_callback(lambda task: batch_tasks.pop(task, None))
+    return BatchResponse(**batch.to_dict())
+
+
+@app.get("/transcribe/batch/{batch_id}", response_model=BatchResponse)
+async def get_batch(batch_id: str):
+    """Get the progress of a batch, whichever process runs it"""
+    batch = await asyncio.to_thread(job_manager.store.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return BatchResponse(**batch)
+
+
+@app.get("/transcribe/batch/{batch_id}/results")
+async def get_batch_results(batch_id: str):
+    """Download a batch's results as JSON lines, one per file"""
+    batch = await asyncio.to_thread(job_manager.store.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if not os.path.exists(batch["output_path"]):
+        raise HTTPException(status_code=409, detail=f"Batch is {batch['status']}")
+    return FileResponse(batch["output_path"], media_type="application/x-ndjson")
+
+
+@app.websocket("/ws/stream")
+async def stream(websocket: WebSocket, model: Optional[str] = None):
+    """
+    Live transcription of 16 kHz mono 16-bit PCM sent as binary frames
+
+    The optional model query parameter selects the model.
+
+    Partial results for the current window are sent as new audio arrives,
+    followed by a final result once the window is full. Send a text frame
+    {"type": "stop"} to flush the remaining audio and end the stream.
+    """
+    await websocket.accept()
+    try:
+        # Held for the whole session, so the model is not unloaded between windows
+        model = registry.acquire(model)
+    except ModelError as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+        return
+    try:
+        stream_transcriber = await run_in_threadpool(registry.get, model)
+    except ModelError as e:
+        registry.release(model)
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+        return
+
+    session = StreamingSession()
+    inference = None
+    # Stops the window being transcribed when the client goes away
+    cancel = CancelToken()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("bytes"):
+                session.append(message["bytes"])
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    command = {}
+                if command.get("type") == "stop":
+                    break
+
+            # Keep receiving while a window is being transcribed
+            if (inference is None or inference.done()) and session.step_ready():
+                if inference is not None:
+                    inference.result()
+                inference = asyncio.create_task(transcribe_window(websocket, session, stream_transcriber,
+                                                                  cancel=cancel))
+
+        if inference is not None:
+            await inference
+            inference = None
+        while session.has_pending():
+            await transcribe_window(websocket, session, stream_transcriber, flush=True, cancel=cancel)
+        await websocket.send_json({"type": "done", "duration": session.received_seconds})
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        logger.info("Stream client disconnected")
+
+    except StreamBacklogError as e:
+        logger.warning(f"Stream closed: {str(e)}")
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+
+    except Exception as e:
+        logger.error(f"Stream error: {str(e)}")
+        await websocket.send_json({"type": "error", "error": f"Transcription failed: {str(e)}"})
+        await websocket.close()
+
+    finally:
+        if inference is not None and not inference.done():
+            cancel.cancel(DISCONNECT)
+            inference.cancel()
+        registry.release(model)
+
+
+@app.get("/search")
+async def search(q: str, limit: int = 50, offset: int = 0, recording_id: Optional[str] = None,
+                 order: str = "rank"):
+    """
+    Search archived transcripts for segments matching a full-text query
+
+    q uses the FTS5 query syntax: words, "a phrase", prefix*, AND/OR/NOT and
+    NEAR(a b). order is rank (best matches first) or newest.
+    """
+    store = require_archive()
+    try:
+        hits = await run_in_threadpool(store.search, q, limit, offset, recording_id, order)
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"query": q, "order": order, "hits": hits}
+
+
+@app.get("/recordings/{recording_id}")
+async def get_recording(recording_id: str, format: Optional[str] = None, fields: Optional[str] = None):
+    """Get an archived transcript, in the same formats as /transcribe"""
+    format, fields = require_format(format, fields)
+    recording = await run_in_threadpool(require_archive().get, recording_id)
+    if recording is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    if format == "full" and not fields:
+        return FastJSONResponse(recording)
+    return result_response(recording, format, fields, recording_id)
+
+
+@app.delete("/recordings/{recording_id}")
+async def delete_recording(recording_id: str):
+    """Remove a transcript from the archive and the search index"""
+    if not await run_in_threadpool(require_archive().delete, recording_id):
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return {"recording_id": recording_id, "deleted": True}
+
+
+@app.get("/models")
+async def models():
+    """List downloaded and downloadable models and the ones currently loaded"""
+    return {
+        "models": await run_in_threadpool(list_models),
+        "default_model": registry.default_model,
+        "loaded": [name for name, t in registry.transcribers.items() if t.engine is not None],
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        await run_in_threadpool(metrics.render),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.get("/check-whisper")
 async def check_whisper():
     """Check if whisper.cpp is installed and built correctly"""
     whisper_cli = os.path.join(WHISPER_CPP_DIR, "build", "bin", "whisper-cli")
     model_exists = os.path.exists(WHISPER_MODEL_PATH)
+    # SQLite reads wait for other processes' writes, keep them off the event loop
+    cache_stats = await asyncio.to_thread(transcriber.cache.stats) if transcriber.cache is not None else None
+    archive_stats = await asyncio.to_thread(archive.stats) if archive is not None else None
 
     return {
         "whisper_cpp_dir_exists": os.path.exists(WHISPER_CPP_DIR),
         "whisper_cli_exists": os.path.exists(whisper_cli),
         "model_exists": model_exists,
+        "engine": transcriber.engine.status() if transcriber.engine is not None else None,
+        "layout": LAYOUT,
+        "preflight": preflight.status(),
+        "cache": cache_stats,
+        "models": registry.status(),
+        "dispatcher": dispatcher.status(),
+        "jobs": await job_manager.status(),
+        "archive": archive_stats,
+        "scratch": scratch.status(),
         "status": "ready" if os.path.exists(whisper_cli) and model_exists else "not_ready"
     }
 
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics for the transcription pipeline
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Default histogram buckets in seconds, from a cache hit to a long recording
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Buckets for the real-time factor, audio seconds per wall-clock second
+RTF_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+# whisper.cpp timing lines, e.g. "whisper_print_timings:   encode time =   312.45 ms /  1 runs"
+WHISPER_TIMING_PATTERN = re.compile(r"whisper_print_timings:\s+(\w+) time\s*=\s*([\d.]+) ms")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: bucket counts, sum, count
+        self._values: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock seconds spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(sorted(labels.items())))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# A collector returns gauges read at scrape time: (name, help, [(labels, value)])
+Collector = Callable[[], Iterable[Tuple[str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        """Add a function that reports gauges computed when metrics are scraped"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            for name, help_text, values in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Singleton registry and the pipeline's metrics
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "scribly_stage_seconds",
+    "Seconds spent in each stage of a transcription (upload, decode, queue_wait, inference, postprocess)"
+)
+WHISPER_PHASE_SECONDS = metrics.histogram(
+    "scribly_whisper_phase_seconds",
+    "Seconds whisper.cpp reports for each phase of a run (load, mel, encode, decode, total, ...)"
+)
+REALTIME_FACTOR = metrics.histogram(
+    "scribly_realtime_factor",
+    "Seconds of audio transcribed per wall-clock second",
+    RTF_BUCKETS
+)
+AUDIO_SECONDS = metrics.counter(
+    "scribly_audio_seconds_total",
+    "Seconds of audio transcribed"
+)
+TRANSCRIPTIONS = metrics.counter(
+    "scribly_transcriptions_total",
+    "Transcriptions finished, by outcome (success, error, cache_hit, cancelled)"
+)
+CANCELLED = metrics.counter(
+    "scribly_cancelled_total",
+    "Transcriptions cancelled, by reason (deadline, disconnect, job_cancelled, shutdown)"
+)
+CANCELLED_SECONDS = metrics.counter(
+    "scribly_cancelled_seconds_total",
+    "Seconds of transcription work thrown away by cancellations, by reason"
+)
+
+
+def stage(name: str):
+    """Time a pipeline stage: with stage("decode"): ..."""
+    return STAGE_SECONDS.time(stage=name)
+
+
+def observe_whisper_output(text: str):
+    """
+    Record the phase timings whisper.cpp prints to stderr
+
+    Args:
+        text: One or more lines of whisper-cli or whisper-server stderr
+    """
+    for phase, milliseconds in WHISPER_TIMING_PATTERN.findall(text):
+        WHISPER_PHASE_SECONDS.observe(float(milliseconds) / 1000, phase=phase)
+
+
+def observe_transcription(audio_seconds: Optional[float], wall_seconds: float):
+    """
+    Record the amount of audio transcribed and the real-time factor
+
+    Args:
+        audio_seconds: Length of the audio, None if unknown
+        wall_seconds: Seconds it took to transcribe
+    """
+    TRANSCRIPTIONS.inc(outcome="success")
+    if not audio_seconds:
+        return
+    AUDIO_SECONDS.inc(audio_seconds)
+    if wall_seconds > 0:
+        REALTIME_FACTOR.observe(audio_seconds / wall_seconds)
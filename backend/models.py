@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Registry of whisper models with a warm worker set per model
+"""
+import os
+import re
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import DEFAULT_MODEL, ENGINE, MODEL_POOL_SIZES, MODEL_MEMORY_BYTES, POOL_SIZE
+from cancellation import CancelToken
+from transcriber import Transcriber, WHISPER_MODEL_DIR, transcriber as default_transcriber
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Models download-ggml-model.sh knows how to fetch
+DOWNLOADABLE_MODELS = [
+    "tiny", "tiny.en", "tiny-q5_1", "tiny.en-q5_1", "tiny-q8_0",
+    "base", "base.en", "base-q5_1", "base.en-q5_1", "base-q8_0",
+    "small", "small.en", "small.en-tdrz", "small-q5_1", "small.en-q5_1", "small-q8_0",
+    "medium", "medium.en", "medium-q5_0", "medium.en-q5_0", "medium-q8_0",
+    "large-v1", "large-v2", "large-v2-q5_0", "large-v2-q8_0",
+    "large-v3", "large-v3-q5_0", "large-v3-turbo", "large-v3-turbo-q5_0", "large-v3-turbo-q8_0",
+]
+
+MODEL_NAME_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+# Resident memory of a worker relative to its model file size
+WORKER_MEMORY_FACTOR = 1.3
+
+# Memory of each extra library engine state relative to the model file size
+STATE_MEMORY_FACTOR = 0.3
+
+
+class ModelError(Exception):
+    """Raised for unknown or unloadable models"""
+
+
+class ModelUnavailableError(ModelError):
+    """Raised for a known model that is still being downloaded"""
+
+
+def quantization(model_name: str) -> Optional[str]:
+    """Quantization type in a model name, e.g. "q5_1", None for full precision"""
+    match = re.search(r"-(q\d_\d)$", model_name)
+    return match.group(1) if match else None
+
+
+def total_memory() -> int:
+    """Physical memory of the host in bytes"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 8 * 1024 ** 3
+
+
+def list_models() -> List[Dict[str, Any]]:
+    """
+    List downloaded and downloadable models
+
+    Returns:
+        List[Dict]: name, path, size, whether it is downloaded and its quantization
+    """
+    names = set(DOWNLOADABLE_MODELS)
+    if WHISPER_MODEL_DIR.exists():
+        for path in WHISPER_MODEL_DIR.glob("ggml-*.bin"):
+            names.add(path.name[len("ggml-"):-len(".bin")])
+
+    models = []
+    for name in sorted(names):
+        path = WHISPER_MODEL_DIR / f"ggml-{name}.bin"
+        models.append({
+            "name": name,
+            "path": str(path),
+            "downloaded": path.exists(),
+            "size_bytes": path.stat().st_size if path.exists() else None,
+            "quantization": quantization(name),
+        })
+    return models
+
+
+class ModelRegistry:
+    """Load models on demand and unload idle ones to stay within a memory budget"""
+
+    def __init__(self, default_model: str = DEFAULT_MODEL,
+                 memory_budget: int = MODEL_MEMORY_BYTES,
+                 pool_sizes: Dict[str, int] = MODEL_POOL_SIZES):
+        """
+        Initialize the registry
+
+        Args:
+            default_model: Model used when a request does not name one
+            memory_budget: Bytes the loaded models' workers may use, 0 for half of RAM
+            pool_sizes: Worker count per model, others use SCRIBLY_POOL_SIZE
+        """
+        self.default_model = default_model
+        self.memory_budget = memory_budget or total_memory() // 2
+        self.pool_sizes = pool_sizes
+        self.transcribers: Dict[str, Transcriber] = {}
+        self._last_used: Dict[str, float] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._downloads: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+        # Share the module-level transcriber when it serves the default model
+        if default_transcriber.model_name == default_model:
+            self.transcribers[default_model] = default_transcriber
+
+    def resolve(self, model_name: Optional[str]) -> str:
+        """
+        Validate a requested model name
+
+        Args:
+            model_name: Requested model, None for the default
+
+        Returns:
+            str: The model name to use
+
+        Raises:
+            ModelError: If the model is unknown
+        """
+        if not model_name:
+            return self.default_model
+        if not MODEL_NAME_PATTERN.match(model_name):
+            raise ModelError(f"Invalid model name: {model_name}")
+        if model_name not in DOWNLOADABLE_MODELS and not (WHISPER_MODEL_DIR / f"ggml-{model_name}.bin").exists():
+            raise ModelError(f"Unknown model: {model_name}")
+        return model_name
+
+    def estimated_memory(self, model_name: str) -> int:
+        """Estimated memory of a model's worker set"""
+        path = WHISPER_MODEL_DIR / f"ggml-{model_name}.bin"
+        size = path.stat().st_size if path.exists() else 0
+        workers = max(self.pool_sizes.get(model_name, POOL_SIZE), 1)
+        if ENGINE == "library":
+            # One copy of the weights shared by every state
+            return int(size * (WORKER_MEMORY_FACTOR + STATE_MEMORY_FACTOR * (workers - 1)))
+        return int(size * WORKER_MEMORY_FACTOR * workers)
+
+    def _loaded_memory(self) -> int:
+        return sum(
+            self.estimated_memory(name) for name, t in self.transcribers.items()
+            if t.engine is not None
+        )
+
+    def _make_room(self, model_name: str):
+        """Stop the least recently used idle engines until model_name fits the budget"""
+        needed = self.estimated_memory(model_name)
+        candidates = sorted(
+            (name for name, t in self.transcribers.items()
+             if name != model_name and t.engine is not None and not self._in_flight.get(name)),
+            key=lambda name: self._last_used.get(name, 0)
+        )
+        for name in candidates:
+            if self._loaded_memory() + needed <= self.memory_budget:
+                break
+            logger.info(f"Unloading model {name} to make room for {model_name}")
+            self.transcribers[name].stop_engine()
+
+        if self._loaded_memory() + needed > self.memory_budget:
+            logger.warning(f"Loading {model_name} exceeds the model memory budget")
+
+    def _transcriber(self, model_name: str) -> Transcriber:
+        """The transcriber for a resolved model name, created on first use"""
+        with self._lock:
+            transcriber = self.transcribers.get(model_name)
+            if transcriber is None:
+                transcriber = Transcriber(
+                    model_name,
+                    pool_size=self.pool_sizes.get(model_name, POOL_SIZE)
+                )
+                self.transcribers[model_name] = transcriber
+            return transcriber
+
+    def download(self, model_name: Optional[str] = None) -> bool:
+        """Download a model if it is missing, blocking until done"""
+        return self._transcriber(self.resolve(model_name)).ensure_model()
+
+    def check_available(self, model_name: Optional[str] = None) -> str:
+        """
+        Make sure a model can be used right away
+
+        A missing model is downloaded in the background, so requests never
+        wait for a download.
+
+        Args:
+            model_name: Requested model, None for the default
+
+        Returns:
+            str: The model name to use
+
+        Raises:
+            ModelError: If the model is unknown
+            ModelUnavailableError: If the model is still being downloaded
+        """
+        model_name = self.resolve(model_name)
+        transcriber = self._transcriber(model_name)
+        if transcriber.model_available():
+            return model_name
+
+        with self._lock:
+            download = self._downloads.get(model_name)
+            if download is None or not download.is_alive():
+                download = threading.Thread(target=transcriber.ensure_model, daemon=True)
+                self._downloads[model_name] = download
+                download.start()
+        raise ModelUnavailableError(f"Model {model_name} is being downloaded, retry shortly")
+
+    def get(self, model_name: Optional[str] = None) -> Transcriber:
+        """
+        Get the transcriber for a model, starting its engine if needed
+
+        Args:
+            model_name: Requested model, None for the default
+
+        Returns:
+            Transcriber: Transcriber with the model's engine started
+
+        Raises:
+            ModelError: If the model is unknown
+            ModelUnavailableError: If the model is still being downloaded
+        """
+        model_name = self.check_available(model_name)
+        transcriber = self._transcriber(model_name)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+            self._last_used[model_name] = time.time()
+
+        # Loading one model must not hold up requests for the others
+        with load_lock:
+            if transcriber.engine is None and transcriber.pool_size > 0:
+                with self._lock:
+                    self._make_room(model_name)
+                transcriber.start_engine()
+        return transcriber
+
+    def transcribe(self, audio_file: str, model: Optional[str] = None,
+                   progress_callback: Optional[Callable[[float], None]] = None,
+                   segment_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   cancel: Optional[CancelToken] = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Transcribe an audio file with the requested model
+
+        Args:
+            audio_file: Path to the audio file to transcribe
+            model: Model name, None for the default
+            progress_callback: Called with the fraction of a long recording done
+            segment_callback: Called with each segment, in order, as soon as it is available
+            cancel: Token that stops the inference when cancelled
+
+        Returns:
+            Tuple[bool, Dict]: Success status and transcription data or error message
+        """
+        try:
+            name = self.acquire(model)
+        except ModelError as e:
+            return False, {"error": str(e)}
+
+        try:
+            transcriber = self.get(name)
+            return transcriber.transcribe(
+                audio_file,
+                progress_callback=progress_callback,
+                segment_callback=segment_callback,
+                cancel=cancel
+            )
+        except ModelError as e:
+            return False, {"error": str(e)}
+        finally:
+            self.release(name)
+
+    def acquire(self, model_name: Optional[str] = None) -> str:
+        """
+        Count a model as in use, so it is not unloaded to make room for another
+
+        Call it before get(), so the model is not unloaded between loading
+        and use, and call release() when done.
+
+        Args:
+            model_name: Requested model, None for the default
+
+        Returns:
+            str: The resolved model name to pass to get() and release()
+
+        Raises:
+            ModelError: If the model is unknown
+        """
+        name = self.resolve(model_name)
+        with self._lock:
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+        return name
+
+    def release(self, model_name: str):
+        """Stop counting a model acquired with acquire() as in use"""
+        with self._lock:
+            self._in_flight[model_name] -= 1
+            self._last_used[model_name] = time.time()
+
+    def start_default(self) -> bool:
+        """Start the default model's workers"""
+        try:
+            return self.get(self.default_model).engine is not None
+        except ModelError as e:
+            logger.error(str(e))
+            return False
+
+    def stop_all(self):
+        """Stop every model's workers"""
+        for transcriber in self.transcribers.values():
+            transcriber.stop_engine()
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for the loaded models"""
+        return {
+            "default_model": self.default_model,
+            "memory_budget_bytes": self.memory_budget,
+            "loaded_memory_bytes": self._loaded_memory(),
+            "loaded": {
+                name: {
+                    "engine": t.engine.status() if t.engine is not None else None,
+                    "in_flight": self._in_flight.get(name, 0),
+                    "last_used": self._last_used.get(name),
+                }
+                for name, t in self.transcribers.items()
+            },
+        }
+
+
+# Singleton instance
+registry = ModelRegistry()
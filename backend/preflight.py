@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Startup checks and warm-up, so the first request is as fast as the hundredth
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import ENGINE, PRELOAD_MODELS, WARMUP, WHISPER_CPP_DIR
+from audio_io import SAMPLE_RATE
+from engines import WHISPER_CLI
+from models import ModelError, ModelRegistry
+from transcriber import Transcriber, TranscriptionError
+from whisper_lib import find_library
+from worker_pool import WHISPER_SERVER
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time when pulling a model file into the page cache
+PRELOAD_BLOCK_BYTES = 16 * 1024 * 1024
+
+# Length of the warm-up inference
+WARMUP_SECONDS = 1.0
+
+
+def preload_file(path: Path) -> float:
+    """
+    Read a file once so the workers that load it next are served from the page cache
+
+    Args:
+        path: File to read
+
+    Returns:
+        float: Seconds it took
+    """
+    started = time.perf_counter()
+    buffer = bytearray(PRELOAD_BLOCK_BYTES)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while f.readinto(buffer):
+            pass
+    return time.perf_counter() - started
+
+
+def check_binaries() -> Dict[str, Optional[str]]:
+    """Paths of the whisper.cpp binaries and library that were found, None for missing ones"""
+    library = find_library()
+    return {
+        "whisper_cli": str(WHISPER_CLI) if WHISPER_CLI.exists() or WHISPER_CLI.with_suffix(".exe").exists() else None,
+        "whisper_server": str(WHISPER_SERVER) if WHISPER_SERVER.exists() else None,
+        "libwhisper": str(library) if library is not None else None,
+    }
+
+
+def warm_up(transcriber: Transcriber) -> float:
+    """
+    Run a short inference on every worker or state of the transcriber's engine
+
+    Args:
+        transcriber: Transcriber with its engine started
+
+    Returns:
+        float: Seconds it took
+    """
+    # Faint noise rather than digital silence, which some builds short-circuit
+    samples = np.random.default_rng(0).normal(0, 1e-3, int(SAMPLE_RATE * WARMUP_SECONDS)).astype(np.float32)
+    # One run per resident worker; without one, a single whisper-cli run warms the page cache
+    runs = transcriber.engine.size if transcriber.engine is not None else 1
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=runs, thread_name_prefix="warmup") as executor:
+        list(executor.map(lambda _: transcriber.transcribe_samples(samples), range(runs)))
+    return time.perf_counter() - started
+
+
+class Preflight:
+    """Validate the installation, prepare the models once and report readiness"""
+
+    def __init__(self, registry: ModelRegistry, models: Optional[List[str]] = None, warmup: bool = WARMUP):
+        """
+        Initialize the preflight
+
+        Args:
+            registry: Registry whose models are prepared
+            models: Models to prepare besides the default, SCRIBLY_PRELOAD_MODELS if None
+            warmup: Run a warm-up inference on every worker
+        """
+        self.registry = registry
+        extra = PRELOAD_MODELS if models is None else models
+        self.models = [registry.default_model] + [name for name in extra if name != registry.default_model]
+        self.warmup = warmup
+        self.ready = False
+        self.finished = False
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.binaries: Dict[str, Optional[str]] = {}
+        self.prepared: Dict[str, Dict[str, Any]] = {}
+        self.errors: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Run the preflight in the background, so /ready can be polled meanwhile"""
+        self._thread = threading.Thread(target=self.run, name="preflight", daemon=True)
+        self._thread.start()
+
+    def run(self) -> bool:
+        """
+        Check binaries, download, preload, start and warm up the models
+
+        Returns:
+            bool: True if the default model is ready to serve requests
+        """
+        self.started_at = time.time()
+
+        if not os.path.isdir(WHISPER_CPP_DIR):
+            self.errors.append("whisper.cpp directory not found. Please run setup_whisper.py first.")
+
+        self.binaries = check_binaries()
+        resident = {"server": "whisper_server", "library": "libwhisper"}.get(ENGINE)
+        if resident and self.binaries[resident] is None:
+            logger.warning(f"{resident} not found, the {ENGINE} engine will fall back to whisper-cli")
+        if self.binaries["whisper_cli"] is None and (resident is None or self.binaries[resident] is None):
+            self.errors.append("No whisper.cpp binary found. Please build whisper.cpp first.")
+
+        for name in self.models:
+            self.prepared[name] = self._prepare(name)
+
+        default = self.prepared[self.registry.default_model]
+        self.ready = not self.errors and default["warmup_seconds" if self.warmup else "engine"] is not None
+        self.finished = True
+        self.finished_at = time.time()
+        if self.ready:
+            logger.info(f"Ready after {self.finished_at - self.started_at:.2f}s")
+        else:
+            logger.error(f"Not ready: {'; '.join(self.errors)}")
+        return self.ready
+
+    def _prepare(self, model_name: str) -> Dict[str, Any]:
+        """Download, preload, start and warm up one model"""
+        prepared = {"downloaded": False, "preload_seconds": None, "engine": None, "warmup_seconds": None}
+        try:
+            if not self.registry.download(model_name):
+                self.errors.append(f"Model {model_name} could not be downloaded")
+                return prepared
+            prepared["downloaded"] = True
+
+            transcriber = self.registry.transcribers[model_name]
+            # Before the workers start, so they all load it from memory
+            prepared["preload_seconds"] = round(preload_file(transcriber.model_path), 3)
+
+            transcriber = self.registry.get(model_name)
+            prepared["engine"] = transcriber.engine.name if transcriber.engine is not None else "cli"
+
+            if self.warmup:
+                prepared["warmup_seconds"] = round(warm_up(transcriber), 3)
+        except (ModelError, TranscriptionError, OSError) as e:
+            self.errors.append(f"Preparing {model_name} failed: {str(e)}")
+        return prepared
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness and the outcome of each check"""
+        return {
+            "ready": self.ready,
+            "finished": self.finished,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "binaries": self.binaries,
+            "models": self.prepared,
+            "errors": self.errors,
+        }
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Preallocated ring buffer of audio samples for live capture
+"""
+import threading
+from typing import Tuple
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer that keeps the most recent samples
+
+    Samples are addressed by their absolute position in the stream, so a
+    consumer can remember where it stopped reading and ask for everything
+    written since. Memory use is bounded by the capacity no matter how long
+    the stream runs.
+    """
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        """
+        Initialize the buffer
+
+        Args:
+            capacity: Number of samples kept
+            dtype: Sample type
+        """
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=dtype)
+        # Total samples written since creation
+        self.written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def oldest(self) -> int:
+        """Position of the oldest sample still in the buffer"""
+        return max(self.written - self.capacity, 0)
+
+    def write(self, samples: np.ndarray):
+        """
+        Append samples, overwriting the oldest ones when full
+
+        Args:
+            samples: 1-D array of samples
+        """
+        count = len(samples)
+        # Only the last capacity samples survive a write larger than the buffer
+        skipped = max(count - self.capacity, 0)
+        samples = samples[skipped:]
+        with self._lock:
+            start = (self.written + skipped) % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.written += count
+
+    def views(self, start: int, end: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zero-copy views of the samples between two stream positions
+
+        The range wraps around the end of the storage at most once, so it is
+        returned as two views whose concatenation is the requested audio. The
+        views alias the buffer and are overwritten once the writer laps them.
+
+        Args:
+            start: First position, clamped to the oldest sample kept
+            end: Position after the last sample, defaults to everything written
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The two views, the second may be empty
+        """
+        with self._lock:
+            if end is None or end > self.written:
+                end = self.written
+            start = min(max(start, self.oldest), end)
+            first_index = start % self.capacity
+            length = end - start
+            first = min(length, self.capacity - first_index)
+            return (
+                self._data[first_index:first_index + first],
+                self._data[:length - first],
+            )
+
+    def read(self, start: int, end: int = None) -> np.ndarray:
+        """Copy of the samples between two stream positions, see views"""
+        head, tail = self.views(start, end)
+        return np.concatenate((head, tail))
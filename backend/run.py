@@ -2,6 +2,7 @@
 """
 Run script for the FastAPI backend
 """
+import os
 import uvicorn
 import logging
 import argparse
@@ -34,15 +35,71 @@ def main():
         action="store_true", 
         help="Enable auto-reload for development"
     )
+    parser.add_argument(
+        "--workers", 
+        type=int, 
+        default=1, 
+        help="Number of server processes sharing the port, the job store and the result cache"
+    )
+    parser.add_argument(
+        "--pool-size", 
+        type=int, 
+        default=None, 
+        help="Number of resident whisper-server workers (0 to use whisper-cli per request)"
+    )
+    parser.add_argument(
+        "--engine", 
+        choices=("server", "library", "cli"), 
+        default=None, 
+        help="Inference engine: whisper-server workers, libwhisper in-process, or whisper-cli per request"
+    )
+    parser.add_argument(
+        "--worker-threads", 
+        type=int, 
+        default=None, 
+        help="Number of threads per whisper-server worker"
+    )
+    parser.add_argument(
+        "--max-concurrent", 
+        type=int, 
+        default=None, 
+        help="Number of transcriptions allowed to run at the same time"
+    )
+    parser.add_argument(
+        "--max-queued", 
+        type=int, 
+        default=None, 
+        help="Number of transcriptions allowed to wait before requests are rejected"
+    )
     
     args = parser.parse_args()
     
-    logger.info(f"Starting FastAPI server at {args.host}:{args.port}")
+    # Pass worker settings to the app through the environment so they
+    # also apply to processes spawned by --reload
+    if args.pool_size is not None:
+        os.environ["SCRIBLY_POOL_SIZE"] = str(args.pool_size)
+    if args.engine is not None:
+        os.environ["SCRIBLY_ENGINE"] = args.engine
+    if args.worker_threads is not None:
+        os.environ["SCRIBLY_WORKER_THREADS"] = str(args.worker_threads)
+    if args.max_concurrent is not None:
+        os.environ["SCRIBLY_MAX_CONCURRENT"] = str(args.max_concurrent)
+    if args.max_queued is not None:
+        os.environ["SCRIBLY_MAX_QUEUED"] = str(args.max_queued)
+    
+    if args.workers > 1 and "SCRIBLY_POOL_SIZE" not in os.environ:
+        # Split the layout's resident workers between the processes instead
+        # of giving every process a full set
+        from config import LAYOUT
+        os.environ["SCRIBLY_POOL_SIZE"] = str(max(LAYOUT["workers"] // args.workers, 1))
+    
+    logger.info(f"Starting FastAPI server at {args.host}:{args.port} with {args.workers} process(es)")
     uvicorn.run(
         "main:app", 
         host=args.host, 
         port=args.port, 
-        reload=args.reload
+        reload=args.reload,
+        workers=args.workers
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Managed scratch space for uploads and intermediate audio files
+
+Every process writes into its own directory under the scratch root, named
+after its PID. Files are counted against a per-request and a per-process
+quota, a sweeper removes files older than the age limit that a failed
+request never removed, and the directories of processes that died are
+removed at startup and by the sweeper, so crashes don't leave audio behind.
+
+The quotas are clamped to the free space of the scratch filesystem at
+startup, and every file is also checked against the space actually free
+when it grows, since other processes share the filesystem.
+"""
+import contextlib
+import errno
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from config import (
+    SCRATCH_DIR, SCRATCH_FALLBACK_DIR, SCRATCH_MAX_BYTES, SCRATCH_REQUEST_BYTES, SCRATCH_MAX_AGE_SECONDS,
+    SCRATCH_SWEEP_INTERVAL,
+)
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+class ScratchFullError(Exception):
+    """Raised when a file would exceed a scratch quota"""
+
+    def __init__(self, message: str, status_code: int = 507):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@contextlib.contextmanager
+def out_of_space_as_full():
+    """Raise ScratchFullError for writes that run out of space on the scratch filesystem"""
+    try:
+        yield
+    except OSError as e:
+        if e.errno != errno.ENOSPC:
+            raise
+        raise ScratchFullError("Scratch filesystem is out of space") from e
+
+
+def free_bytes(path: str) -> int:
+    """Free space on the filesystem holding path"""
+    return shutil.disk_usage(path).free
+
+
+def process_alive(pid: int) -> bool:
+    """Check whether a process exists"""
+    if os.name == "nt":
+        # os.kill would terminate it, Windows directories are left to the age limit
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def owner_pid(name: str) -> Optional[int]:
+    """PID a process directory belongs to, from its "<pid>-<id>" name"""
+    pid, _, _ = name.partition("-")
+    return int(pid) if pid.isdigit() else None
+
+
+class ScratchSpace:
+    """Per-process scratch directory with size quotas and an orphan sweeper"""
+
+    def __init__(self, root: str = SCRATCH_DIR, max_bytes: int = SCRATCH_MAX_BYTES,
+                 request_bytes: int = SCRATCH_REQUEST_BYTES, max_age: float = SCRATCH_MAX_AGE_SECONDS,
+                 sweep_interval: float = SCRATCH_SWEEP_INTERVAL, fallback_root: str = SCRATCH_FALLBACK_DIR):
+        """
+        Initialize the scratch space
+
+        Args:
+            root: Directory holding the process directories, ideally on tmpfs
+            max_bytes: Bytes this process may keep in scratch at once
+            request_bytes: Largest file a single request may create
+            max_age: Seconds after which files are removed, longer than any request takes
+            sweep_interval: Seconds between sweeps
+            fallback_root: Used instead of root when root's filesystem has less
+                free space than request_bytes, empty to always use root
+        """
+        self.root = root
+        self.fallback_root = fallback_root
+        self.max_bytes = max_bytes
+        self.request_bytes = request_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.dir = os.path.join(root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.rejected = 0
+        self.swept = 0
+        # Tracked files and the bytes counted for each
+        self._files: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    @property
+    def used(self) -> int:
+        return sum(self._files.values())
+
+    def start(self):
+        """Fit the quotas to the free space, clean up after processes that died and start the sweeper"""
+        self.fit_to_disk()
+        self.recover()
+        self._stop_event.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="scratch-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        """Stop the sweeper and remove this process's directory"""
+        self._stop_event.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+        with self._lock:
+            self._files.clear()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def fit_to_disk(self):
+        """
+        Clamp the quotas to the free space of the scratch filesystem
+
+        A tmpfs smaller than the per-request quota, such as Docker's 64 MB
+        /dev/shm, is swapped for the fallback root when that has more room.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        free = free_bytes(self.root)
+        if self.fallback_root and free < self.request_bytes:
+            os.makedirs(self.fallback_root, exist_ok=True)
+            fallback_free = free_bytes(self.fallback_root)
+            if fallback_free > free:
+                logger.warning(f"Only {free} bytes free in {self.root}, using {self.fallback_root} for scratch")
+                self.root = self.fallback_root
+                self.dir = os.path.join(self.root, os.path.basename(self.dir))
+                free = fallback_free
+        if free < self.max_bytes:
+            logger.warning(f"Scratch quota lowered from {self.max_bytes} to the {free} bytes free in {self.root}")
+            self.max_bytes = free
+        self.request_bytes = min(self.request_bytes, self.max_bytes)
+
+    def create(self, suffix: str = "", size: int = 0) -> str:
+        """
+        Create an empty file in this process's directory
+
+        Args:
+            suffix: File name suffix, e.g. ".wav"
+            size: Bytes the caller expects to write, counted against the quotas up front
+
+        Returns:
+            str: Path to the file, removed with remove()
+
+        Raises:
+            ScratchFullError: If size exceeds the per-request quota or the scratch space is full
+        """
+        with self._lock:
+            self._reserve(None, size)
+            os.makedirs(self.dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(suffix=suffix, dir=self.dir)
+            os.close(fd)
+            self._files[path] = size
+        return path
+
+    def resize(self, path: str, size: int):
+        """
+        Count a tracked file as size bytes, e.g. once it is written
+
+        Raises:
+            ScratchFullError: If the new size exceeds a quota
+        """
+        with self._lock:
+            self._reserve(path, size)
+            self._files[path] = size
+
+    def _reserve(self, path: Optional[str], size: int):
+        """Check that a file of size bytes fits in the quotas, with the lock held"""
+        if size > self.request_bytes:
+            self.rejected += 1
+            raise ScratchFullError(f"File exceeds the {self.request_bytes} byte scratch limit per request",
+                                   status_code=413)
+        used = self.used - self._files.get(path, 0)
+        if used + size > self.max_bytes:
+            # Files removed without remove() still count until they are forgotten
+            self._forget_missing()
+            used = self.used - self._files.get(path, 0)
+        if used + size > self.max_bytes:
+            self.rejected += 1
+            raise ScratchFullError(f"Scratch space is full ({used} of {self.max_bytes} bytes in use)")
+        # Other processes fill the same filesystem
+        growth = size - self._files.get(path, 0)
+        if growth > 0:
+            try:
+                free = free_bytes(self.root)
+            except FileNotFoundError:
+                return
+            if growth > free:
+                self.rejected += 1
+                raise ScratchFullError(f"Scratch filesystem is full ({free} bytes free)")
+
+    def _forget_missing(self):
+        """Stop counting tracked files that were removed directly"""
+        for path in [path for path in self._files if not os.path.exists(path)]:
+            del self._files[path]
+
+    def remove(self, path: str):
+        """Remove a file and stop counting it, whether or not it still exists"""
+        with self._lock:
+            self._files.pop(path, None)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing scratch file {path}: {str(e)}")
+
+    def recover(self) -> int:
+        """
+        Remove the directories of processes that are no longer running
+
+        Running processes touch their directory on every sweep, so one that
+        was not touched within max_age is abandoned too, even if its PID was
+        reused.
+
+        Returns:
+            int: Number of directories removed
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if entry.path == self.dir:
+                continue
+            pid = owner_pid(entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if pid is not None and process_alive(pid) and now - entry.stat().st_mtime < self.max_age:
+                        continue
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                elif now - entry.stat().st_mtime > self.max_age:
+                    os.unlink(entry.path)
+                else:
+                    continue
+            except OSError:
+                continue
+            removed += 1
+            logger.info(f"Removed scratch left behind by a stopped process: {entry.path}")
+        return removed
+
+    def sweep(self) -> int:
+        """
+        Remove files older than max_age from this process's directory
+
+        Requests remove their files when they finish, so these were left by
+        one that failed before it could.
+
+        Returns:
+            int: Number of files removed
+        """
+        if not os.path.isdir(self.dir):
+            return 0
+        # Shows other processes this directory is still in use
+        os.utime(self.dir)
+        removed = 0
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.dir):
+            try:
+                if entry.stat().st_mtime > cutoff:
+                    continue
+                os.unlink(entry.path)
+            except OSError:
+                continue
+            removed += 1
+        with self._lock:
+            self._forget_missing()
+        if removed:
+            logger.warning(f"Swept {removed} orphaned scratch files")
+        self.swept += removed
+        return removed
+
+    def _sweep_loop(self):
+        """Periodically sweep this process's directory and those of stopped processes"""
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+                self.recover()
+            except OSError as e:
+                logger.error(f"Scratch sweep failed: {str(e)}")
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for the scratch space"""
+        with self._lock:
+            files, used = len(self._files), self.used
+        return {
+            "dir": self.dir,
+            "files": files,
+            "used_bytes": used,
+            "max_bytes": self.max_bytes,
+            "request_bytes": self.request_bytes,
+            "rejected": self.rejected,
+            "swept": self.swept,
+        }
+
+
+# Singleton instance
+scratch = ScratchSpace()
+
+
+if __name__ == "__main__":
+    # Simple test
+    with tempfile.TemporaryDirectory() as root:
+        # A directory left by a process that no longer exists
+        os.makedirs(os.path.join(root, "999999999-deadbeef"))
+        space = ScratchSpace(root, max_bytes=1000, request_bytes=600, max_age=0.1, sweep_interval=3600)
+        space.start()
+        print(f"Recovered: {not os.path.exists(os.path.join(root, '999999999-deadbeef'))}")
+
+        first = space.create(".wav", size=500)
+        try:
+            space.create(".wav", size=700)
+        except ScratchFullError as e:
+            print(f"{e.status_code}: {e}")
+        try:
+            space.create(".wav", size=600)
+        except ScratchFullError as e:
+            print(f"{e.status_code}: {e}")
+        os.unlink(first)
+        print(f"Freed by a direct unlink: {space.create('.wav', size=600) is not None}")
+
+        orphan = os.path.join(space.dir, "orphan.wav")
+        open(orphan, "wb").close()
+        time.sleep(0.2)
+        kept = space.create(".wav")
+        print(f"Swept {space.sweep()} orphans: {space.status()}")
+        print(f"Newer file kept: {os.path.exists(kept)}")
+        space.stop()
+        print(f"Directory removed on stop: {not os.path.exists(space.dir)}")
+
+        # Quotas beyond the free space are clamped, and a root too small for one request is swapped
+        fallback = os.path.join(root, "fallback")
+        space = ScratchSpace(os.path.join(root, "small"), max_bytes=2 ** 62, request_bytes=2 ** 61,
+                             fallback_root=fallback)
+        free = free_bytes(root)
+        real_free_bytes = free_bytes
+        free_bytes = lambda path: free // 2 if "small" in path else real_free_bytes(path)
+        space.fit_to_disk()
+        free_bytes = real_free_bytes
+        print(f"Fell back: {space.dir.startswith(fallback)}, clamped: {space.max_bytes <= free}")
+        # Files are checked against the space actually free too, which other processes use up
+        space.max_bytes = space.request_bytes = 2 ** 62
+        try:
+            space.create(".wav", size=2 ** 61)
+        except ScratchFullError as e:
+            print(f"{e.status_code}: {e}")
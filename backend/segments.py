@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Helpers to normalize whisper.cpp transcription output
+"""
+import re
+from typing import Dict, Any, List, Optional
+
+# A segment as whisper-cli prints it: "[00:00:01.240 --> 00:00:04.560]   And so my fellow"
+SEGMENT_LINE_PATTERN = re.compile(
+    r"^\[(\d+):(\d+):(\d+)[.,](\d+) --> (\d+):(\d+):(\d+)[.,](\d+)\] {0,2}(.*)$"
+)
+
+
+def normalize_segments(transcription_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Convert whisper.cpp output into a list of segments
+
+    whisper-server's verbose_json output already has a "segments" list with
+    start/end in seconds. whisper-cli's -oj output has a "transcription" list
+    with millisecond offsets instead, so convert those to the same shape.
+
+    Args:
+        transcription_data: Parsed JSON output of whisper-cli or whisper-server
+
+    Returns:
+        List[Dict]: Segments with at least id, start, end and text
+    """
+    if "segments" in transcription_data:
+        return transcription_data.get("segments") or []
+
+    segments = []
+    for index, item in enumerate(transcription_data.get("transcription", [])):
+        offsets = item.get("offsets", {})
+        segments.append({
+            "id": index,
+            "start": offsets.get("from", 0) / 1000.0,
+            "end": offsets.get("to", 0) / 1000.0,
+            "text": item.get("text", ""),
+        })
+    return segments
+
+
+def parse_segment_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a segment line from whisper-cli's stdout
+
+    Args:
+        line: One line of output
+
+    Returns:
+        Optional[Dict]: Segment with start, end and text, or None if the line is not a segment
+    """
+    match = SEGMENT_LINE_PATTERN.match(line.rstrip("\r\n"))
+    if match is None:
+        return None
+    values = match.groups()
+    start = int(values[0]) * 3600 + int(values[1]) * 60 + int(values[2]) + int(values[3]) / 1000.0
+    end = int(values[4]) * 3600 + int(values[5]) * 60 + int(values[6]) + int(values[7]) / 1000.0
+    return {"start": start, "end": end, "text": values[8]}
+
+
+def shift_segment(segment: Dict[str, Any], offset: float) -> Dict[str, Any]:
+    """Copy of a segment moved later by offset seconds"""
+    return dict(segment, start=segment.get("start", 0.0) + offset, end=segment.get("end", 0.0) + offset)
+
+
+def shift_result(result: Dict[str, Any], offset: float) -> Dict[str, Any]:
+    """
+    Move a result's segments to the time of a longer recording the audio was cut from
+
+    Args:
+        result: Transcriber result with segments in seconds from the start of the audio
+        offset: Seconds into the recording where the audio starts
+
+    Returns:
+        Dict: A copy of the result, the original is left alone since it may be cached
+    """
+    if not offset:
+        return result
+    return dict(result, segments=[shift_segment(segment, offset) for segment in result.get("segments", [])])
+
+
+def join_text(segments: List[Dict[str, Any]]) -> str:
+    """Join the text of all segments"""
+    return " ".join([segment.get("text", "") for segment in segments])
+
+
+def to_result(transcription_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the transcriber result dict from whisper.cpp output
+
+    Args:
+        transcription_data: Parsed JSON output of whisper-cli or whisper-server
+
+    Returns:
+        Dict: text, segments and language
+    """
+    segments = normalize_segments(transcription_data)
+    language = transcription_data.get("language") \
+        or transcription_data.get("result", {}).get("language", "en")
+    return {
+        "text": join_text(segments),
+        "segments": segments,
+        "language": language,
+    }
@@ -3,9 +3,14 @@
 Setup script to clone and build whisper.cpp
 """
 import os
+import json
+import shutil
+import platform
 import subprocess
 import sys
+import time
 import logging
+import argparse
 from pathlib import Path
 
 # Setup logging
@@ -19,6 +24,19 @@ logger = logging.getLogger(__name__)
 BACKEND_DIR = Path(__file__).parent.absolute()
 WHISPER_CPP_DIR = BACKEND_DIR / "whisper.cpp"
 WHISPER_MODEL_DIR = WHISPER_CPP_DIR / "models"
+BUILD_RESULTS_PATH = WHISPER_CPP_DIR / "build-profiles.json"
+
+# Extra CMake options of each build profile
+BUILD_PROFILES = {
+    # Baseline x86-64/ARM code that runs on any CPU of the fleet
+    "portable": ["-DGGML_NATIVE=OFF"],
+    # Every instruction set extension of the build machine (AVX2, AVX-512, ...)
+    "native": ["-DGGML_NATIVE=ON"],
+    # Native code plus OpenBLAS for the encoder's matrix multiplications
+    "openblas": ["-DGGML_NATIVE=ON", "-DGGML_BLAS=ON", "-DGGML_BLAS_VENDOR=OpenBLAS"],
+    # Encoder on OpenVINO, needs the OpenVINO toolkit and a converted encoder model
+    "openvino": ["-DGGML_NATIVE=ON", "-DWHISPER_OPENVINO=ON"],
+}
 
 def run_command(cmd, cwd=None, check=True):
     """Run a shell command and log the output"""
@@ -52,27 +70,146 @@ def clone_whisper_cpp():
     logger.info("Cloning whisper.cpp repository...")
     run_command(["git", "clone", "https://github.com/ggml-org/whisper.cpp.git", str(WHISPER_CPP_DIR)])
 
-def build_whisper_cpp():
-    """Build whisper.cpp"""
-    logger.info("Building whisper.cpp...")
+def build_dir_for(profile, static=False):
+    """Build directory of a profile, e.g. build-native or build-openblas-static"""
+    return WHISPER_CPP_DIR / f"build-{profile}{'-static' if static else ''}"
+
+def build_whisper_cpp(profile="native", static=False, jobs=None, check=True):
+    """
+    Build whisper.cpp with a build profile
+    
+    Each profile builds in its own directory so profiles can be compared
+    without rebuilding. Only the library, whisper-cli and whisper-server are
+    compiled, in parallel.
     
-    # Create build directory
-    build_dir = WHISPER_CPP_DIR / "build"
-    build_dir.mkdir(exist_ok=True)
+    Args:
+        profile: Name of a BUILD_PROFILES entry
+        static: Link libwhisper and ggml statically instead of as shared libraries
+        jobs: Parallel compile jobs, defaults to the CPU count
+        check: Exit if the build fails, otherwise return None
+        
+    Returns:
+        Path: The build directory, or None if the build failed
+    """
+    build_dir = build_dir_for(profile, static)
+    jobs = jobs or os.cpu_count() or 1
+    logger.info(f"Building whisper.cpp with the {profile} profile{' (static)' if static else ''} in {build_dir}...")
     
-    # Run CMake
-    run_command(["cmake", ".."], cwd=build_dir)
+    # Configure
+    cmd = [
+        "cmake", "-S", str(WHISPER_CPP_DIR), "-B", str(build_dir),
+        "-DCMAKE_BUILD_TYPE=Release",
+        f"-DBUILD_SHARED_LIBS={'OFF' if static else 'ON'}",
+        "-DWHISPER_BUILD_EXAMPLES=ON",
+        "-DWHISPER_BUILD_TESTS=OFF",
+    ] + BUILD_PROFILES[profile]
+    if run_command(cmd, check=check).returncode != 0:
+        return None
     
-    # Build
-    run_command(["cmake", "--build", ".", "--config", "Release"], cwd=build_dir)
+    # Build the library and the two binaries the backend runs
+    cmd = [
+        "cmake", "--build", str(build_dir), "--config", "Release", "-j", str(jobs),
+        "--target", "whisper", "whisper-cli", "whisper-server",
+    ]
+    if run_command(cmd, check=check).returncode != 0:
+        return None
     
     # Check if the build was successful
+    missing = [name for name in ("whisper-cli", "whisper-server")
+               if not (build_dir / "bin" / name).exists() and not (build_dir / "bin" / f"{name}.exe").exists()]
+    if not any(build_dir.rglob("libwhisper.*")) and not any(build_dir.rglob("whisper.lib")):
+        missing.append("libwhisper")
+    if missing:
+        logger.error(f"Failed to build {', '.join(missing)}")
+        if check:
+            sys.exit(1)
+        return None
+    
+    logger.info(f"whisper.cpp built successfully in {build_dir}")
+    return build_dir
+
+def activate_build(build_dir):
+    """
+    Point build/ at a profile's build directory, where the backend looks for the binaries
+    
+    Args:
+        build_dir: Build directory to use
+    """
+    active = WHISPER_CPP_DIR / "build"
+    if active.is_symlink():
+        active.unlink()
+    elif active.exists():
+        # A build from before profiles existed, keep it around
+        previous = WHISPER_CPP_DIR / "build-previous"
+        logger.info(f"Moving existing {active} to {previous}")
+        shutil.rmtree(previous, ignore_errors=True)
+        active.rename(previous)
+    
+    if os.name == "nt":
+        # Symlinks need extra privileges on Windows, copy instead
+        shutil.copytree(build_dir, active)
+    else:
+        active.symlink_to(build_dir.name, target_is_directory=True)
+    logger.info(f"Using {build_dir.name} as {active}")
+
+def smoke_benchmark(build_dir, model_name="base.en", threads=None):
+    """
+    Time one transcription of the bundled JFK sample with a build
+    
+    Args:
+        build_dir: Build directory whose whisper-cli to run
+        model_name: Model to transcribe with
+        threads: Inference threads, defaults to the backend's per-worker threads
+        
+    Returns:
+        Dict: Wall-clock seconds, real-time factor and whisper's own phase timings,
+            or None if the run failed
+    """
+    from config import WORKER_THREADS
+    from metrics import WHISPER_TIMING_PATTERN
+    
     whisper_cli = build_dir / "bin" / "whisper-cli"
-    if not whisper_cli.exists() and not (build_dir / "bin" / "whisper-cli.exe").exists():
-        logger.error("Failed to build whisper-cli")
-        sys.exit(1)
+    sample_path = WHISPER_CPP_DIR / "samples" / "jfk.wav"
+    model_path = WHISPER_MODEL_DIR / f"ggml-{model_name}.bin"
+    threads = threads or WORKER_THREADS
+    
+    cmd = [str(whisper_cli), "-m", str(model_path), "-f", str(sample_path), "-t", str(threads)]
+    started = time.perf_counter()
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    wall_seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        logger.error(f"Smoke benchmark failed: {result.stderr}")
+        return None
     
-    logger.info("whisper.cpp built successfully")
+    # The JFK sample is 11 seconds long
+    return {
+        "threads": threads,
+        "wall_seconds": wall_seconds,
+        "real_time_factor": 11.0 / wall_seconds,
+        "timings_ms": {phase: float(ms) for phase, ms in WHISPER_TIMING_PATTERN.findall(result.stderr)},
+    }
+
+def record_benchmark(profile, static, flags, benchmark):
+    """Add a smoke benchmark result to build-profiles.json in the whisper.cpp directory"""
+    results = {}
+    if BUILD_RESULTS_PATH.exists():
+        try:
+            results = json.loads(BUILD_RESULTS_PATH.read_text())
+        except ValueError:
+            pass
+    
+    commit = run_command(["git", "rev-parse", "HEAD"], cwd=WHISPER_CPP_DIR, check=False)
+    results[f"{profile}{'-static' if static else ''}"] = dict(
+        benchmark or {},
+        profile=profile,
+        static=static,
+        flags=flags,
+        whisper_cpp_commit=commit.stdout.strip() if commit.returncode == 0 else None,
+        cpu=platform.processor() or platform.machine(),
+        measured_at=time.time(),
+        failed=benchmark is None,
+    )
+    BUILD_RESULTS_PATH.write_text(json.dumps(results, indent=2))
 
 def download_model():
     """Download the base.en model"""
@@ -97,19 +234,138 @@ def download_model():
     
     logger.info(f"Model downloaded to {model_path}")
 
+def tune_layout(model_name="base.en", rounds=3):
+    """
+    Measure how to split the cores between whisper workers and threads
+    
+    Every candidate layout transcribes the bundled JFK sample on a worker
+    pool at full concurrency. The layout with the highest real-time factor
+    (seconds of audio per wall-clock second) is saved for the backend.
+    
+    Args:
+        model_name: Model to measure with
+        rounds: Requests per worker for each candidate
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    import numpy as np
+    
+    from audio_io import SAMPLE_RATE, decode_audio, encode_wav
+    from config import TUNING_PATH
+    from tuning import candidate_layouts, detect_cpus, save_tuning
+    from worker_pool import WorkerPool
+    
+    model_path = WHISPER_MODEL_DIR / f"ggml-{model_name}.bin"
+    server_path = WHISPER_CPP_DIR / "build" / "bin" / "whisper-server"
+    sample_path = WHISPER_CPP_DIR / "samples" / "jfk.wav"
+    for path in (model_path, server_path, sample_path):
+        if not path.exists():
+            logger.error(f"{path} not found, run setup_whisper.py first")
+            sys.exit(1)
+    
+    # Three JFK samples back to back, long enough that the model load doesn't dominate
+    samples = np.tile(decode_audio(str(sample_path)), 3)
+    audio = encode_wav(samples)
+    audio_seconds = len(samples) / SAMPLE_RATE
+    
+    cpus = detect_cpus()
+    logger.info(f"Tuning for {cpus['usable']} usable cores: {cpus}")
+    
+    measurements = []
+    for workers, threads in candidate_layouts(cpus["usable"]):
+        pool = WorkerPool(model_path, size=workers, threads=threads, health_check_interval=3600,
+                          server_path=server_path)
+        if not pool.start():
+            logger.warning(f"Could not start {workers} workers with {threads} threads, skipping")
+            pool.stop()
+            continue
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Warm up every worker, then measure
+                list(executor.map(lambda _: pool.transcribe(audio), range(workers)))
+                started = time.perf_counter()
+                list(executor.map(lambda _: pool.transcribe(audio), range(workers * rounds)))
+                wall_seconds = time.perf_counter() - started
+        finally:
+            pool.stop()
+        
+        rtf = workers * rounds * audio_seconds / wall_seconds
+        logger.info(f"{workers} workers x {threads} threads: {rtf:.1f}x real time")
+        measurements.append({"workers": workers, "threads": threads, "real_time_factor": rtf})
+    
+    if not measurements:
+        logger.error("No layout could be measured")
+        sys.exit(1)
+    
+    best = max(measurements, key=lambda m: m["real_time_factor"])
+    save_tuning(TUNING_PATH, best["workers"], best["threads"], cpus, measurements, model_name)
+    logger.info(f"Saved {best['workers']} workers x {best['threads']} threads to {TUNING_PATH}")
+
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Set up whisper.cpp for the backend")
+    parser.add_argument("--profile", choices=sorted(BUILD_PROFILES), default="native",
+                        help="Build profile (default: native)")
+    parser.add_argument("--static", action="store_true",
+                        help="Link libwhisper and ggml statically into the binaries")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Parallel compile jobs (default: CPU count)")
+    parser.add_argument("--compare", metavar="PROFILES",
+                        help="Comma-separated profiles to build and benchmark, the fastest is used")
+    parser.add_argument("--no-benchmark", action="store_true",
+                        help="Skip the smoke benchmark after building")
+    parser.add_argument("--tune", action="store_true",
+                        help="Measure the best worker/thread layout for this machine and save it")
+    parser.add_argument("--model", default="base.en", help="Model to benchmark and tune with")
+    args = parser.parse_args()
+    
+    if args.tune:
+        tune_layout(args.model)
+        return
+    
     logger.info("Setting up whisper.cpp...")
     
     # Clone whisper.cpp
     clone_whisper_cpp()
     
-    # Build whisper.cpp
-    build_whisper_cpp()
-    
     # Download model
     download_model()
     
+    if args.compare:
+        profiles = [name.strip() for name in args.compare.split(",") if name.strip()]
+        unknown = [name for name in profiles if name not in BUILD_PROFILES]
+        if unknown:
+            parser.error(f"unknown profiles: {', '.join(unknown)}")
+        
+        # Build and time every profile, then use the fastest
+        best_dir, best_rtf = None, 0.0
+        for profile in profiles:
+            build_dir = build_whisper_cpp(profile, args.static, args.jobs, check=False)
+            benchmark = smoke_benchmark(build_dir, args.model) if build_dir else None
+            record_benchmark(profile, args.static, BUILD_PROFILES[profile], benchmark)
+            if benchmark:
+                logger.info(f"{profile}: {benchmark['wall_seconds']:.2f}s, "
+                            f"{benchmark['real_time_factor']:.1f}x real time")
+                if benchmark["real_time_factor"] > best_rtf:
+                    best_dir, best_rtf = build_dir, benchmark["real_time_factor"]
+        
+        if best_dir is None:
+            logger.error("No profile built and ran successfully")
+            sys.exit(1)
+        activate_build(best_dir)
+        logger.info(f"Results recorded in {BUILD_RESULTS_PATH}")
+    else:
+        # Build whisper.cpp
+        build_dir = build_whisper_cpp(args.profile, args.static, args.jobs)
+        activate_build(build_dir)
+        
+        if not args.no_benchmark:
+            benchmark = smoke_benchmark(build_dir, args.model)
+            record_benchmark(args.profile, args.static, BUILD_PROFILES[args.profile], benchmark)
+            if benchmark:
+                logger.info(f"Smoke benchmark: {benchmark['wall_seconds']:.2f}s for the 11s sample, "
+                            f"{benchmark['real_time_factor']:.1f}x real time")
+    
     logger.info("whisper.cpp setup completed successfully")
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Sliding-window transcription of live PCM audio, like whisper.cpp's stream example
+"""
+import logging
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from config import STREAM_WINDOW_SECONDS, STREAM_STEP_SECONDS, STREAM_KEEP_SECONDS, STREAM_MAX_BACKLOG_SECONDS
+from ring_buffer import RingBuffer
+from segments import join_text
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Sample rate whisper expects
+SAMPLE_RATE = 16000
+
+
+class StreamBacklogError(Exception):
+    """Raised when a client sends audio faster than it can be transcribed"""
+
+
+class StreamingSession:
+    """
+    Buffer live audio and cut it into windows for repeated transcription
+
+    Every step of new audio the whole current window is transcribed again
+    and reported as a partial result. Once the window reaches its full
+    length its result is final, and the next window starts with a short
+    tail of the previous one.
+
+    Audio is kept in a preallocated ring buffer holding the current window
+    and a bounded backlog, so memory stays fixed however long the session
+    runs; a client that gets further ahead of the transcription than the
+    backlog allows is stopped with StreamBacklogError.
+    """
+
+    def __init__(self, window_seconds: float = STREAM_WINDOW_SECONDS,
+                 step_seconds: float = STREAM_STEP_SECONDS,
+                 keep_seconds: float = STREAM_KEEP_SECONDS,
+                 sample_rate: int = SAMPLE_RATE,
+                 max_backlog_seconds: float = STREAM_MAX_BACKLOG_SECONDS):
+        """
+        Initialize the session
+
+        Args:
+            window_seconds: Length of audio transcribed before it is finalized
+            step_seconds: New audio needed before the next partial result
+            keep_seconds: Audio carried over into the next window
+            sample_rate: Sample rate of the incoming PCM
+            max_backlog_seconds: Audio allowed to wait beyond the current window
+        """
+        self.sample_rate = sample_rate
+        self.window_samples = int(window_seconds * sample_rate)
+        self.step_samples = int(step_seconds * sample_rate)
+        self.keep_samples = int(keep_seconds * sample_rate)
+        self.ring = RingBuffer(self.window_samples + int(max_backlog_seconds * sample_rate))
+        # Position in the stream where the current window starts
+        self.buffer_start = 0
+        # Pending audio at the last transcription
+        self.transcribed = 0
+        self._remainder = b""
+
+    @property
+    def pending(self) -> int:
+        """Samples from the start of the current window to the newest one"""
+        return self.ring.written - self.buffer_start
+
+    @property
+    def received_seconds(self) -> float:
+        return self.ring.written / self.sample_rate
+
+    def append(self, pcm: bytes):
+        """
+        Add little-endian 16-bit mono PCM to the stream
+
+        Args:
+            pcm: Raw PCM bytes, frames may split a sample
+
+        Raises:
+            StreamBacklogError: If the audio would overwrite samples not transcribed yet
+        """
+        data = self._remainder + pcm
+        usable = len(data) - len(data) % 2
+        self._remainder = data[usable:]
+        if usable:
+            samples = np.frombuffer(data[:usable], dtype="<i2")
+            if self.pending + len(samples) > self.ring.capacity:
+                raise StreamBacklogError(
+                    f"Audio is arriving faster than it is transcribed, more than "
+                    f"{self.ring.capacity / self.sample_rate:g}s are waiting"
+                )
+            self.ring.write(samples)
+
+    def step_ready(self) -> bool:
+        """Check if enough new audio arrived for another transcription"""
+        return self.pending - self.transcribed >= self.step_samples \
+            or self.pending >= self.window_samples
+
+    def has_pending(self) -> bool:
+        """Check if there is audio not yet covered by a final result"""
+        return self.pending > (self.keep_samples if self.buffer_start else 0)
+
+    def take_window(self, flush: bool = False) -> Tuple[np.ndarray, float, bool]:
+        """
+        Take the audio to transcribe next
+
+        Args:
+            flush: Finalize the window even if it is not full, used at end of stream
+
+        Returns:
+            Tuple[np.ndarray, float, bool]: Samples, their start time in
+            seconds and whether the result will be final
+        """
+        # A copy, the ring keeps receiving while the window is transcribed
+        window = self.ring.read(self.buffer_start, self.buffer_start + self.window_samples)
+        offset = self.buffer_start / self.sample_rate
+        final = flush or self.pending >= self.window_samples
+
+        if final:
+            if flush and self.pending <= self.window_samples:
+                # End of stream, nothing follows this window
+                consumed = len(window)
+            else:
+                # Start the next window with a short tail of this one
+                consumed = max(len(window) - self.keep_samples, 0)
+            self.buffer_start += consumed
+            self.transcribed = 0
+        else:
+            self.transcribed = len(window)
+        return window, offset, final
+
+    @staticmethod
+    def make_message(result: Dict[str, Any], offset: float, final: bool) -> Dict[str, Any]:
+        """
+        Build the message sent to the client for a window's result
+
+        Args:
+            result: Transcriber result for the window
+            offset: Start of the window in the stream, in seconds
+            final: Whether the window is finalized
+
+        Returns:
+            Dict: Message with stream-relative segment timestamps
+        """
+        segments: List[Dict[str, Any]] = []
+        for segment in result.get("segments", []):
+            segment = dict(segment)
+            segment["start"] = segment.get("start", 0.0) + offset
+            segment["end"] = segment.get("end", 0.0) + offset
+            segments.append(segment)
+        return {
+            "type": "final" if final else "partial",
+            "offset": offset,
+            "text": join_text(segments),
+            "segments": segments,
+        }
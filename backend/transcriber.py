@@ -4,11 +4,31 @@ Transcriber module to handle whisper.cpp transcription
 """
 import os
 import subprocess
-import tempfile
-import json
+import threading
 import logging
+import time
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    ENGINE, POOL_SIZE, WORKER_THREADS, LAYOUT,
+    CHUNK_THRESHOLD_SECONDS, CHUNK_SECONDS, CHUNK_OVERLAP_SECONDS,
+    CACHE_PATH, WHISPER_CPP_DIR as CONFIGURED_WHISPER_CPP_DIR,
+)
+from cache import TranscriptionCache, audio_fingerprint, open_cache
+from cancellation import CancelToken, TranscriptionCancelled, check
+from audio_io import (
+    SAMPLE_RATE, AudioDecodeError,
+    AudioReader, audio_duration, decode_audio, is_whisper_native,
+)
+from chunking import transcribe_chunked
+from engines import Audio, CliEngine, Engine, EngineError, SegmentCallback, ServerEngine, create_engine
+from metrics import TRANSCRIPTIONS, stage, observe_transcription
+from scratch import ScratchFullError
+from worker_pool import WorkerPool
 
 # Setup logging
 logging.basicConfig(
@@ -18,41 +38,70 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Path to the whisper.cpp directory
-BACKEND_DIR = Path(__file__).parent.absolute()
-WHISPER_CPP_DIR = BACKEND_DIR / "whisper.cpp"
+WHISPER_CPP_DIR = Path(CONFIGURED_WHISPER_CPP_DIR)
 WHISPER_MODEL_DIR = WHISPER_CPP_DIR / "models"
 WHISPER_MODEL_PATH = WHISPER_MODEL_DIR / "ggml-base.en.bin"
 
+class TranscriptionError(Exception):
+    """Raised when a chunk of audio cannot be transcribed"""
+
 class Transcriber:
     """Class to handle whisper.cpp transcription"""
     
-    def __init__(self, model_name="base.en"):
+    def __init__(self, model_name="base.en", pool_size=POOL_SIZE, worker_threads=WORKER_THREADS,
+                 cache_path=CACHE_PATH, engine=ENGINE):
         """
         Initialize the transcriber
         
         Args:
             model_name: Name of the whisper model to use
+            pool_size: Requests the resident engine serves at once, 0 to always use whisper-cli
+            worker_threads: Number of threads per request
+            cache_path: SQLite file for cached results, empty to disable caching
+            engine: Resident engine, "server", "library" or "cli"
         """
         self.model_name = model_name
         self.model_path = WHISPER_MODEL_DIR / f"ggml-{model_name}.bin"
         self.whisper_cli = WHISPER_CPP_DIR / "build" / "bin" / "whisper-cli"
+        self.whisper_server = WHISPER_CPP_DIR / "build" / "bin" / "whisper-server"
+        self.pool_size = pool_size
+        self.worker_threads = worker_threads
+        self.engine_name = engine
+        # Resident engine while started; whisper-cli is the fallback when it is down or fails
+        self.engine: Optional[Engine] = None
+        self.cli = CliEngine(self.model_path, worker_threads, self.whisper_cli)
+        self.cache: Optional[TranscriptionCache] = None
+        # The model file is looked up until it is found, then trusted (see model_available)
+        self._model_found = False
+        self._download_lock = threading.Lock()
         
-        # Check if whisper.cpp is installed
-        if not WHISPER_CPP_DIR.exists():
-            logger.error("whisper.cpp directory not found. Please run setup_whisper.py first.")
-        
-        # Check if the model exists
-        if not self.model_path.exists():
-            logger.warning(f"Model {self.model_path} not found. Will attempt to download it when needed.")
+        if cache_path:
+            try:
+                self.cache = open_cache(cache_path)
+            except Exception as e:
+                logger.error(f"Failed to open transcription cache: {str(e)}")
+    
+    def model_available(self) -> bool:
+        """Check if the model file is on disk, without downloading it"""
+        if not self._model_found:
+            self._model_found = self.model_path.exists()
+        return self._model_found
     
     def ensure_model(self) -> bool:
         """
         Ensure the model is downloaded
         
+        Blocks for the whole download, so it runs at startup or in the
+        background, never inside a request.
+        
         Returns:
             bool: True if the model is available, False otherwise
         """
-        if self.model_path.exists():
+        with self._download_lock:
+            return self._download_model()
+    
+    def _download_model(self) -> bool:
+        if self.model_available():
             return True
         
         logger.info(f"Downloading model {self.model_name}...")
@@ -72,78 +121,274 @@ class Transcriber:
                 text=True
             )
             
-            return self.model_path.exists()
+            return self.model_available()
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to download model: {e.stderr}")
             return False
     
-    def transcribe(self, audio_file: str) -> Tuple[bool, Dict[str, Any]]:
+    @property
+    def pool(self) -> Optional[WorkerPool]:
+        """whisper-server workers of the server engine, None for other engines"""
+        return self.engine.pool if isinstance(self.engine, ServerEngine) else None
+    
+    def start_engine(self) -> bool:
+        """
+        Start the resident engine so requests skip the model load
+        
+        Returns:
+            bool: True if the engine is running, False if whisper-cli will be used
+        """
+        if self.engine is not None and self.engine.is_running():
+            return True
+        
+        if self.pool_size <= 0:
+            logger.info("Resident engine disabled, using whisper-cli per request")
+            return False
+        
+        engine = create_engine(self.engine_name, self.model_path, self.pool_size, self.worker_threads)
+        if engine is None:
+            return False
+        
+        if not self.model_available():
+            logger.error(f"Model {self.model_path} not found, run setup_whisper.py or download it first")
+            return False
+        
+        if not engine.start():
+            engine.stop()
+            logger.warning(f"{engine.name} engine failed to start, using whisper-cli per request")
+            return False
+        self.engine = engine
+        return True
+    
+    def stop_engine(self):
+        """Stop the resident engine"""
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+    
+    def transcribe(self, audio_file: str,
+                   progress_callback: Optional[Callable[[float], None]] = None,
+                   segment_callback: Optional[SegmentCallback] = None,
+                   cancel: Optional[CancelToken] = None) -> Tuple[bool, Dict[str, Any]]:
         """
         Transcribe an audio file using whisper.cpp
         
+        Audio that is not 16 kHz mono PCM WAV is decoded and resampled
+        first. Recordings longer than the chunk threshold are split at
+        silence and the chunks transcribed in parallel.
+        
         Args:
             audio_file: Path to the audio file to transcribe
+            progress_callback: Called with the fraction of a long recording done
+            segment_callback: Called with each segment, in order, as soon as it is available
+            cancel: Token that stops the inference when the deadline passes or the client goes away
             
         Returns:
-            Tuple[bool, Dict]: Success status and transcription data or error message
+            Tuple[bool, Dict]: Success status and transcription data or error
+                message, with the reason under "cancelled" if the token was cancelled
+                and the HTTP status under "status_code" if scratch space ran out
         """
         if not os.path.exists(audio_file):
             return False, {"error": f"Audio file not found: {audio_file}"}
         
-        # Ensure the model is downloaded
-        if not self.ensure_model():
-            return False, {"error": f"Failed to download model {self.model_name}"}
+        # Cancelled while it waited for a free slot
+        if cancel is not None and cancel.cancelled:
+            TRANSCRIPTIONS.inc(outcome="cancelled")
+            return False, cancelled_result(TranscriptionCancelled(cancel.reason))
         
-        # Check if whisper-cli exists
-        if not self.whisper_cli.exists() and not (WHISPER_CPP_DIR / "build" / "bin" / "whisper-cli.exe").exists():
-            return False, {"error": "whisper-cli not found. Please build whisper.cpp first."}
+        # Repeated uploads of the same audio skip whisper entirely
+        cache_key = None
+        if self.cache is not None:
+            try:
+                cache_key = self.cache.make_key(audio_fingerprint(audio_file), self.model_name, self.cache_params())
+                cached = self.cache.get(cache_key)
+            except Exception as e:
+                logger.warning(f"Transcription cache lookup failed: {str(e)}")
+                cached = None
+            if cached is not None:
+                logger.info(f"Cache hit for {audio_file}")
+                TRANSCRIPTIONS.inc(outcome="cache_hit")
+                emit_segments(cached["segments"], segment_callback)
+                return True, cached
         
-        try:
-            # Create a temporary file for the JSON output
-            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as json_file:
-                json_file_path = json_file.name
+        # Models are downloaded at startup or in the background, never here
+        if not self.model_available():
+            TRANSCRIPTIONS.inc(outcome="error")
+            return False, {"error": f"Model {self.model_name} is not downloaded"}
+        
+        started = time.perf_counter()
+        success, result = self._transcribe_uncached(audio_file, progress_callback, segment_callback, cancel)
+        if not success:
+            if result.get("cancelled"):
+                TRANSCRIPTIONS.inc(outcome="cancelled")
+                cancel.wasted(time.perf_counter() - started)
+            else:
+                TRANSCRIPTIONS.inc(outcome="error")
+            return success, result
+        
+        # Length from the header, or from the last segment for formats soundfile can't read
+        duration = audio_duration(audio_file)
+        if duration is None and result.get("segments"):
+            duration = result["segments"][-1].get("end")
+        observe_transcription(duration, time.perf_counter() - started)
+        
+        if cache_key is not None:
+            with stage("postprocess"):
+                try:
+                    self.cache.put(cache_key, result)
+                except Exception as e:
+                    logger.warning(f"Failed to store transcription in cache: {str(e)}")
+        
+        return success, result
+    
+    def cache_params(self) -> Dict[str, Any]:
+        """Settings that change the transcription output, part of the cache key"""
+        return {
+            "temperature": 0.0,
+            "chunk_threshold": CHUNK_THRESHOLD_SECONDS,
+            "chunk_seconds": CHUNK_SECONDS,
+            "chunk_overlap": CHUNK_OVERLAP_SECONDS,
+        }
+    
+    def _transcribe_uncached(self, audio_file: str,
+                             progress_callback: Optional[Callable[[float], None]] = None,
+                             segment_callback: Optional[SegmentCallback] = None,
+                             cancel: Optional[CancelToken] = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Transcribe an audio file with whisper.cpp, splitting long recordings
+        
+        Args:
+            audio_file: Path to the audio file to transcribe
+            progress_callback: Called with the fraction of a long recording done
+            segment_callback: Called with each segment as soon as it is available
+            cancel: Token that stops the inference of every chunk
             
-            # Run whisper-cli with JSON output
-            cmd = [
-                str(self.whisper_cli),
-                "-m", str(self.model_path),
-                "-f", audio_file,
-                "-oj",  # Output JSON
-                "-of", os.path.splitext(json_file_path)[0]  # Output file path without extension
-            ]
+        Returns:
+            Tuple[bool, Dict]: Success status and transcription data or error message
+        """
+        duration = audio_duration(audio_file)
+        long_audio = CHUNK_THRESHOLD_SECONDS > 0 and (duration is None or duration > CHUNK_THRESHOLD_SECONDS)
+        
+        # 16 kHz mono PCM WAV goes to whisper as-is
+        if is_whisper_native(audio_file) and not long_audio:
+            return self._transcribe_single(audio_file, segment_callback, cancel)
+        
+        # Anything else is decoded and resampled in memory and handed to the
+        # engine as samples, without an intermediate file. Long recordings
+        # soundfile can read are decoded a chunk at a time as each one starts;
+        # only ffmpeg's formats have to be decoded whole.
+        try:
+            if long_audio and duration is not None:
+                samples = AudioReader(audio_file)
+            else:
+                with stage("decode"):
+                    samples = decode_audio(audio_file)
+        except AudioDecodeError as e:
+            return False, {"error": f"Transcription failed: {str(e)}"}
+        
+        try:
+            if CHUNK_THRESHOLD_SECONDS > 0 and len(samples) / SAMPLE_RATE > CHUNK_THRESHOLD_SECONDS:
+                return True, transcribe_chunked(
+                    samples,
+                    SAMPLE_RATE,
+                    partial(self.transcribe_samples, cancel=cancel),
+                    CHUNK_SECONDS,
+                    CHUNK_OVERLAP_SECONDS,
+                    self.parallelism(),
+                    progress_callback,
+                    segment_callback
+                )
+            return True, self.transcribe_samples(samples, segment_callback, cancel)
+        except TranscriptionCancelled as e:
+            return False, cancelled_result(e)
+        except ScratchFullError as e:
+            logger.error(f"Transcription error: {str(e)}")
+            return False, {"error": f"Transcription failed: {str(e)}", "status_code": e.status_code}
+        except Exception as e:
+            logger.error(f"Transcription error: {str(e)}")
+            return False, {"error": f"Transcription failed: {str(e)}"}
+    
+    def parallelism(self) -> int:
+        """Number of chunks of one recording to transcribe at the same time"""
+        if self.engine is not None and self.engine.is_running():
+            return self.engine.size
+        # As many whisper-cli runs as the layout has workers
+        return max(self.pool_size if self.pool_size > 0 else LAYOUT["workers"], 1)
+    
+    def transcribe_samples(self, samples: np.ndarray,
+                           segment_callback: Optional[SegmentCallback] = None,
+                           cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Transcribe 16 kHz mono samples held in memory
+        
+        Args:
+            samples: float32 samples in [-1, 1] or 16-bit PCM
+            segment_callback: Called with each segment as soon as it is available
+            cancel: Token that stops the inference when cancelled
             
-            logger.info(f"Running transcription: {' '.join(cmd)}")
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
-            )
+        Returns:
+            Dict: Transcription data
             
-            # Read the JSON output
-            with open(json_file_path, "r") as f:
-                transcription_data = json.load(f)
+        Raises:
+            TranscriptionError: If the transcription fails
+            TranscriptionCancelled: If the token was cancelled
+        """
+        return self._run_engine(samples, segment_callback, cancel)
+    
+    def _transcribe_single(self, audio_file: str,
+                           segment_callback: Optional[SegmentCallback] = None,
+                           cancel: Optional[CancelToken] = None) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Transcribe an audio file in one piece
+        
+        Args:
+            audio_file: Path to the audio file to transcribe
+            segment_callback: Called with each segment as soon as it is available
+            cancel: Token that stops the inference when cancelled
             
-            # Clean up the temporary file
-            os.unlink(json_file_path)
+        Returns:
+            Tuple[bool, Dict]: Success status and transcription data or error message
+        """
+        try:
+            return True, self._run_engine(audio_file, segment_callback, cancel)
+        except TranscriptionCancelled as e:
+            return False, cancelled_result(e)
+        except TranscriptionError as e:
+            return False, {"error": str(e)}
+    
+    def _run_engine(self, audio: Audio, segment_callback: Optional[SegmentCallback] = None,
+                    cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Transcribe on the resident engine, falling back to a one-off whisper-cli run
+        
+        Args:
+            audio: Path to an audio file or 16 kHz mono samples
+            segment_callback: Called with each segment as soon as it is available
+            cancel: Token that stops the inference when cancelled
             
-            # Extract the full text
-            full_text = " ".join([segment.get("text", "") for segment in transcription_data.get("segments", [])])
+        Returns:
+            Dict: Transcription data
             
-            return True, {
-                "text": full_text,
-                "segments": transcription_data.get("segments", []),
-                "language": transcription_data.get("language", "en")
-            }
-        
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Transcription process error: {e.stderr}")
-            return False, {"error": f"Transcription failed: {e.stderr}"}
+        Raises:
+            TranscriptionError: If whisper-cli fails as well
+            TranscriptionCancelled: If the token was cancelled
+        """
+        check(cancel)
+        engine = self.engine
+        if engine is not None and engine.is_running():
+            try:
+                with stage("inference"):
+                    return engine.transcribe(audio, segment_callback, cancel)
+            except EngineError as e:
+                # A cancelled request does not get a second run
+                check(cancel)
+                logger.warning(f"{engine.name} engine failed, falling back to whisper-cli: {str(e)}")
         
-        except Exception as e:
-            logger.error(f"Transcription error: {str(e)}")
-            return False, {"error": f"Transcription failed: {str(e)}"}
+        try:
+            with stage("inference"):
+                return self.cli.transcribe(audio, segment_callback, cancel)
+        except EngineError as e:
+            raise TranscriptionError(str(e))
     
     def check_status(self) -> Dict[str, Any]:
         """
@@ -157,9 +402,21 @@ class Transcriber:
             "whisper_cli_exists": self.whisper_cli.exists(),
             "model_exists": self.model_path.exists(),
             "model_name": self.model_name,
+            "engine": self.engine.status() if self.engine is not None else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
             "status": "ready" if self.whisper_cli.exists() and self.model_path.exists() else "not_ready"
         }
 
+def cancelled_result(e: TranscriptionCancelled) -> Dict[str, Any]:
+    """Error result for a cancelled transcription"""
+    return {"error": str(e), "cancelled": e.reason}
+
+def emit_segments(segments: List[Dict[str, Any]], segment_callback: Optional[SegmentCallback]):
+    """Forward finished segments to a segment callback"""
+    if segment_callback:
+        for segment in segments:
+            segment_callback(segment)
+
 # Singleton instance
 transcriber = Transcriber()
 
@@ -184,7 +441,52 @@ def check_status() -> Dict[str, Any]:
     """
     return transcriber.check_status()
 
+def run_batch_cli(directory: str, output: Optional[str], model_name: str, workers: Optional[int], resume: bool):
+    """
+    Transcribe every audio file under a directory into a JSONL file
+    
+    Args:
+        directory: Directory to scan for audio files
+        output: JSONL output path, defaults to transcriptions.jsonl in the directory
+        model_name: Name of the whisper model to use
+        workers: Number of files transcribed at the same time, defaults to the pool size
+        resume: Skip files already transcribed in the output file
+    """
+    import asyncio
+    from batch import Batch, find_audio_files
+    from dispatcher import Dispatcher
+    
+    output = output or os.path.join(directory, "transcriptions.jsonl")
+    items = [(os.path.relpath(path, directory), path) for path in find_audio_files(directory)]
+    
+    batch_transcriber = transcriber if model_name == transcriber.model_name else Transcriber(model_name)
+    batch_transcriber.start_engine()
+    try:
+        workers = workers or batch_transcriber.parallelism()
+        batch = Batch(items, output)
+        asyncio.run(batch.run(Dispatcher(max_concurrent=workers), batch_transcriber.transcribe,
+                              max_workers=workers, resume=resume))
+    finally:
+        batch_transcriber.stop_engine()
+    
+    print(f"Transcribed {batch.completed} files, {batch.failed} failed, "
+          f"{batch.skipped} already done. Results in {output}")
+
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Transcribe audio with whisper.cpp")
+    parser.add_argument("--batch", metavar="DIR", help="Transcribe every audio file under DIR")
+    parser.add_argument("--output", help="JSONL output file for --batch")
+    parser.add_argument("--model", default="base.en", help="Whisper model to use")
+    parser.add_argument("--workers", type=int, default=None, help="Files transcribed at the same time")
+    parser.add_argument("--no-resume", action="store_true", help="Transcribe files already in the output again")
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch_cli(args.batch, args.output, args.model, args.workers, not args.no_resume)
+        raise SystemExit(0)
+    
     # Simple test
     status = check_status()
     print(f"Transcriber status: {status}")
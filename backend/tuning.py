@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Split the machine's cores between whisper workers and threads per worker
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# whisper.cpp scales well up to about this many threads per inference
+PREFERRED_THREADS = 4
+
+
+def physical_cores() -> int:
+    """
+    Number of physical cores, without hyperthread siblings
+
+    Returns:
+        int: Physical cores, or the logical CPU count if it can't be told apart
+    """
+    logical = os.cpu_count() or 1
+    try:
+        with open("/proc/cpuinfo") as f:
+            cores = set()
+            physical_id = core_id = None
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key and core_id is not None:
+                    cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+        if cores:
+            return min(len(cores), logical)
+    except OSError:
+        pass
+
+    if platform.system() == "Darwin":
+        try:
+            result = subprocess.run(["sysctl", "-n", "hw.physicalcpu"], capture_output=True, text=True, check=True)
+            return max(int(result.stdout.strip()), 1)
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            pass
+    return logical
+
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """
+    CPU quota of the container this process runs in
+
+    Returns:
+        Optional[float]: CPUs the cgroup may use, None if unlimited or unknown
+    """
+    # cgroup v2: "max 100000" or "<quota> <period>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def detect_cpus() -> Dict[str, Any]:
+    """
+    Cores this process can actually use
+
+    Returns:
+        Dict: logical, physical, affinity and cgroup_limit counts and the
+            resulting number of usable cores
+    """
+    logical = os.cpu_count() or 1
+    physical = physical_cores()
+    affinity = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else logical
+    limit = cgroup_cpu_limit()
+
+    usable = min(physical, affinity)
+    if limit is not None:
+        usable = min(usable, max(math.floor(limit), 1))
+    return {
+        "logical": logical,
+        "physical": physical,
+        "affinity": affinity,
+        "cgroup_limit": limit,
+        "usable": max(usable, 1),
+    }
+
+
+def heuristic_layout(cores: int) -> Tuple[int, int]:
+    """
+    Workers and threads per worker for a number of cores, without measuring
+
+    Args:
+        cores: Usable cores
+
+    Returns:
+        Tuple[int, int]: Worker count and threads per worker
+    """
+    workers = max(cores // PREFERRED_THREADS, 1)
+    return workers, max(cores // workers, 1)
+
+
+def candidate_layouts(cores: int) -> List[Tuple[int, int]]:
+    """
+    Layouts worth measuring: every power-of-two thread count up to the core count
+
+    Args:
+        cores: Usable cores
+
+    Returns:
+        List[Tuple[int, int]]: Worker count and threads per worker
+    """
+    candidates = []
+    threads = 1
+    while threads <= cores:
+        candidates.append((cores // threads, threads))
+        threads *= 2
+    if (1, cores) not in candidates:
+        candidates.append((1, cores))
+    return candidates
+
+
+def load_tuning(path: str) -> Optional[Dict[str, Any]]:
+    """Read a tuning result written by save_tuning, None if missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_tuning(path: str, workers: int, threads: int, cpus: Dict[str, Any],
+                measurements: List[Dict[str, Any]], model: str):
+    """
+    Persist the best measured layout
+
+    Args:
+        path: JSON file to write
+        workers: Chosen worker count
+        threads: Chosen threads per worker
+        cpus: detect_cpus() at the time of measurement
+        measurements: Real-time factor of every candidate
+        model: Model the measurements were taken with
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "workers": workers,
+            "threads": threads,
+            "usable_cores": cpus["usable"],
+            "cpus": cpus,
+            "model": model,
+            "measured_at": time.time(),
+            "measurements": measurements,
+        }, f, indent=2)
+
+
+def choose_layout(tuning_path: str) -> Dict[str, Any]:
+    """
+    Pick the worker layout for this machine
+
+    A layout measured by `setup_whisper.py --tune` is used if it was taken
+    with the same number of usable cores, otherwise the cores are split into
+    workers of PREFERRED_THREADS threads each.
+
+    Args:
+        tuning_path: JSON file written by save_tuning
+
+    Returns:
+        Dict: workers, threads, source ("tuned" or "heuristic") and cpus
+    """
+    cpus = detect_cpus()
+    tuned = load_tuning(tuning_path) if tuning_path else None
+    if tuned and tuned.get("usable_cores") == cpus["usable"]:
+        return {
+            "workers": int(tuned["workers"]),
+            "threads": int(tuned["threads"]),
+            "source": "tuned",
+            "tuning_path": tuning_path,
+            "cpus": cpus,
+        }
+
+    workers, threads = heuristic_layout(cpus["usable"])
+    return {
+        "workers": workers,
+        "threads": threads,
+        "source": "heuristic",
+        "cpus": cpus,
+    }
+
+
+if __name__ == "__main__":
+    # Simple test
+    print(json.dumps(detect_cpus(), indent=2))
+    print(f"Heuristic layout: {heuristic_layout(detect_cpus()['usable'])}")
+    print(f"Candidates: {candidate_layouts(detect_cpus()['usable'])}")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Stream uploaded audio to disk in fixed-size chunks
+
+Routes using UploadRoute parse multipart bodies with ScratchMultiPartParser,
+which writes each file part straight into a scratch file as it arrives
+instead of Starlette's own spool file, so an upload is written once, checked
+against the size limit and scratch quotas while it is received, and
+rejected from its first bytes if the format is unsupported.
+"""
+import logging
+from typing import BinaryIO, List, Optional
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from audio_io import detect_format, ffmpeg_available
+from config import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+from metrics import stage
+from scratch import ScratchFullError, out_of_space_as_full, scratch
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Bytes needed to recognize an audio container
+HEADER_BYTES = 12
+
+# Containers decoded without ffmpeg
+NATIVE_FORMATS = ("wav", "flac", "ogg")
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def check_audio_header(header: bytes) -> str:
+    """
+    Recognize the uploaded audio format from its first bytes
+
+    Args:
+        header: The first HEADER_BYTES of the upload
+
+    Returns:
+        str: The detected format
+
+    Raises:
+        UploadError: If the format is unknown or needs ffmpeg, which is missing
+    """
+    audio_format = detect_format(header)
+    if audio_format is None:
+        raise UploadError("Unsupported audio format, upload WAV, FLAC or OGG", status_code=415)
+    if audio_format not in NATIVE_FORMATS and not ffmpeg_available():
+        raise UploadError(f"Decoding {audio_format} requires ffmpeg on the server", status_code=415)
+    return audio_format
+
+
+def copy_upload(source: BinaryIO, dest: BinaryIO, header: bytes, max_bytes: int = MAX_UPLOAD_BYTES,
+                chunk_size: int = UPLOAD_CHUNK_BYTES) -> int:
+    """
+    Copy an upload in fixed-size chunks
+
+    Args:
+        source: File object to read from, positioned after the header
+        dest: File object to write to
+        header: Bytes already read from source
+        max_bytes: Largest accepted upload
+        chunk_size: Bytes copied at a time
+
+    Returns:
+        int: Number of bytes copied
+
+    Raises:
+        UploadError: If the upload is too large
+    """
+    dest.write(header)
+    total = len(header)
+
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadError(f"Upload exceeds the {max_bytes} byte limit", status_code=413)
+        dest.write(chunk)
+    return total
+
+
+class ScratchPart:
+    """
+    File part of a multipart body, written to a scratch file as it arrives
+
+    Stands in for the SpooledTemporaryFile behind an UploadFile. The first
+    HEADER_BYTES are held back until the format is known, then the scratch
+    file is created with the matching suffix. The file is removed on close
+    unless save_upload() took it over.
+    """
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = min(max_bytes, scratch.request_bytes)
+        self.path: Optional[str] = None
+        self.size = 0
+        self.claimed = False
+        self._header = b""
+        self._file: Optional[BinaryIO] = None
+
+    def write(self, data: bytes):
+        """
+        Append data from the request body
+
+        Raises:
+            UploadError: If the format is unsupported, or the part exceeds the
+                size limit or the scratch quotas
+        """
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadError(f"Upload exceeds the {self.max_bytes} byte limit", status_code=413)
+        if self._file is None:
+            self._header += data
+            if len(self._header) < HEADER_BYTES:
+                return
+            self._open()
+            data, self._header = self._header, b""
+        try:
+            scratch.resize(self.path, self.size)
+            with out_of_space_as_full():
+                self._file.write(data)
+        except ScratchFullError as e:
+            raise UploadError(str(e), status_code=e.status_code)
+
+    def _open(self):
+        """Create the scratch file once the format is known from the header"""
+        audio_format = check_audio_header(self._header)
+        try:
+            self.path = scratch.create(f".{audio_format}")
+        except ScratchFullError as e:
+            raise UploadError(str(e), status_code=e.status_code)
+        self._file = open(self.path, "wb")
+
+    def seek(self, offset: int):
+        # Called by the parser once the part is complete
+        if self._file is not None:
+            try:
+                with out_of_space_as_full():
+                    self._file.flush()
+            except ScratchFullError as e:
+                raise UploadError(str(e), status_code=e.status_code)
+
+    def claim(self) -> str:
+        """
+        Take over the finished scratch file
+
+        Returns:
+            str: Path to the file, now owned by the caller
+
+        Raises:
+            UploadError: If the part was too short to recognize its format
+        """
+        try:
+            with out_of_space_as_full():
+                if self._file is None:
+                    # Shorter than HEADER_BYTES, rejected unless the format is still recognized
+                    self._open()
+                    self._file.write(self._header)
+                self._file.close()
+        except ScratchFullError as e:
+            raise UploadError(str(e), status_code=e.status_code)
+        self.claimed = True
+        return self.path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self.path is not None and not self.claimed:
+            scratch.remove(self.path)
+
+
+class ScratchMultiPartParser(MultiPartParser):
+    """Multipart parser that writes file parts into scratch files, see ScratchPart"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parts: List[ScratchPart] = []
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None:
+            # Starlette created a spool file for the part, which is still empty
+            upload.file.close()
+            self._files_to_close_on_error.remove(upload.file)
+            upload.file = ScratchPart()
+            self.parts.append(upload.file)
+
+
+class UploadRequest(Request):
+    """Request whose multipart bodies are parsed with ScratchMultiPartParser"""
+
+    async def _get_form(self, *, max_files: int = 1000, max_fields: int = 1000):
+        if self._form is None and self.headers.get("content-type", "").startswith("multipart/form-data"):
+            parser = ScratchMultiPartParser(self.headers, self.stream(), max_files=max_files, max_fields=max_fields)
+            try:
+                self._form = await parser.parse()
+            except BaseException as e:
+                for part in parser.parts:
+                    await run_in_threadpool(part.close)
+                if isinstance(e, UploadError):
+                    raise HTTPException(status_code=e.status_code, detail=str(e))
+                if isinstance(e, MultiPartException):
+                    raise HTTPException(status_code=400, detail=e.message)
+                raise
+        return await super()._get_form(max_files=max_files, max_fields=max_fields)
+
+
+class UploadRoute(APIRoute):
+    """Route class that streams uploads into scratch space while the body is read"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def upload_handler(request: Request):
+            return await handler(UploadRequest(request.scope, request.receive))
+        return upload_handler
+
+
+async def save_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """
+    Save an uploaded file to scratch space without holding it in memory
+
+    Files parsed through UploadRoute are already in scratch and are taken
+    over as they are. Others are copied: the format is checked from the
+    first bytes before anything is written, and the declared size is
+    counted against the scratch quotas up front.
+
+    Args:
+        file: The uploaded file
+        max_bytes: Largest accepted upload
+
+    Returns:
+        str: Path to the saved file, owned by the caller and removed with scratch.remove()
+
+    Raises:
+        UploadError: If the upload is rejected or scratch space is full
+    """
+    if isinstance(file.file, ScratchPart):
+        return await run_in_threadpool(file.file.claim)
+
+    with stage("upload"):
+        header = await run_in_threadpool(file.file.read, HEADER_BYTES)
+        audio_format = check_audio_header(header)
+
+        try:
+            temp_file_path = scratch.create(f".{audio_format}", size=file.size or 0)
+        except ScratchFullError as e:
+            raise UploadError(str(e), status_code=e.status_code)
+        try:
+            with out_of_space_as_full(), open(temp_file_path, "wb") as temp_file:
+                # The copy blocks on disk I/O, keep it off the event loop
+                size = await run_in_threadpool(copy_upload, file.file, temp_file, header,
+                                               min(max_bytes, scratch.request_bytes))
+            scratch.resize(temp_file_path, size)
+        except ScratchFullError as e:
+            scratch.remove(temp_file_path)
+            raise UploadError(str(e), status_code=e.status_code)
+        except BaseException:
+            scratch.remove(temp_file_path)
+            raise
+    return temp_file_path
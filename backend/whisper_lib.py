@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+ctypes bindings for the parts of libwhisper the library engine uses
+
+The structs mirror whisper.h of whisper.cpp 1.7.x up to the last field this
+module touches. Parameters are always obtained from the library's
+whisper_*_default_params() so fields added after that point keep the values
+the library chose, and each struct carries spare room for them: a struct of
+this size is passed and returned through memory on every supported ABI, so
+the library only ever reads or writes the prefix it knows.
+"""
+import ctypes
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import WHISPER_CPP_DIR, WHISPER_LIBRARY
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Room for fields newer whisper.cpp releases append to the parameter structs
+RESERVED_BYTES = 512
+
+WHISPER_SAMPLING_GREEDY = 0
+
+# Where the shared library ends up in a whisper.cpp build directory
+LIBRARY_CANDIDATES = [
+    Path("build") / "src" / "libwhisper.so",
+    Path("build") / "src" / "libwhisper.dylib",
+    Path("build") / "bin" / "whisper.dll",
+    Path("build") / "bin" / "Release" / "whisper.dll",
+]
+
+# Callbacks, see whisper.h
+NEW_SEGMENT_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+PROGRESS_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p)
+ENCODER_BEGIN_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p)
+ABORT_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_void_p)
+
+
+class WhisperLibraryError(Exception):
+    """Raised when libwhisper cannot be loaded or a call into it fails"""
+
+
+class WhisperAheads(ctypes.Structure):
+    _fields_ = [
+        ("n_heads", ctypes.c_size_t),
+        ("heads", ctypes.c_void_p),
+    ]
+
+
+class WhisperContextParams(ctypes.Structure):
+    _fields_ = [
+        ("use_gpu", ctypes.c_bool),
+        ("flash_attn", ctypes.c_bool),
+        ("gpu_device", ctypes.c_int),
+        ("dtw_token_timestamps", ctypes.c_bool),
+        ("dtw_aheads_preset", ctypes.c_int),
+        ("dtw_n_top", ctypes.c_int),
+        ("dtw_aheads", WhisperAheads),
+        ("dtw_mem_size", ctypes.c_size_t),
+        ("_reserved", ctypes.c_uint8 * RESERVED_BYTES),
+    ]
+
+
+class GreedyParams(ctypes.Structure):
+    _fields_ = [("best_of", ctypes.c_int)]
+
+
+class BeamSearchParams(ctypes.Structure):
+    _fields_ = [
+        ("beam_size", ctypes.c_int),
+        ("patience", ctypes.c_float),
+    ]
+
+
+class WhisperFullParams(ctypes.Structure):
+    _fields_ = [
+        ("strategy", ctypes.c_int),
+        ("n_threads", ctypes.c_int),
+        ("n_max_text_ctx", ctypes.c_int),
+        ("offset_ms", ctypes.c_int),
+        ("duration_ms", ctypes.c_int),
+        ("translate", ctypes.c_bool),
+        ("no_context", ctypes.c_bool),
+        ("no_timestamps", ctypes.c_bool),
+        ("single_segment", ctypes.c_bool),
+        ("print_special", ctypes.c_bool),
+        ("print_progress", ctypes.c_bool),
+        ("print_realtime", ctypes.c_bool),
+        ("print_timestamps", ctypes.c_bool),
+        ("token_timestamps", ctypes.c_bool),
+        ("thold_pt", ctypes.c_float),
+        ("thold_ptsum", ctypes.c_float),
+        ("max_len", ctypes.c_int),
+        ("split_on_word", ctypes.c_bool),
+        ("max_tokens", ctypes.c_int),
+        ("debug_mode", ctypes.c_bool),
+        ("audio_ctx", ctypes.c_int),
+        ("tdrz_enable", ctypes.c_bool),
+        ("suppress_regex", ctypes.c_char_p),
+        ("initial_prompt", ctypes.c_char_p),
+        ("prompt_tokens", ctypes.c_void_p),
+        ("prompt_n_tokens", ctypes.c_int),
+        ("language", ctypes.c_char_p),
+        ("detect_language", ctypes.c_bool),
+        ("suppress_blank", ctypes.c_bool),
+        ("suppress_nst", ctypes.c_bool),
+        ("temperature", ctypes.c_float),
+        ("max_initial_ts", ctypes.c_float),
+        ("length_penalty", ctypes.c_float),
+        ("temperature_inc", ctypes.c_float),
+        ("entropy_thold", ctypes.c_float),
+        ("logprob_thold", ctypes.c_float),
+        ("no_speech_thold", ctypes.c_float),
+        ("greedy", GreedyParams),
+        ("beam_search", BeamSearchParams),
+        ("new_segment_callback", NEW_SEGMENT_CALLBACK),
+        ("new_segment_callback_user_data", ctypes.c_void_p),
+        ("progress_callback", PROGRESS_CALLBACK),
+        ("progress_callback_user_data", ctypes.c_void_p),
+        ("encoder_begin_callback", ENCODER_BEGIN_CALLBACK),
+        ("encoder_begin_callback_user_data", ctypes.c_void_p),
+        ("abort_callback", ABORT_CALLBACK),
+        ("abort_callback_user_data", ctypes.c_void_p),
+        ("logits_filter_callback", ctypes.c_void_p),
+        ("logits_filter_callback_user_data", ctypes.c_void_p),
+        ("grammar_rules", ctypes.c_void_p),
+        ("n_grammar_rules", ctypes.c_size_t),
+        ("i_start_rule", ctypes.c_size_t),
+        ("grammar_penalty", ctypes.c_float),
+        ("_reserved", ctypes.c_uint8 * RESERVED_BYTES),
+    ]
+
+
+def find_library(whisper_cpp_dir: str = WHISPER_CPP_DIR) -> Optional[Path]:
+    """
+    Locate libwhisper
+
+    Returns:
+        Optional[Path]: SCRIBLY_WHISPER_LIBRARY if set, else the first shared
+            library found in the whisper.cpp build, None if there is none
+    """
+    if WHISPER_LIBRARY:
+        return Path(WHISPER_LIBRARY)
+    for candidate in LIBRARY_CANDIDATES:
+        path = Path(whisper_cpp_dir) / candidate
+        if path.exists():
+            return path
+    # Versioned names such as libwhisper.so.1
+    matches = sorted((Path(whisper_cpp_dir) / "build").glob("**/libwhisper.so*"))
+    return matches[0] if matches else None
+
+
+class WhisperLibrary:
+    """A loaded libwhisper with typed function prototypes"""
+
+    def __init__(self, path: Path):
+        """
+        Load the shared library
+
+        Args:
+            path: Path to libwhisper.so, libwhisper.dylib or whisper.dll
+
+        Raises:
+            WhisperLibraryError: If the library cannot be loaded
+        """
+        self.path = Path(path)
+        try:
+            # The ggml libraries built alongside are found next to libwhisper
+            if sys.platform == "win32" and hasattr(os, "add_dll_directory"):
+                os.add_dll_directory(str(self.path.parent))
+            self.lib = ctypes.CDLL(str(self.path))
+        except OSError as e:
+            raise WhisperLibraryError(f"Failed to load {self.path}: {str(e)}")
+
+        lib = self.lib
+        lib.whisper_context_default_params.argtypes = []
+        lib.whisper_context_default_params.restype = WhisperContextParams
+        lib.whisper_init_from_file_with_params_no_state.argtypes = [ctypes.c_char_p, WhisperContextParams]
+        lib.whisper_init_from_file_with_params_no_state.restype = ctypes.c_void_p
+        lib.whisper_init_state.argtypes = [ctypes.c_void_p]
+        lib.whisper_init_state.restype = ctypes.c_void_p
+        lib.whisper_free_state.argtypes = [ctypes.c_void_p]
+        lib.whisper_free_state.restype = None
+        lib.whisper_free.argtypes = [ctypes.c_void_p]
+        lib.whisper_free.restype = None
+        lib.whisper_full_default_params.argtypes = [ctypes.c_int]
+        lib.whisper_full_default_params.restype = WhisperFullParams
+        lib.whisper_full_with_state.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, WhisperFullParams, ctypes.POINTER(ctypes.c_float), ctypes.c_int
+        ]
+        lib.whisper_full_with_state.restype = ctypes.c_int
+        lib.whisper_full_n_segments_from_state.argtypes = [ctypes.c_void_p]
+        lib.whisper_full_n_segments_from_state.restype = ctypes.c_int
+        lib.whisper_full_get_segment_t0_from_state.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.whisper_full_get_segment_t0_from_state.restype = ctypes.c_int64
+        lib.whisper_full_get_segment_t1_from_state.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.whisper_full_get_segment_t1_from_state.restype = ctypes.c_int64
+        lib.whisper_full_get_segment_text_from_state.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.whisper_full_get_segment_text_from_state.restype = ctypes.c_char_p
+        lib.whisper_full_lang_id_from_state.argtypes = [ctypes.c_void_p]
+        lib.whisper_full_lang_id_from_state.restype = ctypes.c_int
+        lib.whisper_lang_str.argtypes = [ctypes.c_int]
+        lib.whisper_lang_str.restype = ctypes.c_char_p
+
+        self.version = None
+        if hasattr(lib, "whisper_version"):
+            lib.whisper_version.argtypes = []
+            lib.whisper_version.restype = ctypes.c_char_p
+            self.version = lib.whisper_version().decode()
+            if not self.version.startswith("1.7."):
+                logger.warning(f"libwhisper {self.version} may not match the 1.7.x struct layout")
+
+    def init_context(self, model_path: Path, use_gpu: bool = False) -> int:
+        """
+        Load a model without any decoding state
+
+        Args:
+            model_path: Path to the ggml model
+            use_gpu: Let whisper.cpp use a GPU backend if it was built with one
+
+        Returns:
+            int: Context handle, shared by every state created from it
+        """
+        params = self.lib.whisper_context_default_params()
+        params.use_gpu = use_gpu
+        ctx = self.lib.whisper_init_from_file_with_params_no_state(str(model_path).encode(), params)
+        if not ctx:
+            raise WhisperLibraryError(f"Failed to load model {model_path}")
+        return ctx
+
+    def init_state(self, ctx: int) -> int:
+        """Allocate the decoding state (KV cache, mel, results) for one request at a time"""
+        state = self.lib.whisper_init_state(ctx)
+        if not state:
+            raise WhisperLibraryError("Failed to allocate a whisper state")
+        return state
+
+    def free_state(self, state: int):
+        self.lib.whisper_free_state(state)
+
+    def free(self, ctx: int):
+        self.lib.whisper_free(ctx)
+
+    def full(self, ctx: int, state: int, samples: np.ndarray, threads: int,
+             segment_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+             abort: Optional[Callable[[], bool]] = None) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Run the full encoder and decoder on 16 kHz mono float32 samples
+
+        Args:
+            ctx: Context from init_context
+            state: State from init_state, not in use by any other call
+            samples: Mono float32 samples in [-1, 1]
+            threads: Inference threads
+            segment_callback: Called with each segment as whisper.cpp finishes it
+            abort: Polled during inference, returning True stops it
+
+        Returns:
+            Tuple[List[Dict], str]: Segments and the detected or configured language
+        """
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        segments: List[Dict[str, Any]] = []
+
+        def read_segments(upto: int):
+            for index in range(len(segments), upto):
+                text = self.lib.whisper_full_get_segment_text_from_state(state, index) or b""
+                segment = {
+                    "id": index,
+                    "start": self.lib.whisper_full_get_segment_t0_from_state(state, index) / 100.0,
+                    "end": self.lib.whisper_full_get_segment_t1_from_state(state, index) / 100.0,
+                    "text": text.decode("utf-8", errors="replace"),
+                }
+                segments.append(segment)
+                if segment_callback:
+                    segment_callback(segment)
+
+        def on_new_segment(_ctx, callback_state, n_new, _user_data):
+            # Exceptions can't cross into C, keep them here
+            try:
+                read_segments(self.lib.whisper_full_n_segments_from_state(callback_state))
+            except Exception as e:
+                logger.error(f"Segment callback failed: {str(e)}")
+
+        def on_abort(_user_data):
+            try:
+                return bool(abort())
+            except Exception:
+                return False
+
+        params = self.lib.whisper_full_default_params(WHISPER_SAMPLING_GREEDY)
+        params.n_threads = threads
+        params.print_progress = False
+        params.print_realtime = False
+        params.print_timestamps = False
+        # Kept referenced until whisper_full returns
+        new_segment = NEW_SEGMENT_CALLBACK(on_new_segment)
+        params.new_segment_callback = new_segment
+        abort_callback = ABORT_CALLBACK(on_abort) if abort else None
+        if abort_callback is not None:
+            params.abort_callback = abort_callback
+
+        # ctypes releases the GIL for the call, so requests on other states run in parallel
+        status = self.lib.whisper_full_with_state(
+            ctx, state, params, samples.ctypes.data_as(ctypes.POINTER(ctypes.c_float)), len(samples)
+        )
+        if status != 0:
+            raise WhisperLibraryError(f"whisper_full_with_state failed with status {status}")
+
+        # Segments the callback did not see, e.g. from a single-segment run
+        read_segments(self.lib.whisper_full_n_segments_from_state(state))
+        language = self.lib.whisper_lang_str(self.lib.whisper_full_lang_id_from_state(state))
+        return segments, language.decode() if language else "en"
+
+
+if __name__ == "__main__":
+    # Simple test
+    path = find_library()
+    if path is None:
+        print("libwhisper not found. Build whisper.cpp with BUILD_SHARED_LIBS=ON.")
+    else:
+        library = WhisperLibrary(path)
+        print(f"Loaded {library.path} (version {library.version or 'unknown'})")
+        print(f"whisper_full_params: {ctypes.sizeof(WhisperFullParams)} bytes with reserve")
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Pool of resident whisper-server workers that keep the model loaded
+"""
+import io
+import os
+import socket
+import subprocess
+import threading
+import queue
+import time
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Union
+
+import requests
+
+from config import (
+    POOL_SIZE, WORKER_THREADS, HEALTH_CHECK_INTERVAL, WORKER_STARTUP_TIMEOUT, WORKER_REQUEST_TIMEOUT,
+    WORKER_TIMEOUT_FACTOR, WHISPER_CPP_DIR,
+)
+from audio_io import audio_duration
+from cancellation import CancelToken, check
+from metrics import observe_whisper_output
+from segments import to_result
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Path to the whisper-server executable
+WHISPER_SERVER = Path(WHISPER_CPP_DIR) / "build" / "bin" / "whisper-server"
+
+# Seconds to wait for a worker to accept the connection
+CONNECT_TIMEOUT = 5.0
+
+# Seconds between cancel token checks while waiting for an idle worker
+ACQUIRE_POLL_INTERVAL = 0.1
+
+
+class WorkerError(Exception):
+    """Raised when a worker cannot serve a request"""
+
+
+class WorkerTimeout(WorkerError):
+    """Raised when a worker did not answer in time and was killed"""
+
+
+def request_timeout(audio: Union[str, bytes]) -> float:
+    """
+    Seconds a worker may take to answer a request for this audio
+
+    Args:
+        audio: Path to a WAV file or the WAV file content
+
+    Returns:
+        float: SCRIBLY_WORKER_REQUEST_TIMEOUT plus the allowance for the audio length
+    """
+    duration = audio_duration(io.BytesIO(audio) if isinstance(audio, bytes) else audio)
+    return WORKER_REQUEST_TIMEOUT + WORKER_TIMEOUT_FACTOR * (duration or 0.0)
+
+
+def find_free_port() -> int:
+    """Ask the OS for a free local TCP port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class WhisperServerWorker:
+    """A single whisper-server process with the model loaded once"""
+
+    def __init__(self, worker_id: int, model_path: Path, threads: int = WORKER_THREADS,
+                 server_path: Path = WHISPER_SERVER):
+        """
+        Initialize the worker
+
+        Args:
+            worker_id: Index of the worker in its pool
+            model_path: Path to the ggml model to load
+            threads: Number of threads whisper-server uses for inference
+            server_path: Path to the whisper-server executable
+        """
+        self.worker_id = worker_id
+        self.model_path = Path(model_path)
+        self.threads = threads
+        self.server_path = Path(server_path)
+        self.port = None
+        self.process = None
+        self.restarts = 0
+        self.requests_served = 0
+        # Held while the worker serves a request or is being restarted
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def is_alive(self) -> bool:
+        """Check if the worker process is running"""
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, timeout: float = WORKER_STARTUP_TIMEOUT) -> bool:
+        """
+        Start the whisper-server process and wait until it serves requests
+
+        Args:
+            timeout: Seconds to wait for the model to load
+
+        Returns:
+            bool: True if the worker is ready, False otherwise
+        """
+        self.port = find_free_port()
+        cmd = [
+            str(self.server_path),
+            "-m", str(self.model_path),
+            "-t", str(self.threads),
+            "--host", "127.0.0.1",
+            "--port", str(self.port),
+        ]
+
+        logger.info(f"Starting worker {self.worker_id}: {' '.join(cmd)}")
+        try:
+            self.process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+        except OSError as e:
+            logger.error(f"Failed to start worker {self.worker_id}: {str(e)}")
+            self.process = None
+            return False
+
+        # Drain stderr so the process never blocks on a full pipe
+        threading.Thread(target=self._drain_stderr, args=(self.process,), daemon=True).start()
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.is_alive():
+                logger.error(f"Worker {self.worker_id} exited during startup")
+                return False
+            if self.health_check():
+                logger.info(f"Worker {self.worker_id} ready on port {self.port}")
+                return True
+            time.sleep(0.2)
+
+        logger.error(f"Worker {self.worker_id} did not become ready within {timeout}s")
+        self.stop()
+        return False
+
+    def _drain_stderr(self, process: subprocess.Popen):
+        """Read the worker's stderr, forward it to the debug log and record its timings"""
+        for line in process.stderr:
+            logger.debug(f"worker {self.worker_id}: {line.rstrip()}")
+            observe_whisper_output(line)
+
+    def stop(self):
+        """Stop the whisper-server process"""
+        if self.process is None:
+            return
+
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            # Force kill if it doesn't terminate gracefully
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def kill(self):
+        """Kill the process right away, abandoning the request it is serving"""
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def restart(self) -> bool:
+        """Restart the worker after a crash or failed health check"""
+        logger.warning(f"Restarting worker {self.worker_id}")
+        self.stop()
+        self.restarts += 1
+        return self.start()
+
+    def health_check(self, timeout: float = 2.0) -> bool:
+        """
+        Check that the worker process is alive and answering HTTP requests
+
+        Args:
+            timeout: Seconds to wait for the response
+
+        Returns:
+            bool: True if the worker is healthy
+        """
+        if not self.is_alive():
+            return False
+        try:
+            response = requests.get(self.url, timeout=timeout)
+            return response.status_code < 500
+        except requests.RequestException:
+            return False
+
+    def transcribe(self, audio: Union[str, bytes], params: Optional[Dict[str, Any]] = None,
+                   timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Transcribe audio on this worker
+
+        A worker that does not answer within the timeout is killed, since
+        whisper-server would otherwise keep working on the request.
+
+        Args:
+            audio: Path to a WAV file or the WAV file content
+            params: Extra whisper-server inference parameters
+            timeout: Seconds to wait for the answer, derived from the audio length if None
+
+        Returns:
+            Dict: text, segments and language
+
+        Raises:
+            WorkerTimeout: If the worker did not answer in time
+        """
+        if timeout is None:
+            timeout = request_timeout(audio)
+        if not self.is_alive():
+            raise WorkerError(f"Worker {self.worker_id} is not running")
+
+        data = {"response_format": "verbose_json", "temperature": "0.0"}
+        if params:
+            data.update({key: str(value) for key, value in params.items()})
+
+        try:
+            if isinstance(audio, bytes):
+                response = requests.post(
+                    f"{self.url}/inference",
+                    files={"file": ("audio.wav", audio, "audio/wav")},
+                    data=data,
+                    timeout=(CONNECT_TIMEOUT, timeout),
+                )
+            else:
+                with open(audio, "rb") as f:
+                    response = requests.post(
+                        f"{self.url}/inference",
+                        files={"file": (os.path.basename(audio), f, "audio/wav")},
+                        data=data,
+                        timeout=(CONNECT_TIMEOUT, timeout),
+                    )
+        except requests.Timeout:
+            self.kill()
+            raise WorkerTimeout(f"Worker {self.worker_id} did not answer within {timeout:.0f}s")
+        except requests.RequestException as e:
+            raise WorkerError(f"Worker {self.worker_id} request failed: {str(e)}")
+
+        if response.status_code != 200:
+            raise WorkerError(f"Worker {self.worker_id} returned HTTP {response.status_code}: {response.text}")
+
+        transcription_data = response.json()
+        if "error" in transcription_data:
+            raise WorkerError(f"Worker {self.worker_id} error: {transcription_data['error']}")
+
+        self.requests_served += 1
+        return to_result(transcription_data)
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for this worker"""
+        return {
+            "id": self.worker_id,
+            "alive": self.is_alive(),
+            "busy": self.lock.locked(),
+            "port": self.port,
+            "threads": self.threads,
+            "restarts": self.restarts,
+            "requests_served": self.requests_served,
+        }
+
+
+class WorkerPool:
+    """Fixed-size pool of whisper-server workers with health checks"""
+
+    def __init__(self, model_path: Path, size: int = POOL_SIZE, threads: int = WORKER_THREADS,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL,
+                 server_path: Path = WHISPER_SERVER):
+        """
+        Initialize the pool
+
+        Args:
+            model_path: Path to the ggml model every worker loads
+            size: Number of workers
+            threads: Number of threads per worker
+            health_check_interval: Seconds between health checks
+            server_path: Path to the whisper-server executable
+        """
+        self.model_path = Path(model_path)
+        self.size = size
+        self.threads = threads
+        self.health_check_interval = health_check_interval
+        self.server_path = Path(server_path)
+        self.workers: List[WhisperServerWorker] = []
+        self._idle = queue.Queue()
+        self._stop_event = threading.Event()
+        self._monitor = None
+
+    def start(self) -> bool:
+        """
+        Start all workers and the health monitor
+
+        Returns:
+            bool: True if at least one worker is ready
+        """
+        if not self.server_path.exists():
+            logger.error(f"whisper-server not found at {self.server_path}")
+            return False
+
+        self._stop_event.clear()
+        self._idle = queue.Queue()
+        self.workers = [
+            WhisperServerWorker(i, self.model_path, self.threads, self.server_path)
+            for i in range(self.size)
+        ]
+
+        # Start the workers in parallel so the model loads overlap
+        results = [False] * self.size
+
+        def start_worker(worker):
+            results[worker.worker_id] = worker.start()
+
+        threads = [threading.Thread(target=start_worker, args=(w,)) for w in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for worker in self.workers:
+            self._idle.put(worker)
+
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._monitor.start()
+
+        ready = sum(results)
+        logger.info(f"Worker pool started with {ready}/{self.size} workers ready")
+        return ready > 0
+
+    def stop(self):
+        """Stop the health monitor and all workers"""
+        self._stop_event.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=5)
+            self._monitor = None
+        for worker in self.workers:
+            with worker.lock:
+                worker.stop()
+
+    def is_running(self) -> bool:
+        """Check if the pool has been started and has a live worker"""
+        return not self._stop_event.is_set() and any(w.is_alive() for w in self.workers)
+
+    @contextmanager
+    def acquire(self, timeout: Optional[float] = None, cancel: Optional[CancelToken] = None):
+        """
+        Borrow an idle worker for the duration of the block
+
+        The wait is done in short slices so a cancelled token or a stopped
+        pool ends it even while every worker is busy.
+
+        Args:
+            timeout: Seconds to wait for a worker, None to wait until cancelled
+            cancel: Token that abandons the wait when cancelled
+
+        Raises:
+            WorkerError: If no worker became idle in time or the pool stopped
+            TranscriptionCancelled: If the token was cancelled
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            check(cancel)
+            if self._stop_event.is_set():
+                raise WorkerError("Worker pool is stopped")
+            wait = ACQUIRE_POLL_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WorkerError("No idle worker available")
+                wait = min(wait, remaining)
+            try:
+                worker = self._idle.get(timeout=wait)
+                break
+            except queue.Empty:
+                continue
+
+        try:
+            with worker.lock:
+                yield worker
+        finally:
+            self._idle.put(worker)
+
+    def transcribe(self, audio: Union[str, bytes], params: Optional[Dict[str, Any]] = None,
+                   cancel: Optional[CancelToken] = None) -> Dict[str, Any]:
+        """
+        Transcribe audio on the next idle worker
+
+        A worker that crashed is restarted and the request retried once.
+        Cancelling the token, or a worker not answering in time, kills the
+        worker, which is then restarted by the health check or the next
+        request that gets it.
+
+        Args:
+            audio: Path to a WAV file or the WAV file content
+            params: Extra whisper-server inference parameters
+            cancel: Token that abandons the request when cancelled
+
+        Returns:
+            Dict: text, segments and language
+
+        Raises:
+            TranscriptionCancelled: If the token was cancelled
+        """
+        timeout = request_timeout(audio)
+        with self.acquire(cancel=cancel) as worker:
+            check(cancel)
+            if not worker.is_alive() and not worker.restart():
+                raise WorkerError(f"Worker {worker.worker_id} could not be restarted")
+            # whisper-server has no way to stop a request, so the process goes
+            unregister = cancel.on_cancel(worker.kill) if cancel is not None else None
+            try:
+                return worker.transcribe(audio, params, timeout)
+            except WorkerTimeout:
+                check(cancel)
+                raise
+            except WorkerError:
+                check(cancel)
+                if worker.is_alive():
+                    raise
+                # The process died mid-request, restart and retry once
+                if not worker.restart():
+                    raise
+                return worker.transcribe(audio, params, timeout)
+            finally:
+                if unregister is not None:
+                    unregister()
+
+    def _monitor_loop(self):
+        """Periodically restart idle workers that crashed or stopped answering"""
+        while not self._stop_event.wait(self.health_check_interval):
+            for worker in self.workers:
+                # Skip workers that are serving a request
+                if not worker.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if self._stop_event.is_set():
+                        break
+                    if not worker.health_check():
+                        worker.restart()
+                finally:
+                    worker.lock.release()
+
+    def status(self) -> Dict[str, Any]:
+        """Status information for the pool"""
+        return {
+            "size": self.size,
+            "threads_per_worker": self.threads,
+            "model_path": str(self.model_path),
+            "idle": self._idle.qsize(),
+            "workers": [worker.status() for worker in self.workers],
+        }